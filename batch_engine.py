@@ -0,0 +1,287 @@
+import os
+import uuid
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from batch_report import COUNT_KEYS
+from batch_journal import row_fingerprint
+from image_index import ImageIndex
+from template_model import Template
+
+class RenderTarget:
+    """1つのテンプレートの描画先（テンプレート・エンコーダ・出力フォルダ・差分処理のマニフェスト・再開用のジャーナル）
+
+    1回のバッチで複数のテンプレートに描画する場合は、テンプレートごとに1つ作成する。
+    compiledにはコンパイル済みテンプレートを入れる（並列処理ではワーカーごとにコンパイルする）。
+    temp_tagは出力の一時ファイル名に含める名前（出力フォルダを共有するシャードどうしで見分ける）。
+    """
+
+    def __init__(self, name, template, encoder, output_folder, manifest=None, journal=None, temp_tag=None):
+        self.name = name
+        self.template = Template.coerce(template)
+        self.encoder = encoder
+        self.output_folder = output_folder
+        self.manifest = manifest
+        self.journal = journal
+        self.temp_tag = temp_tag
+        self.resumed = 0
+        self.compiled = None
+
+    def for_worker(self):
+        """ワーカープロセスに渡す複製（マニフェスト・ジャーナル・コンパイル済みテンプレートは渡さない）"""
+        return RenderTarget(self.name, self.template, self.encoder, self.output_folder, temp_tag=self.temp_tag)
+
+class BatchRun:
+    """バッチ処理1回分の状態（件数の集計と進捗通知）を保持する
+
+    streamはこのバッチのログの書き出し先（省略時は標準出力）。
+    """
+
+    def __init__(self, image_folder, targets, total, progress_callback=None, report=None, image_index=None, shard=None, cancel=None, stream=None):
+        self.image_folder = image_folder
+        self.stream = stream
+        self.shard = shard
+        self.cancel = cancel
+        self.image_index = image_index if image_index is not None else ImageIndex(image_folder)
+        self.targets = targets
+        self.total = total
+        self.progress_callback = progress_callback
+        self.report = report
+        self.processed = 0
+        self.errors = 0
+        self.skipped = 0
+        self.counters = {}
+
+    def tasks(self, rows):
+        """CSVの行から描画タスクを生成（画像が用意できない行はここでエラーとして数える）"""
+        for index, product_data in rows:
+            if self.cancelled:
+                # 中止: 新しい行は投入しない（投入済みの行は集計する）
+                return
+
+            if self.shard is not None and not self.shard.claim(index, product_data):
+                # 他のシャードが処理する行（差分処理でこの行の出力を削除しないようにする）
+                for target in self.targets:
+                    if target.manifest is not None:
+                        target.manifest.mark_seen(product_data.get('id', index))
+                continue
+
+            # 商品画像を索引から探す（image_fileが空ならIDと同じ名前の画像）
+            image_file = product_data.get('image_file', '')
+            product_image_path = self.image_index.find(image_file, product_data.get('id', index))
+            if product_image_path is None:
+                # CSVには残っている行なので、差分処理で前回の出力を削除しない
+                for target in self.targets:
+                    if target.manifest is not None:
+                        target.manifest.keep_previous(product_data.get('id', index))
+                if not image_file:
+                    self._record_error(product_data.get('id', index), "image_fileが指定されていません")
+                    continue
+                missing_path = os.path.join(self.image_folder, str(image_file))
+                print(f"画像ファイルが見つかりません: {missing_path}", file=self.stream)
+                self._record_error(product_data.get('id', index), f"画像ファイルが見つかりません: {missing_path}")
+                continue
+
+            task = {
+                "index": index,
+                "id": product_data.get('id', index),
+                "data": product_data,
+                "image_path": product_image_path
+            }
+
+            task["targets"] = [i for i, target in enumerate(self.targets) if self._needs_render(target, task)]
+            if not task["targets"]:
+                self.skipped += 1
+                self._notify_progress()
+                continue
+
+            yield task
+
+    @property
+    def cancelled(self):
+        """中止が要求されたか（cancelはthreading.Event）"""
+        return self.cancel is not None and self.cancel.is_set()
+
+    def _needs_render(self, target, task):
+        """描画先でこの行を描画する必要があるか"""
+        # 差分処理: 前回から入力が変わっていない描画先は描画しない
+        if target.manifest is not None and target.manifest.check(task):
+            return False
+
+        # 再開: 中断した実行で同じ入力から描画済みの行は描画しない（差分処理のマニフェストにはその出力を記録する）
+        # 行データか商品画像が変わっていればジャーナルの出力は使わずに描画し直す
+        outputs = target.journal.outputs(task["id"], row_fingerprint(task)) if target.journal is not None else None
+        if outputs is not None:
+            if target.manifest is not None:
+                target.manifest.record(task, outputs)
+            target.resumed += 1
+            return False
+        return True
+
+    def finish(self, task, result):
+        """描画結果を集計して進捗を通知"""
+        if result["ok"]:
+            self.processed += 1
+            stats = result.get("stats", {})
+            for key in COUNT_KEYS:
+                if key in stats:
+                    self.counters[key] = self.counters.get(key, 0) + stats[key]
+            for i, outputs in result["outputs"].items():
+                if self.targets[i].manifest is not None:
+                    self.targets[i].manifest.record(task, outputs)
+                if self.targets[i].journal is not None:
+                    self.targets[i].journal.record(task["id"], outputs, row_fingerprint(task))
+            if self.report is not None:
+                self.report.record_row(task, stats)
+            self._notify_progress()
+        else:
+            print(f"処理エラー（ID: {task['id']}）: {result['error']}", file=self.stream)
+            self._record_error(task["id"], result["error"])
+
+    def _record_error(self, task_id, error):
+        """エラー件数を数え、レポートに記録"""
+        self.errors += 1
+        if self.report is not None:
+            self.report.record_failure(task_id, error)
+
+    def _notify_progress(self):
+        """進捗コールバック（差分処理で省略した行も完了として数える）"""
+        if self.progress_callback:
+            self.progress_callback(self.processed + self.skipped, self.total)
+
+def load_task_images(processor, task, targets, stats=None, stream=None):
+    """タスクの描画先で使う商品画像を読み込む（元画像のデコードは全テンプレートで1回だけ）
+
+    読み込めなかった場合は商品画像なしで合成するようNoneを並べて返す。
+    """
+    templates = [targets[i].compiled for i in task["targets"]]
+    try:
+        return processor.load_product_images(task["image_path"], templates, stats)
+    except Exception as e:
+        print(f"商品画像の処理エラー: {e}", file=stream)
+        return [None] * len(templates)
+
+def render_task(processor, task, targets, stream=None):
+    """1行分のテンプレート適用と保存を行い、結果を辞書で返す（出力は描画先の番号ごと、警告はstreamに書き出す）"""
+    stats = {}
+    try:
+        outputs = {}
+        for i, prod_img in zip(task["targets"], load_task_images(processor, task, targets, stats, stream)):
+            target = targets[i]
+
+            # テンプレート適用
+            result_image = processor.compose(prod_img, task["data"], target.compiled, stats, stream)
+
+            # 設定された形式でエンコードして保存（ファイル名はIDから生成）
+            outputs[i] = target.encoder.save(result_image, target.output_folder, str(task["id"]), stats, target.temp_tag)
+
+        return {"ok": True, "outputs": outputs, "stats": stats}
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+def run_sequential(processor, run, rows):
+    """全行を現在のプロセスで順番に処理"""
+    for task in run.tasks(rows):
+        run.finish(task, render_task(processor, task, run.targets, run.stream))
+
+# ワーカープロセスごとの状態（プロセス内でのみ共有）
+_worker_processor = None
+_worker_targets = None
+_worker_jobs = OrderedDict()
+
+# 常駐ワーカーが保持するジョブ（コンパイル済みテンプレート）の件数
+WARM_WORKER_JOBS = 4
+
+def _init_worker(targets, font_dirs=None, product_cache=None, compositor="pil"):
+    """ワーカープロセスの初期化（フォントキャッシュとコンパイル済みテンプレートはワーカーごとに持つ）"""
+    global _worker_processor, _worker_targets
+    from image_processor import ImageProcessor
+    from font_resolver import FontResolver
+
+    # 代用フォントの警告は親プロセスで表示済み
+    _worker_processor = ImageProcessor(FontResolver(font_dirs, report_fallbacks=False), product_cache, compositor=compositor)
+    for target in targets:
+        target.compiled = _worker_processor.compile_template(target.template)
+    _worker_targets = targets
+
+def _render_in_worker(task):
+    """ワーカープロセス内で1行分を描画"""
+    return render_task(_worker_processor, task, _worker_targets)
+
+def _run_in_pool(run, rows, submit, max_pending):
+    """タスクをプールに投入し、結果を行順に集計する（投入済みで未集計のタスク数を制限してメモリ使用量を抑える）"""
+    pending = deque()
+    for task in run.tasks(rows):
+        pending.append((task, submit(task)))
+        if len(pending) >= max_pending:
+            done_task, future = pending.popleft()
+            run.finish(done_task, future.result())
+
+    while pending:
+        done_task, future = pending.popleft()
+        run.finish(done_task, future.result())
+
+def run_parallel(run, rows, workers, font_dirs=None, product_cache=None, compositor="pil"):
+    """プロセスプールで並列処理（結果は行順に集計するので出力は逐次処理と同じ）"""
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=([target.for_worker() for target in run.targets], font_dirs, product_cache, compositor)
+    ) as executor:
+        _run_in_pool(run, rows, lambda task: executor.submit(_render_in_worker, task), workers * 4)
+
+def _init_warm_worker(font_dirs=None, product_cache=None, compositor="pil"):
+    """常駐ワーカーの初期化（フォント・デコード済みの素材はジョブをまたいで保持する）"""
+    global _worker_processor
+    from image_processor import ImageProcessor
+    from font_resolver import FontResolver
+    from template_compiler import AssetCache
+
+    _worker_processor = ImageProcessor(FontResolver(font_dirs, report_fallbacks=False), product_cache, AssetCache(), compositor)
+
+def _render_in_warm_worker(job_key, targets, task):
+    """常駐ワーカー内で1行分を描画（テンプレートはジョブごとに最初の1行でコンパイルする）"""
+    compiled = _worker_jobs.get(job_key)
+    if compiled is None:
+        for target in targets:
+            target.compiled = _worker_processor.compile_template(target.template)
+        compiled = _worker_jobs[job_key] = targets
+        if len(_worker_jobs) > WARM_WORKER_JOBS:
+            _worker_jobs.popitem(last=False)
+    return render_task(_worker_processor, task, compiled)
+
+class WarmPool:
+    """ジョブをまたいで使い回すワーカープロセスのプール（常駐するレンダーサーバー用）
+
+    run_parallelはバッチごとにプロセスを起動するが、このプールのワーカーは
+    Pillowの読み込み・フォント・デコード済みの背景や装飾画像を保持したまま次のジョブを処理する。
+    """
+
+    def __init__(self, workers, font_dirs=None, product_cache=None, compositor="pil"):
+        self.workers = workers
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_warm_worker,
+            initargs=(font_dirs, product_cache, compositor)
+        )
+
+    def run(self, run, rows):
+        """BatchRunの全タスクを処理"""
+        job_key = uuid.uuid4().hex
+        targets = [target.for_worker() for target in run.targets]
+        _run_in_pool(
+            run, rows,
+            lambda task: self.executor.submit(_render_in_warm_worker, job_key, targets, task),
+            self.workers * 4
+        )
+
+    def shutdown(self):
+        """ワーカープロセスを終了"""
+        self.executor.shutdown(cancel_futures=True)
+
+def resolve_workers(workers):
+    """ワーカー数を解決（0以下はCPUコア数）"""
+    if workers is None:
+        return 1
+    if workers <= 0:
+        return os.cpu_count() or 1
+    return workers
@@ -0,0 +1,141 @@
+import os
+import json
+import time
+from batch_manifest import hash_data, hash_template
+from image_encoder import is_temp_file
+
+# 出力フォルダに保存するジャーナルのファイル名
+JOURNAL_FILENAME = ".journal.jsonl"
+
+# この件数か時間（秒）ごとにまとめてディスクに書き込む
+DEFAULT_SYNC_ROWS = 200
+DEFAULT_SYNC_INTERVAL = 2.0
+
+def row_fingerprint(task):
+    """行データと商品画像（パス・サイズ・更新日時）のハッシュ（タスクに記録して描画先のジャーナルで共有する）"""
+    if "row_fingerprint" not in task:
+        stat = os.stat(task["image_path"])
+        task["row_fingerprint"] = hash_data([task["data"], task["image_path"], stat.st_size, stat.st_mtime_ns])
+    return task["row_fingerprint"]
+
+class BatchJournal:
+    """描画が終わった行を追記していくジャーナル（中断したバッチを途中から再開するため）
+
+    1行に1件、ID・出力したファイル名・行の入力のハッシュ（row_fingerprint）をJSONで追記する。
+    出力ファイルは一時ファイルから置き換えて保存するので、ジャーナルにある行の出力は
+    必ず完全なファイルになっている。再開時に行データか商品画像が変わっていた行は描画し直す。
+    書き込みは一定件数か一定時間ごとにまとめてfsyncするので、異常終了したときに
+    失われるのは最後の書き込み以降の行だけで、それらは再開時にもう一度描画する。
+    テンプレート・参照している画像ファイル・出力設定が変わっていれば、再開せずに最初から処理する。
+    再開時に消す中断した書き込みの一時ファイルは、temp_tag（シャード名）が同じものだけに限る
+    （出力フォルダを共有する他のシャードが書き込み中の一時ファイルは消さない）。
+    """
+
+    def __init__(self, output_folder, template, encoder=None, resume=False, filename=JOURNAL_FILENAME,
+                 sync_rows=DEFAULT_SYNC_ROWS, sync_interval=DEFAULT_SYNC_INTERVAL, clock=time.monotonic, temp_tag=None, stream=None):
+        self.output_folder = output_folder
+        self.stream = stream
+        self.temp_tag = temp_tag
+        self.path = os.path.join(output_folder, filename)
+        self.sync_rows = sync_rows
+        self.sync_interval = sync_interval
+        self.clock = clock
+        self.signature = hash_template(template, encoder)
+
+        self.completed = self._load() if resume else None
+        if self.completed is None:
+            self.completed = {}
+            self._file = open(self.path, 'w', encoding='utf-8')
+            self._file.write(json.dumps({"signature": self.signature}) + "\n")
+            self.sync()
+        else:
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._unsynced = 0
+        self._last_sync = self.clock()
+
+    def __len__(self):
+        return len(self.completed)
+
+    def outputs(self, task_id, fingerprint=None):
+        """前回の実行で同じ入力から描画済みならその出力ファイル名のリスト（未処理か入力が変わっていればNone）"""
+        entry = self.completed.get(str(task_id))
+        if entry is None or entry["fingerprint"] != fingerprint:
+            return None
+        return entry["outputs"]
+
+    def record(self, task_id, outputs, fingerprint=None):
+        """描画に成功した行を追記（ディスクへの書き込みはまとめて行う）"""
+        entry = {"id": str(task_id), "outputs": outputs, "fingerprint": fingerprint}
+        self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self._unsynced += 1
+        if self._unsynced >= self.sync_rows or self.clock() - self._last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        """書き込み済みの行をディスクに反映"""
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+        self._last_sync = self.clock()
+
+    def close(self):
+        """書き込んでいない行をディスクに反映して閉じる"""
+        if self._file.closed:
+            return
+        self.sync()
+        self._file.close()
+
+    def discard(self):
+        """全件処理できたのでジャーナルを削除する"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _load(self):
+        """前回のジャーナルを読み込む（再開できなければNone）"""
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            print(f"再開できるジャーナルがないため最初から処理します: {self.output_folder}", file=self.stream)
+            return None
+
+        # 書き込み途中で止まった最後の行は捨てる（続きを追記できるよう切り詰める）
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+        lines = data[:end].decode('utf-8').splitlines()
+
+        try:
+            header = json.loads(lines[0]) if lines else {}
+        except ValueError:
+            header = {}
+        if not isinstance(header, dict) or header.get("signature") != self.signature:
+            print(f"テンプレート・素材画像か出力設定が変わったため最初から処理します: {self.output_folder}", file=self.stream)
+            return None
+
+        completed = {}
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+                completed[entry["id"]] = {"outputs": entry["outputs"], "fingerprint": entry.get("fingerprint")}
+            except (ValueError, KeyError, TypeError):
+                continue
+
+        # 出力ファイルが消されている行は描画し直す（出力フォルダは1回だけ走査する）
+        existing = set()
+        with os.scandir(self.output_folder) as it:
+            for entry in it:
+                if is_temp_file(entry.name, self.temp_tag):
+                    # 中断した書き込みの一時ファイル
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+                else:
+                    existing.add(entry.name)
+        return {
+            task_id: entry for task_id, entry in completed.items()
+            if all(filename in existing for filename in entry["outputs"])
+        }
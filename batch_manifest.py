@@ -0,0 +1,173 @@
+import os
+import json
+import hashlib
+from template_model import Template
+
+# 出力フォルダに保存するマニフェストのファイル名
+MANIFEST_FILENAME = ".manifest.json"
+
+def hash_file(path):
+    """ファイル内容のSHA-1を計算"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_data(data):
+    """JSONに変換できるデータのSHA-1を計算（キーの順序に依存しない）"""
+    text = json.dumps(data, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def hash_template(template, encoder=None):
+    """テンプレート本体・参照している画像ファイル・出力設定のハッシュ"""
+    template = Template.coerce(template)
+    assets = []
+    if template.background:
+        assets.append(template.background)
+    for image_element in template.image_elements:
+        assets.append(image_element.path)
+
+    asset_hashes = []
+    for path in assets:
+        try:
+            asset_hashes.append(hash_file(path))
+        except OSError:
+            asset_hashes.append(None)
+
+    output_config = encoder.config if encoder is not None else None
+    return hash_data({"template": template.to_dict(), "assets": asset_hashes, "output": output_config})
+
+class BatchManifest:
+    """差分処理用に、IDごとの入力のハッシュと出力ファイルを記録する
+
+    入力は「行データ」「商品画像ファイル」「テンプレートと参照している画像」の3つで、
+    前回の実行から変わっていない行は描画を省略する。CSVから消えたIDの出力は削除する。
+    """
+
+    def __init__(self, output_folder, template, encoder=None, filename=MANIFEST_FILENAME, stream=None):
+        self.output_folder = output_folder
+        self.stream = stream
+        self.path = os.path.join(output_folder, filename)
+
+        previous = self._load()
+        self.previous_entries = previous.get("entries", {})
+        self.previous_images = previous.get("images", {})
+
+        self.template_hash = hash_template(template, encoder)
+        self.entries = {}
+        self.images = {}
+        self.seen_ids = set()
+        self.skipped = 0
+        self.removed = 0
+
+    def _load(self):
+        """前回のマニフェストを読み込む"""
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"マニフェストの読み込みに失敗しました（全件を再処理します）: {e}", file=self.stream)
+            return {}
+
+    def _hash_image(self, path, known_hash=None):
+        """商品画像のハッシュ（サイズと更新日時が前回と同じなら前回の値を使う）
+
+        known_hashには同じ行で別のマニフェストが計算したハッシュを渡せる。
+        """
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+
+        cached = self.images.get(path) or self.previous_images.get(path)
+        if cached and cached[:2] == signature:
+            image_hash = cached[2]
+        elif known_hash is not None:
+            image_hash = known_hash
+        else:
+            image_hash = hash_file(path)
+
+        self.images[path] = signature + [image_hash]
+        return image_hash
+
+    def fingerprint(self, task):
+        """行の入力全体のハッシュ（商品画像のハッシュはタスクに記録して他のマニフェストと共有する）"""
+        task["image_hash"] = self._hash_image(task["image_path"], task.get("image_hash"))
+        return hash_data([
+            hash_data(task["data"]),
+            task["image_hash"],
+            self.template_hash
+        ])
+
+    def check(self, task):
+        """前回から入力が変わっていなければTrue（recordで使うfingerprintはタスクに控えておく）
+
+        同じIDの行が複数あっても、先読みした行どうしで控えが混ざらないようタスクごとに持つ
+        （1つのタスクを複数のマニフェストで判定するので、マニフェストのパスごとに分ける）。
+        """
+        key = str(task["id"])
+        self.seen_ids.add(key)
+        fingerprint = self.fingerprint(task)
+        task.setdefault("fingerprints", {})[self.path] = fingerprint
+
+        entry = self.previous_entries.get(key)
+        if not entry or entry["fingerprint"] != fingerprint:
+            return False
+
+        # 出力ファイルが消されていれば再処理
+        for filename in entry["outputs"]:
+            if not os.path.exists(os.path.join(self.output_folder, filename)):
+                return False
+
+        self.entries[key] = entry
+        self.skipped += 1
+        return True
+
+    def mark_seen(self, task_id):
+        """他のシャードが処理するIDを記録（CSVから消えたIDとして出力を削除しないようにする）"""
+        self.seen_ids.add(str(task_id))
+
+    def keep_previous(self, task_id):
+        """描画できなかった行の前回の出力を残す（商品画像が一時的に見つからない場合など）
+
+        CSVにあるIDとして記録し、前回のエントリをそのまま引き継ぐので、
+        次の実行で画像が戻れば差分を比較し、IDがCSVから消えれば出力を削除できる。
+        """
+        key = str(task_id)
+        self.seen_ids.add(key)
+        previous = self.previous_entries.get(key)
+        if previous is not None and key not in self.entries:
+            self.entries[key] = previous
+
+    def record(self, task, outputs):
+        """描画に成功した行を記録（出力形式の変更で不要になった前回の出力は削除）"""
+        key = str(task["id"])
+        previous = self.previous_entries.get(key)
+        if previous:
+            for filename in previous["outputs"]:
+                output_path = os.path.join(self.output_folder, filename)
+                if filename not in outputs and os.path.exists(output_path):
+                    os.remove(output_path)
+
+        self.entries[key] = {
+            "fingerprint": task["fingerprints"][self.path],
+            "outputs": outputs
+        }
+
+    def save(self):
+        """CSVから消えたIDの出力を削除し、マニフェストを保存"""
+        for key, entry in self.previous_entries.items():
+            if key in self.seen_ids:
+                continue
+            for filename in entry["outputs"]:
+                output_path = os.path.join(self.output_folder, filename)
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+            self.removed += 1
+
+        # 書き込み途中で中断しても壊れないよう一時ファイルから置き換える
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"entries": self.entries, "images": self.images}, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
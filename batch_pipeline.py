@@ -0,0 +1,140 @@
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from batch_engine import load_task_images
+
+class StageStats:
+    """パイプラインの1段分の処理時間の集計"""
+
+    def __init__(self, name, threads):
+        self.name = name
+        self.threads = threads
+        self.busy = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        """1件分の処理時間を加算"""
+        with self._lock:
+            self.busy += seconds
+            self.count += 1
+
+    def utilization(self, elapsed):
+        """稼働率（処理時間の合計 ÷ 経過時間 × スレッド数）"""
+        if elapsed <= 0:
+            return 0.0
+        return self.busy / (elapsed * self.threads)
+
+class BatchPipeline:
+    """読み込み → 合成 → 保存 の3段パイプラインでバッチ処理する
+
+    商品画像のデコードは読み込みスレッドで先読みし、合成は呼び出し元のスレッドで
+    行順に、エンコードと保存は保存スレッドで行う。段の間のキューは件数に上限を
+    設けているので、遅い段があっても前段が待たされてメモリ使用量は一定に保たれる。
+    """
+
+    def __init__(self, readers=2, writers=2, queue_size=16):
+        self.readers = max(1, readers)
+        self.writers = max(1, writers)
+        self.queue_size = max(1, queue_size)
+        self.stages = []
+        self.elapsed = 0.0
+
+    def run(self, processor, run, rows):
+        """BatchRunの全タスクをパイプラインで処理（描画先のテンプレートはコンパイル済みであること）"""
+        read_stats = StageStats("読み込み", self.readers)
+        compose_stats = StageStats("合成", 1)
+        write_stats = StageStats("保存", self.writers)
+        self.stages = [read_stats, compose_stats, write_stats]
+
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        result_queue = queue.Queue()
+        started = time.perf_counter()
+
+        def decode(task):
+            """商品画像を読み込む（読み込めなければ商品画像なしで合成する）"""
+            start = time.perf_counter()
+            try:
+                return load_task_images(processor, task, run.targets, task["stats"], run.stream)
+            finally:
+                read_stats.add(time.perf_counter() - start)
+
+        def write():
+            """合成済みの画像をエンコードして保存"""
+            while True:
+                item = write_queue.get()
+                if item is None:
+                    break
+                task, images = item
+                start = time.perf_counter()
+                try:
+                    outputs = {}
+                    for i, image in zip(task["targets"], images):
+                        target = run.targets[i]
+                        outputs[i] = target.encoder.save(image, target.output_folder, str(task["id"]), task["stats"], target.temp_tag)
+                    result_queue.put((task, {"ok": True, "outputs": outputs, "stats": task["stats"]}))
+                except Exception as e:
+                    result_queue.put((task, {"ok": False, "error": str(e)}))
+                write_stats.add(time.perf_counter() - start)
+
+        def drain():
+            """保存が終わった結果を集計（BatchRunはこのスレッドからだけ触る）"""
+            while True:
+                try:
+                    task, result = result_queue.get_nowait()
+                except queue.Empty:
+                    return
+                run.finish(task, result)
+
+        def compose(task, future):
+            """先読みした商品画像を描画先ごとに合成して保存キューへ渡す"""
+            prod_imgs = future.result()
+            start = time.perf_counter()
+            try:
+                images = [
+                    processor.compose(prod_img, task["data"], run.targets[i].compiled, task["stats"], run.stream)
+                    for i, prod_img in zip(task["targets"], prod_imgs)
+                ]
+            except Exception as e:
+                compose_stats.add(time.perf_counter() - start)
+                run.finish(task, {"ok": False, "error": str(e)})
+                return
+            compose_stats.add(time.perf_counter() - start)
+
+            # 保存キューが一杯なら空くまで待つ
+            write_queue.put((task, images))
+            drain()
+
+        writer_threads = [threading.Thread(target=write, daemon=True) for _ in range(self.writers)]
+        for thread in writer_threads:
+            thread.start()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.readers) as reader_pool:
+                # 先読み中の商品画像の件数を制限
+                pending = deque()
+                for task in run.tasks(rows):
+                    # 行ごとの計測値（各段のスレッドが順に書き込む）
+                    task["stats"] = {}
+                    pending.append((task, reader_pool.submit(decode, task)))
+                    if len(pending) >= self.queue_size:
+                        compose(*pending.popleft())
+
+                while pending:
+                    compose(*pending.popleft())
+        finally:
+            for _ in writer_threads:
+                write_queue.put(None)
+            for thread in writer_threads:
+                thread.join()
+            drain()
+
+        self.elapsed = time.perf_counter() - started
+
+    def summary(self):
+        """各段の稼働率を表す文字列"""
+        return " / ".join(
+            f"{stage.name} {stage.utilization(self.elapsed) * 100:.0f}%" for stage in self.stages
+        )
@@ -0,0 +1,41 @@
+import sys
+import json
+import time
+
+# 画面の更新間隔（秒）。進捗がこれより細かく届いても間引いて表示する
+UI_FRAME_INTERVAL = 0.1
+
+def emit_event(event, stream=None):
+    """進捗イベントを1行のJSONとして書き出す（受け取る側がすぐ読めるよう毎回flushする）"""
+    stream = stream or sys.stdout
+    stream.write(json.dumps(event, ensure_ascii=False) + "\n")
+    stream.flush()
+
+def parse_event(line):
+    """JSON Lines形式の進捗イベントなら辞書を、通常のログ行ならNoneを返す"""
+    line = line.strip()
+    if not line.startswith("{"):
+        return None
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(event, dict) or "event" not in event:
+        return None
+    return event
+
+class FrameThrottle:
+    """画面更新を一定の間隔に間引く"""
+
+    def __init__(self, interval=UI_FRAME_INTERVAL, clock=time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self.last = None
+
+    def ready(self):
+        """前回の更新から間隔が空いていればTrue（Trueを返したときを更新時刻とする）"""
+        now = self.clock()
+        if self.last is not None and now - self.last < self.interval:
+            return False
+        self.last = now
+        return True
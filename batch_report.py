@@ -0,0 +1,160 @@
+import json
+import math
+import time
+import heapq
+from array import array
+
+# 行ごとの計測値のうちバイト数を表すキー（それ以外は処理時間の秒数）
+BYTE_KEYS = ("bytes_read", "bytes_written")
+
+# 行ごとの計測値のうち件数を表すキー（BatchRunが合計し、キャッシュの統計として記録する）
+COUNT_KEYS = ("text_cache_hits", "text_cache_misses", "product_cache_hits", "product_cache_misses")
+
+# レポートに詳細を残す失敗行の上限（件数はすべて数える）
+MAX_FAILURE_DETAILS = 1000
+
+def add_time(stats, key, start):
+    """計測用の辞書に start からの経過秒数を加算（statsがNoneなら何もしない）"""
+    if stats is not None:
+        stats[key] = stats.get(key, 0.0) + time.perf_counter() - start
+
+def add_bytes(stats, key, size):
+    """計測用の辞書にバイト数を加算（statsがNoneなら何もしない）"""
+    if stats is not None:
+        stats[key] = stats.get(key, 0) + size
+
+def add_count(stats, key, count=1):
+    """計測用の辞書に件数を加算（statsがNoneなら何もしない）"""
+    if stats is not None:
+        stats[key] = stats.get(key, 0) + count
+
+def percentile(sorted_values, ratio):
+    """ソート済みの値から百分位数を求める（最近傍順位法）"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, math.ceil(ratio * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+class BatchReport:
+    """バッチ処理の計測結果を集計し、JSONのレポートとして出力する
+
+    段（decode, resize, paste, text, layers, encode, write）ごとの処理時間、
+    読み書きしたバイト数、失敗した行、処理に時間のかかった行を記録する。
+    eventsにファイルを渡すと、処理中の出来事をJSON Lines形式で逐次書き出す。
+    """
+
+    def __init__(self, events=None, slowest=10):
+        self.events = events
+        self.slowest_count = slowest
+        self.stage_times = {}
+        self.row_times = array('d')
+        self.slowest = []
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.failures = []
+        self.failure_count = 0
+        self.caches = {}
+        self.shard = None
+        self.summary = {}
+        self.started = time.perf_counter()
+
+    def start(self, total=None):
+        """計測を開始"""
+        self.started = time.perf_counter()
+        self.emit({"event": "start", "total": total})
+
+    def emit(self, event):
+        """イベントを1行のJSONとして書き出す"""
+        if self.events is None:
+            return
+        self.events.write(json.dumps(event, ensure_ascii=False, default=str) + "\n")
+        self.events.flush()
+
+    def record_row(self, task, stats):
+        """描画に成功した1行分の計測値を記録"""
+        row_total = 0.0
+        for key, value in stats.items():
+            if key in BYTE_KEYS:
+                setattr(self, key, getattr(self, key) + value)
+            elif key in COUNT_KEYS:
+                continue
+            else:
+                self.stage_times.setdefault(key, array('d')).append(value)
+                row_total += value
+        self.row_times.append(row_total)
+
+        # 処理時間の長い行を上位だけ保持
+        entry = (row_total, str(task["id"]))
+        if len(self.slowest) < self.slowest_count:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+        self.emit({"event": "row", "id": task["id"], "ok": True, "seconds": round(row_total, 6)})
+
+    def record_failure(self, task_id, error):
+        """失敗した行を記録"""
+        self.failure_count += 1
+        if len(self.failures) < MAX_FAILURE_DETAILS:
+            self.failures.append({"id": task_id, "error": error})
+        self.emit({"event": "row", "id": task_id, "ok": False, "error": error})
+
+    def record_cache(self, name, hits, misses, **details):
+        """キャッシュのヒット数・ミス数を記録"""
+        self.caches[name] = dict({"hits": hits, "misses": misses}, **details)
+
+    def record_shard(self, shard):
+        """分担して処理した場合のシャードの情報（担当したIDを含む）を記録"""
+        self.shard = shard
+
+    def finish(self, processed, errors, skipped=0):
+        """件数と経過時間を記録"""
+        self.summary = {
+            "processed": processed,
+            "errors": errors,
+            "skipped": skipped,
+            "elapsed": time.perf_counter() - self.started
+        }
+        self.emit(dict({"event": "end"}, **self.summary))
+
+    def _describe(self, values):
+        """処理時間の統計値"""
+        ordered = sorted(values)
+        count = len(ordered)
+        total = sum(ordered)
+        return {
+            "count": count,
+            "total": total,
+            "mean": total / count if count else 0.0,
+            "p50": percentile(ordered, 0.50),
+            "p90": percentile(ordered, 0.90),
+            "p99": percentile(ordered, 0.99),
+            "max": ordered[-1] if ordered else 0.0
+        }
+
+    def to_dict(self):
+        """レポートを辞書で返す"""
+        elapsed = self.summary.get("elapsed", 0.0)
+        processed = self.summary.get("processed", 0)
+        report = {
+            "summary": dict(self.summary, rows_per_second=processed / elapsed if elapsed else 0.0),
+            "rows": self._describe(self.row_times),
+            "stages": {stage: self._describe(values) for stage, values in self.stage_times.items()},
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "caches": self.caches,
+            "slowest": [
+                {"id": task_id, "seconds": seconds}
+                for seconds, task_id in sorted(self.slowest, reverse=True)
+            ],
+            "failure_count": self.failure_count,
+            "failures": self.failures
+        }
+        if self.shard is not None:
+            report["shard"] = self.shard
+        return report
+
+    def save(self, path):
+        """レポートをJSONファイルに保存"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=4, ensure_ascii=False)
@@ -0,0 +1,168 @@
+import os
+import glob
+import json
+import zlib
+import heapq
+from collections import Counter
+
+# 行の割り当て方法
+SHARD_MODES = ("hash", "range")
+
+# シャードごとのレポートの既定のファイル名（出力先フォルダに保存）
+REPORT_PATTERN = "report.shard-*-of-*.json"
+
+class Shard:
+    """複数のマシンで1つのCSVを分担するときの、このプロセスの担当分
+
+    indexは1から始まる番号、countは全体の数。担当する行は調整役なしで決まる：
+    hashはIDの安定したハッシュ（CRC32）で割り当て、CSVの行が増減しても他の行の担当は
+    変わらない。rangeは行番号の連続した範囲を割り当てる（total_rowsが必要）。
+    """
+
+    def __init__(self, index, count, mode="hash", total_rows=None):
+        if count < 1 or not 1 <= index <= count:
+            raise ValueError(f"シャードの指定が不正です: {index}/{count}（1〜{count}で指定してください）")
+        if mode not in SHARD_MODES:
+            raise ValueError(f"シャードの割り当て方法が不正です: {mode}")
+        self.index = index
+        self.count = count
+        self.mode = mode
+        self.total_rows = total_rows
+        self.ids = []
+
+    @classmethod
+    def parse(cls, text, mode="hash", total_rows=None):
+        """"K/N" 形式の指定から作成"""
+        try:
+            index, count = (int(part) for part in text.split("/"))
+        except ValueError:
+            raise ValueError(f"シャードはK/Nの形式で指定してください: {text}")
+        return cls(index, count, mode, total_rows)
+
+    @property
+    def label(self):
+        """ファイル名に使う名前（例: shard-1-of-4）"""
+        return f"shard-{self.index}-of-{self.count}"
+
+    def filename(self, filename):
+        """シャードごとのファイル名（.manifest.json → .manifest.shard-1-of-4.json）"""
+        stem, ext = os.path.splitext(filename)
+        return f"{stem}.{self.label}{ext}"
+
+    def owns(self, row_number, product_data):
+        """この行を担当するか"""
+        if self.mode == "range":
+            if self.total_rows is None:
+                raise ValueError("rangeで割り当てるには行数が必要です")
+            start = self.total_rows * (self.index - 1) // self.count
+            end = self.total_rows * self.index // self.count
+            return start <= row_number < end
+        task_id = str(product_data.get('id', row_number))
+        return zlib.crc32(task_id.encode('utf-8')) % self.count == self.index - 1
+
+    def claim(self, row_number, product_data):
+        """担当する行ならIDを記録してTrue（記録したIDは結合時の抜け・重複の確認に使う）"""
+        if not self.owns(row_number, product_data):
+            return False
+        self.ids.append(str(product_data.get('id', row_number)))
+        return True
+
+    def filter(self, rows):
+        """(行番号, 行データ) の組から担当する行だけを返す（IDは記録しない）"""
+        return ((row_number, product_data) for row_number, product_data in rows if self.owns(row_number, product_data))
+
+    def to_dict(self):
+        """レポートに記録する内容"""
+        return {"index": self.index, "count": self.count, "mode": self.mode, "ids": self.ids}
+
+def find_reports(paths):
+    """レポートのファイルパスのリストに展開（フォルダは中のシャードのレポートすべて）"""
+    reports = []
+    for path in paths:
+        if os.path.isdir(path):
+            reports.extend(sorted(glob.glob(os.path.join(path, REPORT_PATTERN))))
+        else:
+            reports.append(path)
+    return reports
+
+def _merge_stats(values):
+    """段ごとの処理時間の統計を結合（百分位数は結合できないので件数・合計・平均・最大のみ）"""
+    count = sum(value.get("count", 0) for value in values)
+    total = sum(value.get("total", 0.0) for value in values)
+    return {
+        "count": count,
+        "total": total,
+        "mean": total / count if count else 0.0,
+        "max": max((value.get("max", 0.0) for value in values), default=0.0)
+    }
+
+def merge_reports(reports, expected_ids=None):
+    """シャードごとのレポート（辞書）を1つに結合し、抜けと重複を確認する
+
+    抜けは、レポートのないシャード番号と、expected_ids（CSVの全ID）のうち
+    どのシャードも担当していないID。重複は複数回担当されたID。
+    """
+    shards = [report.get("shard") for report in reports]
+    if any(shard is None for shard in shards):
+        raise ValueError("シャードの情報がないレポートは結合できません")
+    counts = {shard["count"] for shard in shards}
+    modes = {shard["mode"] for shard in shards}
+    if len(counts) != 1 or len(modes) != 1:
+        raise ValueError("シャードの数か割り当て方法が異なるレポートは結合できません")
+    count = counts.pop()
+
+    indexes = Counter(shard["index"] for shard in shards)
+    ids = Counter(task_id for shard in shards for task_id in shard["ids"])
+    summaries = [report.get("summary", {}) for report in reports]
+    processed = sum(summary.get("processed", 0) for summary in summaries)
+    elapsed = max((summary.get("elapsed", 0.0) for summary in summaries), default=0.0)
+
+    caches = {}
+    for report in reports:
+        for name, cache in report.get("caches", {}).items():
+            merged = caches.setdefault(name, {"hits": 0, "misses": 0})
+            merged["hits"] += cache.get("hits", 0)
+            merged["misses"] += cache.get("misses", 0)
+
+    stage_names = sorted({name for report in reports for name in report.get("stages", {})})
+    slowest = heapq.nlargest(
+        max((len(report.get("slowest", [])) for report in reports), default=0),
+        (entry for report in reports for entry in report.get("slowest", [])),
+        key=lambda entry: entry["seconds"]
+    )
+
+    return {
+        "summary": {
+            "processed": processed,
+            "errors": sum(summary.get("errors", 0) for summary in summaries),
+            "skipped": sum(summary.get("skipped", 0) for summary in summaries),
+            # シャードは並行して動くので最も遅いシャードの時間
+            "elapsed": elapsed,
+            "rows_per_second": processed / elapsed if elapsed else 0.0
+        },
+        "rows": _merge_stats([report.get("rows", {}) for report in reports]),
+        "stages": {name: _merge_stats([report["stages"][name] for report in reports if name in report.get("stages", {})]) for name in stage_names},
+        "bytes_read": sum(report.get("bytes_read", 0) for report in reports),
+        "bytes_written": sum(report.get("bytes_written", 0) for report in reports),
+        "caches": caches,
+        "slowest": slowest,
+        "failure_count": sum(report.get("failure_count", 0) for report in reports),
+        "failures": [failure for report in reports for failure in report.get("failures", [])],
+        "shards": {
+            "count": count,
+            "mode": shards[0]["mode"],
+            "rows": sum(ids.values()),
+            "missing_shards": [index for index in range(1, count + 1) if index not in indexes],
+            "duplicate_shards": sorted(index for index, seen in indexes.items() if seen > 1),
+            "missing_ids": sorted(set(map(str, expected_ids)) - set(ids)) if expected_ids is not None else None,
+            "duplicate_ids": sorted(task_id for task_id, seen in ids.items() if seen > 1)
+        }
+    }
+
+def load_reports(paths):
+    """レポートファイルを読み込む"""
+    reports = []
+    for path in find_reports(paths):
+        with open(path, 'r', encoding='utf-8') as f:
+            reports.append(json.load(f))
+    return reports
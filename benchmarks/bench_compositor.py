@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""テンプレートの固定レイヤーの合成方法（pil・numpy）を、装飾要素の数を変えて比較する
+
+    python benchmarks/bench_compositor.py [--layers 1 10 50] [--repeat 5]
+
+装飾要素（半透明の画像）を1・10・50個並べた800x800のテンプレートについて、
+- 平坦化: 装飾要素を1枚にまとめる処理だけ（以前の方法 = キャンバス全体の大きさのレイヤーを作って全体を合成）
+- コンパイル: 平坦化を含むテンプレートのコンパイル（プレビューの再描画やテンプレートの変更のたびに行われる）
+- 描画: コンパイル済みのテンプレートでの1行分の合成
+の所要時間（繰り返しのうち最短）と、以前の方法の結果との差（各チャンネルの最大値）を表示する。
+装飾画像のデコードは計測前に済ませておく（AssetCacheに保持）。
+"""
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageChops
+from image_processor import ImageProcessor
+from template_compiler import AssetCache
+from layer_compositor import flatten_layers
+
+CANVAS_SIZE = (800, 800)
+
+def legacy_flatten(canvas_size, layers):
+    """以前の平坦化（レイヤーごとにキャンバスの大きさの画像を作り、全体をalpha_compositeで重ねる）"""
+    flattened = None
+    for image, position in layers:
+        layer = Image.new('RGBA', canvas_size, (0, 0, 0, 0))
+        layer.paste(image, tuple(position))
+        flattened = layer if flattened is None else Image.alpha_composite(flattened, layer)
+    return flattened
+
+def difference(first, second):
+    """不透明な背景に重ねたときの各チャンネルの差の最大値"""
+    background = Image.new('RGBA', first.size, (255, 255, 255, 255))
+    first, second = Image.alpha_composite(background, first), Image.alpha_composite(background, second)
+    return max(high for _, high in ImageChops.difference(first, second).getextrema())
+
+def create_template(work_dir, layers, rng):
+    """装飾要素をlayers個持つテンプレートと商品画像を作成"""
+    image_elements = []
+    for i in range(layers):
+        size = (rng.randint(80, 240), rng.randint(80, 240))
+        image = Image.new('RGBA', size, (rng.randrange(256), rng.randrange(256), rng.randrange(256), rng.randint(64, 255)))
+        # 角を透明にして、アルファの異なる画素を混ぜる
+        image.paste((0, 0, 0, 0), (0, 0, size[0] // 3, size[1] // 3))
+        path = os.path.join(work_dir, f"decoration_{layers}_{i}.png")
+        image.save(path)
+        image_elements.append({"path": path, "position": [rng.randint(0, 700), rng.randint(0, 700)]})
+
+    product_path = os.path.join(work_dir, "product.png")
+    Image.new('RGBA', (300, 300), (40, 40, 40, 255)).save(product_path)
+    template = {
+        "name": f"layers_{layers}",
+        "background": "",
+        "product_position": [250, 150],
+        "product_size": [300, 300],
+        "text_elements": [{"text": "${name}", "position": [250, 480], "font_size": 24}],
+        "image_elements": image_elements
+    }
+    return template, product_path
+
+def best_time(function, repeat):
+    """repeat回実行したうちの最短の秒数と、最後の結果を返す"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description='固定レイヤーの合成方法の比較')
+    parser.add_argument('--layers', type=int, nargs='+', default=[1, 10, 50], help='装飾要素の数')
+    parser.add_argument('--repeat', type=int, default=5, help='計測の繰り返し回数（最短時間を採用）')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    work_dir = tempfile.mkdtemp()
+    try:
+        print(f"{'レイヤー':>6} {'合成方法':>10} {'平坦化':>10} {'コンパイル':>10} {'描画':>10} {'差':>4}")
+        for count in args.layers:
+            template, product_path = create_template(work_dir, count, rng)
+            layers = [(Image.open(element["path"]).convert('RGBA'), element["position"]) for element in template["image_elements"]]
+            legacy_time, expected = best_time(lambda: legacy_flatten(CANVAS_SIZE, layers), args.repeat)
+            print(f"{count:>6} {'以前の方法':>8} {legacy_time * 1000:7.2f} ms")
+
+            for compositor in ("pil", "numpy"):
+                flatten_time, flattened = best_time(lambda: flatten_layers(CANVAS_SIZE, layers, compositor), args.repeat)
+                processor = ImageProcessor(assets=AssetCache(), compositor=compositor)
+                compiled = processor.compile_template(template)
+                compile_time, compiled = best_time(lambda: processor.compile_template(template), args.repeat)
+                render_time, _ = best_time(lambda: processor.apply_template(product_path, {"name": "商品"}, compiled), args.repeat)
+                print(f"{count:>6} {compositor:>10} {flatten_time * 1000:7.2f} ms {compile_time * 1000:7.2f} ms "
+                      f"{render_time * 1000:7.2f} ms {difference(expected, flattened):>4}")
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""バッチ処理で行われるJSONの解析にかかる時間を、json.loadsのパッチの有無で比較する
+
+    python benchmarks/bench_json_patch.py [--rows 10000] [--repeat 5]
+
+テンプレートの読み込み（DataHandler.load_template）と、GUIが受け取る
+JSON Lines形式の進捗イベントの解析（batch_progress.parse_event）を、
+- パッチなし（現在のバッチ処理）
+- グローバルなjson.loadsをsafe_loadsにしたもの
+- 以前のsafe_loads（解析のたびに先頭20文字を表示）をグローバルに適用したもの
+で実行する。表示は標準出力を捨てて計測する。
+"""
+import os
+import io
+import sys
+import json
+import time
+import argparse
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import json_patch
+from data_handler import DataHandler
+from batch_progress import parse_event
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates", "default.json")
+
+def legacy_loads(s, *args, **kwargs):
+    """以前のsafe_loads（正常に解析できたデータも先頭20文字を表示していた）"""
+    if isinstance(s, str) and s.strip():
+        if len(s) > 20:
+            print(f"JSONデータの先頭20文字: '{s[:20]}...'")
+        else:
+            print(f"JSONデータ: '{s}'")
+    return json_patch.safe_loads(s, *args, **kwargs)
+
+def progress_lines(rows):
+    """バッチ処理が書き出す進捗イベントとログ行"""
+    lines = [json.dumps({"event": "start", "total": rows})]
+    for i in range(1, rows + 1):
+        lines.append(f"処理中: {i}/{rows}")
+        lines.append(json.dumps({"event": "progress", "current": i, "total": rows}))
+    lines.append(json.dumps({"event": "done", "processed": rows, "errors": 0, "skipped": 0}))
+    return lines
+
+def workload(lines, template_loads):
+    """テンプレートの読み込みと進捗イベントの解析"""
+    data_handler = DataHandler()
+    for _ in range(template_loads):
+        data_handler.load_template(TEMPLATE_PATH)
+    for line in lines:
+        parse_event(line)
+
+def measure(loads, lines, template_loads, repeat):
+    """json.loadsをloadsにしてworkloadを実行し、最短の所要時間（秒）を返す"""
+    original = json.loads
+    json.loads = loads
+    try:
+        best = None
+        for _ in range(repeat):
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                workload(lines, template_loads)
+                elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+    finally:
+        json.loads = original
+
+def main():
+    parser = argparse.ArgumentParser(description='json.loadsのパッチによるオーバーヘッドの計測')
+    parser.add_argument('--rows', type=int, default=10000, help='進捗イベントの件数')
+    parser.add_argument('--templates', type=int, default=200, help='テンプレートの読み込み回数')
+    parser.add_argument('--repeat', type=int, default=5, help='計測の繰り返し回数（最短時間を採用）')
+    args = parser.parse_args()
+
+    lines = progress_lines(args.rows)
+    cases = [
+        ("パッチなし", json_patch.original_loads),
+        ("safe_loads（グローバル）", json_patch.safe_loads),
+        ("以前のsafe_loads（グローバル）", legacy_loads),
+    ]
+
+    baseline = None
+    print(f"進捗イベント {args.rows} 件 + テンプレート読み込み {args.templates} 回（{args.repeat}回中の最短）")
+    for label, loads in cases:
+        elapsed = measure(loads, lines, args.templates, args.repeat)
+        baseline = baseline or elapsed
+        print(f"  {label:<28} {elapsed * 1000:8.1f} ms  (x{elapsed / baseline:.2f})")
+
+if __name__ == "__main__":
+    main()
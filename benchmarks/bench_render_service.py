@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""1枚ずつ画像を合成して返すAPI（/render/<テンプレートID>）のスループットと遅延を計測する
+
+    python benchmarks/bench_render_service.py [--requests 200] [--clients 4] [--format png]
+
+一時フォルダのテンプレートと商品画像でレンダーサーバーを起動し、
+- 描画: 毎回異なる商品データ（応答キャッシュに当たらない）
+- キャッシュ: 同じ商品データの繰り返し（ETagのキャッシュから返す）
+- 再検証: If-None-Matchを付けた繰り返し（304で本体を返さない）
+をそれぞれ --clients 個のスレッドから要求し、1秒あたりの件数とp50・p99の遅延を表示する。
+比較のため、HTTPを経由しないRenderService.renderの描画も計測する。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from batch_report import percentile
+from render_server import RenderServer, RenderClient
+
+def create_inputs(work_dir):
+    """テンプレートと商品画像を作成"""
+    templates_dir = os.path.join(work_dir, "templates")
+    image_folder = os.path.join(work_dir, "images")
+    os.makedirs(templates_dir)
+    os.makedirs(image_folder)
+    Image.new('RGBA', (1200, 1200), (200, 60, 60, 255)).save(os.path.join(image_folder, "product.png"))
+    with open(os.path.join(templates_dir, "card.json"), 'w', encoding='utf-8') as f:
+        json.dump({
+            "name": "card",
+            "background": "",
+            "product_position": [250, 150],
+            "product_size": [300, 300],
+            "text_elements": [
+                {"text": "${name}", "position": [250, 480], "font": "arial.ttf", "font_size": 24, "color": [0, 0, 0]},
+                {"text": "¥${price}", "position": [250, 520], "font": "arial.ttf", "font_size": 32, "color": [255, 0, 0]}
+            ]
+        }, f)
+    return templates_dir, image_folder
+
+def fields(i):
+    """i番目の商品データ"""
+    return {"id": str(i), "image_file": "product.png", "name": f"商品{i}", "price": str(1000 + i)}
+
+def run_clients(request, count, clients):
+    """requestをcount回、clients個のスレッドから呼び出し、(全体の秒数, 遅延のリスト) を返す"""
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(count))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            request(i)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, sorted(latencies)
+
+def report(label, elapsed, latencies):
+    print(f"  {label:<18} {len(latencies) / elapsed:8.1f} 件/秒   p50 {percentile(latencies, 0.50) * 1000:7.2f} ms   p99 {percentile(latencies, 0.99) * 1000:7.2f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description='画像を合成して返すAPIの計測')
+    parser.add_argument('--requests', type=int, default=200, help='各計測の要求件数')
+    parser.add_argument('--clients', type=int, default=4, help='同時に要求するスレッド数')
+    parser.add_argument('--format', choices=['png', 'jpeg', 'webp'], default='png', help='出力形式')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        templates_dir, image_folder = create_inputs(work_dir)
+        server = RenderServer(port=0, state_path=None, templates_dir=templates_dir, image_folder=image_folder)
+        server.start()
+        try:
+            client = RenderClient(server.url, server.token)
+            output = {"format": args.format}
+            service = server.render_service
+
+            # テンプレートのコンパイルとフォントの読み込みを済ませておく
+            etag, _ = client.render("card", fields(-1), output)
+
+            print(f"{args.format}、{args.requests}件、{args.clients}スレッド")
+            elapsed, latencies = run_clients(lambda i: service.render("card", fields(i), output), args.requests, 1)
+            report("描画（HTTPなし）", elapsed, latencies)
+            offset = args.requests
+            elapsed, latencies = run_clients(lambda i: client.render("card", fields(offset + i), output), args.requests, args.clients)
+            report("描画", elapsed, latencies)
+            elapsed, latencies = run_clients(lambda i: client.render("card", fields(-1), output), args.requests, args.clients)
+            report("キャッシュ", elapsed, latencies)
+            elapsed, latencies = run_clients(lambda i: client.render("card", fields(-1), output, etag), args.requests, args.clients)
+            report("再検証（304）", elapsed, latencies)
+            cache = service.cache
+            print(f"応答キャッシュ: {len(cache)}件 {cache.size / 1024 / 1024:.1f} MB, ヒット {cache.hits}件, ミス {cache.misses}件")
+        finally:
+            server.stop()
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    main()
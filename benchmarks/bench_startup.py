@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""main.py --batch のコールドスタート（起動から小さなCSVの処理完了まで）の時間を計測する
+
+    python benchmarks/bench_startup.py [--rows 3] [--repeat 5] [--budget 0.5]
+
+毎回新しいPythonプロセスで `main.py --batch` を実行し、最短・中央値の所要時間と、
+`python -X importtime` で計測したmainモジュールの読み込み時間（上位のモジュール）を表示する。
+中央値が --budget（秒）を超えた場合は終了コード1で終了する。
+"""
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAIN_SCRIPT = os.path.join(ROOT, "main.py")
+
+# 既定の予算（秒）。GUIやpandasを読み込むとこれを超える
+DEFAULT_BUDGET = 0.5
+
+def create_inputs(work_dir, rows):
+    """小さなCSV・商品画像・テンプレートを作成"""
+    from PIL import Image
+    import json
+
+    image_folder = os.path.join(work_dir, "images")
+    os.makedirs(image_folder)
+    Image.new('RGBA', (200, 200), (255, 0, 0, 255)).save(os.path.join(image_folder, "product.png"))
+
+    background = os.path.join(work_dir, "background.png")
+    Image.new('RGBA', (400, 400), (255, 255, 255, 255)).save(background)
+
+    template_path = os.path.join(work_dir, "template.json")
+    with open(template_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            "name": "startup",
+            "background": background,
+            "product_position": [100, 100],
+            "product_size": [200, 200],
+            "text_elements": [{"text": "${name}", "position": [20, 20], "font_size": 24, "color": [0, 0, 0]}],
+            "image_elements": []
+        }, f)
+
+    csv_path = os.path.join(work_dir, "products.csv")
+    with open(csv_path, 'w', encoding='utf-8') as f:
+        f.write("id,name,image_file\n")
+        for i in range(1, rows + 1):
+            f.write(f"{i},商品{i},product.png\n")
+
+    return csv_path, image_folder, template_path
+
+def run_batch(csv_path, image_folder, output_folder, template_path):
+    """main.py --batch を新しいプロセスで実行し、所要時間（秒）を返す"""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, MAIN_SCRIPT, "--batch", "--csv", csv_path, "--images", image_folder,
+         "--output", output_folder, "--template", template_path],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"バッチ処理が失敗しました:\n{result.stdout}{result.stderr}")
+    return elapsed
+
+def import_times(limit):
+    """mainモジュールの読み込み時間（マイクロ秒）と、mainが直接読み込むモジュールのうち時間のかかったもの"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    modules = []
+    for line in result.stderr.splitlines():
+        parts = line[len("import time:"):].split("|")
+        if not line.startswith("import time:") or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        # モジュール名のインデントが読み込みの深さ（子モジュールは親の時間に含まれる）
+        depth = len(parts[2]) - len(parts[2].lstrip())
+        modules.append((depth, int(parts[1]), parts[2].strip()))
+
+    main_depth, total = next(((depth, us) for depth, us, name in modules if name == "main"), (0, 0))
+    children = sorted(((us, name) for depth, us, name in modules if depth == main_depth + 2), reverse=True)
+    return total, children[:limit]
+
+def main():
+    parser = argparse.ArgumentParser(description='バッチ処理のコールドスタート時間の計測')
+    parser.add_argument('--rows', type=int, default=3, help='CSVの行数')
+    parser.add_argument('--repeat', type=int, default=5, help='実行回数')
+    parser.add_argument('--budget', type=float, default=DEFAULT_BUDGET, help='中央値の上限（秒）')
+    parser.add_argument('--top', type=int, default=8, help='表示するモジュールの数')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        csv_path, image_folder, template_path = create_inputs(work_dir, args.rows)
+        times = []
+        for i in range(args.repeat):
+            output_folder = os.path.join(work_dir, f"output{i}")
+            times.append(run_batch(csv_path, image_folder, output_folder, template_path))
+    finally:
+        shutil.rmtree(work_dir)
+
+    total, children = import_times(args.top)
+    print(f"import main: {total / 1000:.1f} ms")
+    for us, name in children:
+        print(f"  {name:<24} {us / 1000:8.1f} ms")
+
+    median = statistics.median(times)
+    print(f"main.py --batch（{args.rows}行, {args.repeat}回）: 最短 {min(times):.3f} 秒, 中央値 {median:.3f} 秒（予算 {args.budget:.3f} 秒）")
+    if median > args.budget:
+        print("予算を超えています")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
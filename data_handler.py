@@ -1,42 +1,90 @@
-import pandas as pd
 import os
+import csv
 import json
+from template_model import Template, TemplateError
 
 class DataHandler:
-    def __init__(self):
-        pass
+    def __init__(self, stream=None):
+        # エラーの表示先（省略時は標準出力）
+        self.stream = stream
     
     def load_csv(self, csv_path):
         """CSVファイルをロード"""
         try:
+            # pandasは読み込みに時間がかかるので、使うときだけ読み込む（バッチ処理はstream_csvを使う）
+            import pandas as pd
             df = pd.read_csv(csv_path)
             return df
         except Exception as e:
-            print(f"CSVロードエラー: {e}")
+            print(f"CSVロードエラー: {e}", file=self.stream)
+            return None
+    
+    def stream_csv(self, csv_path):
+        """CSVファイルを1行ずつ辞書として読み込むイテレータを返す（全体をメモリに載せない）"""
+        try:
+            f = open(csv_path, 'r', encoding='utf-8-sig', newline='')
+        except Exception as e:
+            print(f"CSVロードエラー: {e}", file=self.stream)
+            return None
+        return self._iter_csv_rows(f)
+    
+    def _iter_csv_rows(self, f):
+        """開いたCSVファイルから行を順に返し、読み終えたら閉じる"""
+        with f:
+            for row in csv.DictReader(f):
+                yield row
+    
+    def count_csv_rows(self, csv_path):
+        """CSVファイルのデータ行数を数える（進捗表示用）"""
+        try:
+            with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+                reader = csv.reader(f)
+                # ヘッダー行を除く
+                next(reader, None)
+                return sum(1 for _ in reader)
+        except Exception as e:
+            print(f"CSVロードエラー: {e}", file=self.stream)
             return None
     
     def load_template(self, template_path):
-        """テンプレートJSONファイルをロード"""
+        """テンプレートJSONファイルを検証・正規化済みのTemplateとしてロード
+        
+        ファイルがない・JSONとして読めない場合はデフォルトテンプレートを返す。
+        内容に問題がある場合は問題のある項目をすべて表示してNoneを返す。
+        """
+        data = self.load_template_data(template_path)
+        try:
+            return Template.from_dict(data)
+        except TemplateError as e:
+            print(f"テンプレートの内容が不正です: {template_path}", file=self.stream)
+            for error in e.errors:
+                print(f"  - {error}", file=self.stream)
+            return None
+    
+    def load_template_data(self, template_path):
+        """テンプレートJSONファイルを編集用の辞書としてロード（検証はしない）"""
         try:
             with open(template_path, 'r', encoding='utf-8') as f:
                 content = f.read().strip()
                 if not content:
-                    print(f"テンプレートファイルが空です: {template_path}")
+                    print(f"テンプレートファイルが空です: {template_path}", file=self.stream)
                     return self.create_default_template()
                 template = json.loads(content)
             return template
         except Exception as e:
-            print(f"テンプレートロードエラー: {e}")
+            print(f"テンプレートロードエラー: {e}", file=self.stream)
             return self.create_default_template()
     
     def save_template(self, template, template_path):
-        """テンプレートをJSON形式で保存"""
+        """テンプレートをJSON形式で保存（辞書またはTemplate）"""
+        if isinstance(template, Template):
+            template = template.to_dict()
         try:
             with open(template_path, 'w', encoding='utf-8') as f:
                 json.dump(template, f, indent=4, ensure_ascii=False)
             return True
         except Exception as e:
-            print(f"テンプレート保存エラー: {e}")
+            print(f"テンプレート保存エラー: {e}", file=self.stream)
             return False
     
     def create_default_template(self):
@@ -35,17 +35,10 @@ def apply_patch():
     # on_eventはローカル関数のため、モンキーパッチが必要
     # 直接パッチを適用するのは難しいため、全体の関数を再定義する
     
-    # 代わりに実用的な解決策として、JSONDecodeErrorをキャッチするラッパー関数を作成
-    def safe_json_loads(data):
-        try:
-            return json.loads(data)
-        except json.JSONDecodeError:
-            print("JSONデコードエラーをキャッチしました。空のリストを返します。")
-            return []
+    # 代わりに実用的な解決策として、イベントを受け取るモジュールの中だけjson.loadsを差し替える
+    # （グローバルなjson.loadsは変更しない）
+    from json_patch import apply_flet_patch
+    patched = apply_flet_patch()
     
-    # jsonモジュールのloads関数をモンキーパッチ
-    original_loads = json.loads
-    json.loads = safe_json_loads
-    
-    print("fletのJSONDecodeErrorに対するパッチを適用しました")
-    return True 
\ No newline at end of file
+    print(f"fletのJSONDecodeErrorに対するパッチを適用しました: {', '.join(patched) or 'なし'}")
+    return bool(patched)
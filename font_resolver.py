@@ -0,0 +1,195 @@
+import io
+import os
+import sys
+import shutil
+import threading
+import subprocess
+from collections import OrderedDict
+from PIL import ImageFont
+
+# フォントファイルとして扱う拡張子
+FONT_EXTENSIONS = ('.ttf', '.otf', '.ttc')
+
+# 読み込み済みフォント（名前とサイズの組み合わせ）の保持件数
+DEFAULT_MAX_FACES = 64
+
+def default_font_dirs():
+    """OSごとの標準的なフォントフォルダ"""
+    home = os.path.expanduser("~")
+    if sys.platform.startswith("win"):
+        windir = os.environ.get("WINDIR", r"C:\Windows")
+        return [
+            os.path.join(windir, "Fonts"),
+            os.path.join(os.environ.get("LOCALAPPDATA", home), "Microsoft", "Windows", "Fonts")
+        ]
+    if sys.platform == "darwin":
+        return [
+            os.path.join(home, "Library", "Fonts"),
+            "/Library/Fonts",
+            "/System/Library/Fonts",
+            "/System/Library/Fonts/Supplemental"
+        ]
+    return [
+        os.path.join(home, ".local", "share", "fonts"),
+        os.path.join(home, ".fonts"),
+        "/usr/local/share/fonts",
+        "/usr/share/fonts"
+    ]
+
+class FontResolver:
+    """テンプレートのフォント名をフォントファイルに解決し、読み込んだフォントを保持する
+
+    フォント名はそのままのパス → 指定フォルダ（font_dirs）→ OS標準のフォントフォルダ
+    → fontconfig（fc-match）の順で探し、解決結果は名前ごとに記録する。
+    フォントファイルの中身はサイズをまたいで共有し、サイズごとのフォントは
+    件数に上限のあるLRUで保持する。見つからないフォントは既定のフォントで代用し、
+    その旨をバッチごとに1回だけ表示する。
+    """
+
+    def __init__(self, font_dirs=None, max_faces=DEFAULT_MAX_FACES, use_fontconfig=True, report_fallbacks=True):
+        self.font_dirs = list(font_dirs or [])
+        self.max_faces = max_faces
+        self.use_fontconfig = use_fontconfig
+        self.report_fallbacks = report_fallbacks
+        self.hits = 0
+        self.misses = 0
+        self._paths = {}
+        self._font_data = {}
+        self._faces = OrderedDict()
+        self._index = None
+        self._fallback_names = set()
+        self._reported = set()
+        self._batch_start = (0, 0)
+        self._stream = None
+        self._lock = threading.Lock()
+
+    def get_font(self, font_name, font_size):
+        """フォント名とサイズからフォントを取得（見つからなければ既定のフォント）"""
+        key = (font_name, font_size)
+        with self._lock:
+            font = self._faces.get(key)
+            if font is not None:
+                self._faces.move_to_end(key)
+                self.hits += 1
+                if font_name in self._fallback_names:
+                    # 読み込み済みの代用フォントでも、新しいバッチでは改めて警告する
+                    self._report_fallback(font_name)
+                return font
+            self.misses += 1
+
+            font = self._load(font_name, font_size)
+            self._faces[key] = font
+            if len(self._faces) > self.max_faces:
+                self._faces.popitem(last=False)
+            return font
+
+    def resolve(self, font_name):
+        """フォント名をフォントファイルのパスに解決（見つからなければNone）"""
+        if font_name not in self._paths:
+            self._paths[font_name] = self._find(font_name)
+        return self._paths[font_name]
+
+    def begin_batch(self, stream=None):
+        """バッチの開始時に呼ぶ（代用フォントの警告をもう一度表示し、ヒット・ミスの件数を数え直す）
+
+        streamを渡すと、このバッチの間の警告をそこに書き出す（省略時は標準出力）。
+        """
+        with self._lock:
+            self._reported.clear()
+            self._batch_start = (self.hits, self.misses)
+            self._stream = stream
+
+    @property
+    def fallbacks(self):
+        """このバッチで既定のフォントを代用したフォント名"""
+        return sorted(self._reported)
+
+    @property
+    def batch_hits(self):
+        """このバッチでのキャッシュのヒット件数"""
+        return self.hits - self._batch_start[0]
+
+    @property
+    def batch_misses(self):
+        """このバッチでのキャッシュのミス件数"""
+        return self.misses - self._batch_start[1]
+
+    def _load(self, font_name, font_size):
+        """フォントを読み込む（フォントファイルの中身は全サイズで共有）"""
+        path = self.resolve(font_name)
+        if path is not None:
+            try:
+                data = self._font_data.get(path)
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    self._font_data[path] = data
+                return ImageFont.truetype(io.BytesIO(data), font_size)
+            except Exception as e:
+                print(f"フォントの読み込みエラー: {path}: {e}", file=self._stream)
+                self._paths[font_name] = None
+
+        self._report_fallback(font_name)
+        try:
+            return ImageFont.load_default(font_size)
+        except TypeError:
+            # サイズ指定に対応していない古いPillow
+            return ImageFont.load_default()
+
+    def _report_fallback(self, font_name):
+        """既定のフォントで代用したことをバッチごとに1回だけ表示"""
+        self._fallback_names.add(font_name)
+        if font_name in self._reported:
+            return
+        self._reported.add(font_name)
+        if self.report_fallbacks:
+            print(f"警告: フォント '{font_name}' が見つからないため既定のフォントを使用します", file=self._stream)
+
+    def _find(self, font_name):
+        """フォントファイルを探す"""
+        if os.path.isfile(font_name):
+            return os.path.abspath(font_name)
+
+        base, ext = os.path.splitext(os.path.basename(font_name))
+        candidates = [os.path.basename(font_name).lower()]
+        if ext.lower() not in FONT_EXTENSIONS:
+            candidates = [f"{base}{extension}".lower() for extension in FONT_EXTENSIONS]
+        index = self._font_index()
+        for candidate in candidates:
+            if candidate in index:
+                return index[candidate]
+
+        return self._fc_match(base)
+
+    def _font_index(self):
+        """フォントフォルダ内のファイル名（小文字）→ パスの索引（初回だけ作成）"""
+        if self._index is None:
+            self._index = {}
+            for font_dir in self.font_dirs + default_font_dirs():
+                for root, _, files in os.walk(font_dir):
+                    for filename in files:
+                        if filename.lower().endswith(FONT_EXTENSIONS):
+                            # 先に見つかったフォルダを優先
+                            self._index.setdefault(filename.lower(), os.path.join(root, filename))
+        return self._index
+
+    def _fc_match(self, family):
+        """fontconfigでファミリー名に一致するフォントを探す"""
+        if not self.use_fontconfig or not shutil.which("fc-match"):
+            return None
+        try:
+            result = subprocess.run(
+                ["fc-match", "--format=%{family}\n%{file}", family],
+                capture_output=True, text=True, timeout=5
+            )
+        except (OSError, subprocess.SubprocessError):
+            return None
+        lines = result.stdout.splitlines()
+        if result.returncode != 0 or len(lines) < 2:
+            return None
+
+        # fc-matchは一致しなくても代わりのフォントを返すので、ファミリー名を確認する
+        families = [name.strip().lower().replace(" ", "") for name in lines[0].split(",")]
+        if family.lower().replace(" ", "") not in families:
+            return None
+        return lines[1] if os.path.isfile(lines[1]) else None
@@ -0,0 +1,173 @@
+import io
+import os
+import re
+import time
+import threading
+from PIL import Image, features
+from batch_report import add_time, add_bytes
+
+# 出力形式ごとのPillowでの形式名と拡張子
+FORMATS = {
+    "png": ("PNG", "png"),
+    "jpeg": ("JPEG", "jpg"),
+    "jpg": ("JPEG", "jpg"),
+    "webp": ("WEBP", "webp"),
+    "avif": ("AVIF", "avif"),
+}
+
+# アルファチャンネルを保存できない形式
+NO_ALPHA_FORMATS = {"JPEG"}
+
+# 速度を優先した既定のエンコーダ設定
+DEFAULT_OPTIONS = {
+    "format": "png",
+    "compress_level": 1,
+    "quality": None,
+    "optimize": False,
+    "flatten": "auto",
+    "background": [255, 255, 255],
+}
+
+# 形式ごとの既定の画質
+DEFAULT_QUALITY = {"JPEG": 85, "WEBP": 80, "AVIF": 60}
+
+class OutputSpec:
+    """1種類の出力ファイル（形式・エンコーダ設定・サイズ）の指定"""
+
+    def __init__(self, options):
+        format_name = str(options.get("format", "png")).lower()
+        if format_name not in FORMATS:
+            raise ValueError(f"未対応の出力形式です: {format_name}")
+        self.format, self.extension = FORMATS[format_name]
+        if self.format == "AVIF" and not features.check("avif"):
+            # 古いPillowではプラグインを読み込めばAVIFを保存できる
+            try:
+                import pillow_avif  # noqa: F401
+            except ImportError:
+                raise ValueError("AVIF形式で保存するにはAVIF対応のPillowかpillow-avif-pluginが必要です")
+
+        self.quality = options.get("quality") or DEFAULT_QUALITY.get(self.format)
+        self.compress_level = options.get("compress_level", DEFAULT_OPTIONS["compress_level"])
+        self.optimize = bool(options.get("optimize", False))
+        self.flatten = options.get("flatten", "auto")
+        self.background = tuple(options.get("background", DEFAULT_OPTIONS["background"]))
+        self.size = tuple(options["size"]) if options.get("size") else None
+        self.suffix = options.get("suffix", "")
+
+    def filename(self, stem):
+        """出力ファイル名"""
+        return f"{stem}{self.suffix}.{self.extension}"
+
+    def prepare(self, image):
+        """サイズ変更と、必要に応じたRGBへの平坦化"""
+        if self.size:
+            image = image.copy()
+            image.thumbnail(self.size, Image.LANCZOS)
+
+        if image.mode == 'RGBA' and self._needs_flatten(image):
+            flattened = Image.new('RGB', image.size, self.background)
+            flattened.paste(image, (0, 0), image)
+            image = flattened
+        return image
+
+    def _needs_flatten(self, image):
+        """アルファチャンネルを捨ててよいか"""
+        if self.format in NO_ALPHA_FORMATS:
+            return True
+        if self.flatten == "auto":
+            # 完全に不透明な画像はRGBで保存したほうが小さく速い
+            return image.getchannel('A').getextrema() == (255, 255)
+        return bool(self.flatten)
+
+    def save_options(self):
+        """Image.saveに渡すエンコーダ設定"""
+        if self.format == "PNG":
+            return {"compress_level": self.compress_level, "optimize": self.optimize}
+        options = {"quality": self.quality}
+        if self.format == "JPEG":
+            options["optimize"] = self.optimize
+        return options
+
+    def encode(self, image):
+        """エンコードしたバイト列を返す"""
+        buffer = io.BytesIO()
+        self.prepare(image).save(buffer, self.format, **self.save_options())
+        return buffer.getvalue()
+
+def write_atomic(path, data, temp_tag=None):
+    """一時ファイルに書いてから置き換える（中断しても書きかけのファイルが残らない）
+
+    一時ファイル名は隠しファイル（.で始まり.tmpで終わる）で、同じファイルを
+    複数のスレッドやプロセスが書いても衝突しないようプロセスとスレッドのIDを含める。
+    temp_tag（シャード名など）を指定すると一時ファイル名に含め、is_temp_fileで
+    自分の一時ファイルだけを見分けられるようにする。
+    """
+    folder, filename = os.path.split(path)
+    tag = f".{temp_tag}" if temp_tag else ""
+    temp_path = os.path.join(folder, f".{filename}.{os.getpid()}-{threading.get_ident()}{tag}.tmp")
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+def is_temp_file(name, temp_tag=None):
+    """write_atomicが同じtemp_tagで書いた一時ファイルの名前か"""
+    if not name.startswith("."):
+        return False
+    if temp_tag:
+        return name.endswith(f".{temp_tag}.tmp")
+    return re.search(r"\.\d+-\d+\.tmp$", name) is not None
+
+class ImageEncoder:
+    """合成画像を設定された形式でエンコードして保存する
+
+    1回の描画から複数の出力（例: 原寸と縮小版）を作れる。合成処理とは独立しているので、
+    合成とは別のスレッドやプロセスでエンコードすることもできる。
+    """
+
+    def __init__(self, config=None):
+        self.config = dict(DEFAULT_OPTIONS)
+        self.config.update({key: value for key, value in (config or {}).items() if key != "variants"})
+        self.config["variants"] = list((config or {}).get("variants", []))
+
+        # 原寸の出力と、設定を引き継いだ追加の出力
+        self.outputs = [OutputSpec(self.config)]
+        for variant in self.config["variants"]:
+            options = dict(self.config)
+            options.update(variant)
+            self.outputs.append(OutputSpec(options))
+
+    @classmethod
+    def from_template(cls, template, overrides=None):
+        """テンプレートの"output"設定にコマンドライン等の指定を上書きして作成"""
+        config = dict(template.get("output") or {})
+        config.update({key: value for key, value in (overrides or {}).items() if value is not None})
+        return cls(config)
+
+    def encode(self, image, stem):
+        """(ファイル名, バイト列) のリストを返す"""
+        return [(spec.filename(stem), spec.encode(image)) for spec in self.outputs]
+
+    def save(self, image, output_folder, stem, stats=None, temp_tag=None):
+        """エンコードして保存し、出力したファイル名のリストを返す
+
+        statsに辞書を渡すと、エンコードと書き込みの処理時間（秒）と書き込んだバイト数を加算する。
+        temp_tagはwrite_atomicの一時ファイル名に含める名前。
+        """
+        filenames = []
+        for spec in self.outputs:
+            start = time.perf_counter()
+            filename = spec.filename(stem)
+            data = spec.encode(image)
+            add_time(stats, "encode", start)
+
+            start = time.perf_counter()
+            write_atomic(os.path.join(output_folder, filename), data, temp_tag)
+            add_time(stats, "write", start)
+            add_bytes(stats, "bytes_written", len(data))
+            filenames.append(filename)
+        return filenames
@@ -0,0 +1,151 @@
+import os
+import math
+import unicodedata
+from collections import deque
+
+# 商品画像として扱う拡張子（拡張子が違うファイルを探すときはこの順で優先する）
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.avif', '.gif', '.bmp', '.tif', '.tiff')
+
+# 見つからない商品画像を一覧表示する件数の上限
+MISSING_REPORT_LIMIT = 20
+
+def normalize_name(name):
+    """ファイル名を比較用に正規化（大文字小文字・Unicodeの合成・区切り文字の違いを無視）"""
+    return unicodedata.normalize('NFC', name).replace('\\', '/').strip('/').casefold()
+
+def _text(value):
+    """CSVの値を文字列に（空欄やNaNは空文字列）"""
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    return str(value).strip()
+
+class ImageIndex:
+    """商品画像フォルダの索引（フォルダを1回だけ走査し、行ごとにファイルの存在を確認しない）
+
+    CSVのimage_fileとファイル名の大文字小文字が違っても見つけられるほか、
+    拡張子が違う場合（abc.jpg → abc.png）や、image_fileが空の行ではIDと同じ名前の
+    画像も探す。recursiveならサブフォルダも走査し、ファイル名だけでも見つけられる
+    （同じ名前が複数ある場合は浅いフォルダのものを優先）。
+    索引にない場合も、フォルダからの相対パス（sub/a.png、./a.png）で指定された
+    フォルダ内のファイルはそのパスで探す。
+    """
+
+    def __init__(self, folder, recursive=False):
+        self.folder = folder
+        self.recursive = recursive
+        self._exact = {}
+        self._names = {}
+        self._stems = {}
+        self._scan(folder, "")
+
+    def __len__(self):
+        return len(self._exact)
+
+    def find(self, image_file, product_id=None, allow_outside=True):
+        """商品画像のパスを返す（見つからなければNone）
+
+        allow_outsideがFalseなら、フォルダの外の画像を絶対パスで指定しても探さない
+        （外部から渡された商品データで探す場合）。
+        """
+        image_file = _text(image_file)
+        if not image_file:
+            product_id = _text(product_id)
+            return self._find_stem(normalize_name(product_id)) if product_id else None
+
+        path = self._exact.get(image_file.replace('\\', '/'))
+        if path is not None:
+            return path
+        key = normalize_name(image_file)
+        path = self._names.get(key)
+        if path is not None:
+            return path
+
+        # 拡張子違い（拡張子が書かれていない場合も含む）
+        stem, ext = os.path.splitext(key)
+        path = self._find_stem(stem) if ext in IMAGE_EXTENSIONS else None
+        if path is None:
+            path = self._find_stem(key)
+        if path is None:
+            path = self._find_inside(image_file)
+        if path is None and allow_outside and os.path.isabs(image_file) and os.path.isfile(image_file):
+            # フォルダの外を絶対パスで指定している
+            path = image_file
+        return path
+
+    def missing(self, rows):
+        """商品画像が見つからない行の (ID, image_file) のリスト（rowsは (番号, 行データ) の組）"""
+        missing = []
+        for index, product_data in rows:
+            product_id = product_data.get('id', index)
+            image_file = product_data.get('image_file', '')
+            if self.find(image_file, product_id) is None:
+                missing.append((product_id, _text(image_file)))
+        return missing
+
+    def report_missing(self, rows, stream=None):
+        """描画を始める前に、商品画像が見つからない行をまとめて表示する（streamを省略すると標準出力）"""
+        missing = self.missing(rows)
+        if missing:
+            print(f"商品画像が見つからない行があります: {len(missing)}件（{self.folder}）", file=stream)
+            for product_id, image_file in missing[:MISSING_REPORT_LIMIT]:
+                print(f"  - ID {product_id}: {image_file or '（image_fileなし）'}", file=stream)
+            if len(missing) > MISSING_REPORT_LIMIT:
+                print(f"  ...ほか {len(missing) - MISSING_REPORT_LIMIT}件", file=stream)
+        return missing
+
+    def _find_inside(self, image_file):
+        """フォルダからの相対パスでファイルを探す（シンボリックリンクなどでフォルダの外を指す場合はNone）
+
+        recursiveでない索引に含まれないサブフォルダの画像や、./で始まるパスのため。
+        """
+        path = os.path.normpath(os.path.join(self.folder, image_file))
+        root = os.path.realpath(self.folder)
+        try:
+            if os.path.commonpath([root, os.path.realpath(path)]) != root:
+                return None
+        except ValueError:
+            # Windowsで別のドライブを指している
+            return None
+        return path if os.path.isfile(path) else None
+
+    def _find_stem(self, stem):
+        """拡張子を除いた名前が一致する画像（拡張子の優先順で選ぶ）"""
+        candidates = self._stems.get(stem)
+        if not candidates:
+            return None
+        return min(candidates, key=lambda candidate: candidate[0])[1]
+
+    def _add(self, relative, path, depth):
+        """ファイルを索引に登録（先に登録したもの＝浅いフォルダのものを優先）"""
+        self._exact[relative] = path
+        key = normalize_name(relative)
+        stem, ext = os.path.splitext(key)
+        if ext not in IMAGE_EXTENSIONS:
+            return
+        rank = (depth, IMAGE_EXTENSIONS.index(ext))
+        names = [key]
+        if depth > 0:
+            # サブフォルダの画像はファイル名だけでも探せるようにする
+            names.append(key.rsplit('/', 1)[-1])
+        for name in names:
+            self._names.setdefault(name, path)
+            self._stems.setdefault(os.path.splitext(name)[0], []).append((rank, path))
+
+    def _scan(self, folder, prefix):
+        """フォルダを浅い順に走査（os.scandirの結果のファイル種別を使い、ファイルごとにstatしない）"""
+        pending = deque([(folder, prefix, 0)])
+        while pending:
+            directory, prefix, depth = pending.popleft()
+            subdirs = []
+            try:
+                with os.scandir(directory) as it:
+                    for entry in it:
+                        if entry.is_file():
+                            self._add(prefix + entry.name, entry.path, depth)
+                        elif self.recursive and entry.is_dir():
+                            subdirs.append(entry)
+            except OSError as e:
+                print(f"商品画像フォルダを読み込めません: {directory}: {e}")
+                continue
+            for entry in sorted(subdirs, key=lambda entry: entry.name):
+                pending.append((entry.path, f"{prefix}{entry.name}/", depth + 1))
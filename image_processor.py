@@ -1,149 +1,261 @@
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 import os
 import json
+import time
+from batch_report import add_time, add_bytes, add_count
+from template_compiler import CompiledTemplate, TextSpriteCache, open_image, resize_image, scale_point
+from image_encoder import ImageEncoder
+from font_resolver import FontResolver
+from template_model import Template
+from image_index import ImageIndex
+from layer_compositor import check_compositor
+from batch_engine import BatchRun, RenderTarget, run_sequential, run_parallel, resolve_workers
 
 class ImageProcessor:
-    def __init__(self):
-        self.fonts_cache = {}
+    def __init__(self, fonts=None, product_cache=None, assets=None, compositor="pil"):
+        check_compositor(compositor)
+        self.fonts = fonts or FontResolver()
+        self.text_sprites = TextSpriteCache()
+        self.product_cache = product_cache
+        self.assets = assets
+        self.compositor = compositor
         
     def get_font(self, font_name, font_size):
-        """フォントをキャッシュから取得またはロード"""
-        key = f"{font_name}_{font_size}"
-        if key not in self.fonts_cache:
-            try:
-                self.fonts_cache[key] = ImageFont.truetype(font_name, font_size)
-            except:
-                # デフォルトフォントにフォールバック
-                self.fonts_cache[key] = ImageFont.load_default()
-        return self.fonts_cache[key]
+        """フォントをキャッシュから取得またはロード（見つからなければ既定のフォント）"""
+        return self.fonts.get_font(font_name, font_size)
     
-    def apply_template(self, product_image_path, product_data, template):
-        """テンプレートを適用して画像を合成"""
-        # 背景画像を読み込む
-        if template.get('background'):
-            base_img = Image.open(template['background']).convert('RGBA')
-        else:
-            # デフォルト背景（白）を作成
-            base_img = Image.new('RGBA', (800, 800), (255, 255, 255, 255))
+    def compile_template(self, template, scale=1.0, resample=Image.LANCZOS, assets=None):
+        """テンプレートを描画用にコンパイル（背景・装飾画像と固定テキストを一度だけ描画）
+        
+        templateはTemplateか辞書（辞書は検証して変換し、不正ならTemplateErrorを送出）。
+        scale・resampleはプレビュー用の縮小描画、assetsはコンパイルをまたいで
+        デコード済みの素材を使い回すためのAssetCache（省略時は作成時に渡したもの）。
+        固定レイヤーは作成時に指定した合成方法（compositor）でまとめる。
+        """
+        if assets is None:
+            assets = self.assets
+        return CompiledTemplate(Template.coerce(template), self.get_font, scale, resample, assets, self.compositor)
+    
+    def load_product_image(self, product_image_path, template, stats=None):
+        """商品画像を読み込み、テンプレートに指定されたサイズにリサイズ"""
+        return self.load_product_images(product_image_path, [template], stats)[0]
+    
+    def load_product_images(self, product_image_path, templates, stats=None):
+        """商品画像を読み込み、テンプレートごとに指定されたサイズにリサイズした画像のリストを返す
+        
+        複数のテンプレートで使う場合も、元画像のデコードは1回だけ行う。
+        """
+        add_bytes(stats, "bytes_read", os.path.getsize(product_image_path))
+        
+        # リサイズ後のサイズ（テンプレートに指定されたサイズ、指定がなければ縮尺のみ）
+        sizes = []
+        for template in templates:
+            size = template.product_size
+            if size is None and template.scale != 1.0:
+                with Image.open(product_image_path) as image:
+                    size = scale_point(image.size, template.scale)
+            sizes.append(size)
+        
+        # リサイズ済みの画像がディスクのキャッシュにあれば使う
+        images = [None] * len(templates)
+        if self.product_cache is not None:
+            for i, (template, size) in enumerate(zip(templates, sizes)):
+                if size is None:
+                    continue
+                images[i] = self.product_cache.get(product_image_path, size, template.resample)
+                add_count(stats, "product_cache_hits" if images[i] is not None else "product_cache_misses")
+        
+        missing = [i for i, image in enumerate(images) if image is None]
+        if not missing:
+            return images
+        
+        # 最も大きいサイズに近い大きさで1回だけデコードし、テンプレートごとにリサイズする
+        needed = [sizes[i] for i in missing]
+        draft_size = None
+        if None not in needed:
+            draft_size = (max(size[0] for size in needed), max(size[1] for size in needed))
+        source = open_image(product_image_path, draft_size, stats)
+        for i in missing:
+            images[i] = resize_image(source, sizes[i], templates[i].resample, stats)
+            if self.product_cache is not None and sizes[i] is not None:
+                self.product_cache.put(product_image_path, sizes[i], templates[i].resample, images[i])
+        return images
+    
+    def apply_template(self, product_image_path, product_data, template, stats=None):
+        """テンプレートを適用して画像を合成（templateは辞書またはCompiledTemplate）
+        
+        statsに辞書を渡すと、段ごとの処理時間（秒）と読み込んだバイト数を加算する。
+        """
+        if not isinstance(template, CompiledTemplate):
+            template = self.compile_template(template)
         
         # 商品画像を読み込む
         try:
-            prod_img = Image.open(product_image_path).convert('RGBA')
-            
-            # 商品画像のリサイズ（テンプレートに指定されたサイズ）
-            if 'product_size' in template:
-                width, height = template['product_size']
-                prod_img = prod_img.resize((width, height), Image.LANCZOS)
-            
-            # 商品画像の配置
-            product_pos = template.get('product_position', (0, 0))
-            base_img.paste(prod_img, product_pos, prod_img)
+            prod_img = self.load_product_image(product_image_path, template, stats)
         except Exception as e:
             print(f"商品画像の処理エラー: {e}")
+            prod_img = None
         
-        # テキスト追加
-        draw = ImageDraw.Draw(base_img)
-        for text_element in template.get('text_elements', []):
-            text = text_element['text']
-            
-            # テキスト内の変数を商品データで置換
-            for key, value in product_data.items():
-                text = text.replace(f"${{{key}}}", str(value))
-            
-            position = text_element.get('position', (0, 0))
-            font_name = text_element.get('font', 'arial.ttf')
-            font_size = text_element.get('font_size', 24)
-            color = text_element.get('color', (0, 0, 0))
+        return self.compose(prod_img, product_data, template, stats)
+
+    def render_bytes(self, product_image_path, product_data, template, encoder=None, stats=None):
+        """1行分を合成し、ファイルに保存せずにエンコードしたバイト列を返す
+
+        繰り返し描画する場合はtemplateにCompiledTemplateを渡す。encoderを省略した場合は
+        テンプレートの"output"設定を使い、縮小版などの追加の出力があっても原寸の1枚だけを返す。
+        """
+        if not isinstance(template, CompiledTemplate):
+            template = self.compile_template(template)
+        if encoder is None:
+            encoder = ImageEncoder.from_template(template.template)
+
+        image = self.apply_template(product_image_path, product_data, template, stats)
+        start = time.perf_counter()
+        data = encoder.outputs[0].encode(image)
+        add_time(stats, "encode", start)
+        return data
+
+    def compose(self, prod_img, product_data, template, stats=None, stream=None):
+        """読み込み済みの商品画像とコンパイル済みテンプレートから画像を合成（警告はstream、省略時は標準出力に書き出す）"""
+        start = time.perf_counter()
+        
+        # 平坦化済みの固定レイヤー（背景）を複製して土台にする
+        base_img = template.base.copy()
+        
+        # 商品画像の配置（読み込めなかった場合は商品画像なしで合成）
+        if prod_img is not None:
+            base_img.paste(prod_img, template.product_position, prod_img)
+        add_time(stats, "paste", start)
+        
+        # 商品画像より上のレイヤーを重なり順に描画
+        for layer in template.layers:
+            start = time.perf_counter()
+            if layer[0] == "layer":
+                # 平坦化済みの固定レイヤー（固定テキスト・装飾要素）
+                base_img.alpha_composite(layer[1], layer[2])
+                add_time(stats, "layers", start)
+                continue
             
-            # 色情報がリスト形式の場合はタプルに変換
-            if isinstance(color, list):
-                color = tuple(color)
+            # 参照している列だけを商品データで置換
+            element = layer[1]
+            text, missing = element.text.render(product_data)
+            for field in missing:
+                print(f"警告: テキストが参照する列 '{field}' がCSVにありません（ID: {product_data.get('id', '')}）", file=stream)
             
-            font = self.get_font(font_name, font_size)
-            draw.text(position, text, font=font, fill=color)
-        
-        # イラスト/装飾要素の追加
-        for image_element in template.get('image_elements', []):
-            try:
-                element_img = Image.open(image_element['path']).convert('RGBA')
-                
-                # サイズ調整
-                if 'size' in image_element:
-                    width, height = image_element['size']
-                    element_img = element_img.resize((width, height), Image.LANCZOS)
-                
-                position = image_element.get('position', (0, 0))
-                base_img.paste(element_img, position, element_img)
-            except Exception as e:
-                print(f"装飾要素の処理エラー: {e}")
+            # 同じ文字列は描画済みのマスクを使い回す
+            if self.text_sprites.draw(base_img, element, text):
+                add_count(stats, "text_cache_hits")
+            else:
+                add_count(stats, "text_cache_misses")
+            add_time(stats, "text", start)
         
         return base_img
     
-    def batch_process(self, csv_data, image_folder, template, output_folder, progress_callback=None):
-        """CSVデータを使って一括処理"""
-        os.makedirs(output_folder, exist_ok=True)
-        
-        # テンプレートの座標・サイズデータがリスト形式の場合はタプルに変換
-        if isinstance(template.get('product_position'), list):
-            template['product_position'] = tuple(template['product_position'])
-        
-        if isinstance(template.get('product_size'), list):
-            template['product_size'] = tuple(template['product_size'])
-        
-        # テキスト要素の色情報とポジションをタプルに変換
-        for text_elem in template.get('text_elements', []):
-            if isinstance(text_elem.get('color'), list):
-                text_elem['color'] = tuple(text_elem['color'])
-            if isinstance(text_elem.get('position'), list):
-                text_elem['position'] = tuple(text_elem['position'])
-        
-        # 装飾画像要素のポジションとサイズをタプルに変換
-        for image_elem in template.get('image_elements', []):
-            if isinstance(image_elem.get('position'), list):
-                image_elem['position'] = tuple(image_elem['position'])
-            if isinstance(image_elem.get('size'), list):
-                image_elem['size'] = tuple(image_elem['size'])
-        
-        total = len(csv_data)
-        processed = 0
-        errors = 0
-        
-        for index, row in csv_data.iterrows():
-            product_data = row.to_dict()
-            
-            # 商品画像パスの構築
-            image_file = product_data.get('image_file', '')
-            if not image_file:
-                errors += 1
-                continue
-                
-            product_image_path = os.path.join(image_folder, image_file)
-            
-            # 画像が存在するか確認
-            if not os.path.exists(product_image_path):
-                print(f"画像ファイルが見つかりません: {product_image_path}")
-                errors += 1
-                continue
-            
-            try:
-                # テンプレート適用
-                result_image = self.apply_template(product_image_path, product_data, template)
-                
-                # 出力ファイル名を生成
-                output_filename = f"{product_data.get('id', index)}.png"
-                output_path = os.path.join(output_folder, output_filename)
-                
-                # 画像を保存
-                result_image.save(output_path)
-                
-                processed += 1
-                
-                # 進捗コールバック
-                if progress_callback:
-                    progress_callback(processed, total)
-                    
-            except Exception as e:
-                print(f"処理エラー（ID: {product_data.get('id', index)}）: {e}")
-                errors += 1
-        
-        return processed, errors
+    def batch_process(self, csv_data, image_folder, template, output_folder, progress_callback=None, workers=1, total=None, manifest=None, encoder=None, pipeline=None, report=None):
+        """CSVデータを使って一括処理（workersが2以上ならプロセスプールで並列処理）
+        
+        csv_dataはDataFrameか、DataHandler.stream_csvのような行の辞書を返すイテレータ。
+        イテレータの場合は読み込みながら処理するので、totalで進捗表示用の総件数を渡す。
+        manifestにBatchManifestを渡すと、前回から入力が変わっていない行を省略する。
+        encoderを省略した場合はテンプレートの"output"設定（なければPNG）で保存する。
+        pipelineにBatchPipelineを渡すと、読み込み・合成・保存を別スレッドで並行して行う。
+        reportにBatchReportを渡すと、行ごとの段別処理時間や失敗した行を記録する。
+        """
+        # 不正なテンプレートは行の処理を始める前にTemplateErrorとして報告する
+        template = Template.coerce(template)
+        if encoder is None:
+            encoder = ImageEncoder.from_template(template)
+        target = RenderTarget(template.name, template, encoder, output_folder, manifest)
+        return self.batch_process_targets(
+            csv_data, image_folder, [target], progress_callback, workers, total, pipeline, report
+        )
+    
+    def batch_process_targets(self, csv_data, image_folder, targets, progress_callback=None, workers=1, total=None, pipeline=None, report=None, image_index=None, shard=None, pool=None, cancel=None, stream=None):
+        """CSVの各行を複数の描画先（RenderTarget）に描画する
+        
+        商品画像のデコードは行ごとに1回だけ行い、各テンプレートで共有する。
+        差分処理は描画先ごとのマニフェストで判定し、すべての描画先で変更がない行だけを省略する。
+        商品画像はimage_index（省略時は画像フォルダを走査して作成）から探す。
+        読み込み済みのデータ（DataFrame）なら見つからない商品画像を描画前にまとめて表示する
+        （1行ずつ読み込む場合は呼び出し側で表示する）。
+        shard（batch_shard.Shard）を指定すると担当する行だけを処理する（totalは担当する行数）。
+        poolに常駐ワーカーのプール（WarmPool）を渡すとworkersの代わりにそれを使う。
+        cancel（threading.Event）がセットされると新しい行の処理をやめる（ジャーナルは残るので再開できる）。
+        streamにはこのバッチのログの書き出し先を渡せる（省略時は標準出力）。
+        """
+        # 見つからないフォントの警告はバッチごとに1回だけ（ワーカーではなくここで表示する）
+        self.fonts.begin_batch(stream)
+        for target in targets:
+            os.makedirs(target.output_folder, exist_ok=True)
+            for text_elem in target.template.text_elements:
+                if self.fonts.resolve(text_elem.font) is None:
+                    self.fonts.get_font(text_elem.font, text_elem.font_size)
+        
+        if image_index is None:
+            image_index = ImageIndex(image_folder)
+        if hasattr(csv_data, 'iterrows'):
+            if total is None:
+                total = len(csv_data)
+            missing_rows = ((index, row.to_dict()) for index, row in csv_data.iterrows())
+            image_index.report_missing(shard.filter(missing_rows) if shard is not None else missing_rows, stream)
+            rows = ((index, row.to_dict()) for index, row in csv_data.iterrows())
+        else:
+            rows = enumerate(csv_data)
+        run = BatchRun(image_folder, targets, total, progress_callback, report, image_index, shard, cancel, stream)
+        if report is not None:
+            report.start(total)
+        
+        workers = resolve_workers(workers)
+        try:
+            if pool is not None:
+                pool.run(run, rows)
+            elif workers > 1 and pipeline is None:
+                # 各ワーカーが初期化時にテンプレートをコンパイルする
+                run_parallel(run, rows, workers, self.fonts.font_dirs, self.product_cache, self.compositor)
+            else:
+                # 背景・装飾画像のデコードはバッチ全体で一度だけ
+                for target in targets:
+                    target.compiled = self.compile_template(target.template)
+                if pipeline is not None:
+                    pipeline.run(self, run, rows)
+                else:
+                    run_sequential(self, run, rows)
+        finally:
+            # 中断しても描画済みの行を再開時に省略できるよう、ジャーナルは必ず書き込んで閉じる
+            for target in targets:
+                if target.journal is not None:
+                    target.journal.close()
+        
+        for target in targets:
+            # 中止した場合は未処理の行をCSVから消えた行として扱わないよう、マニフェストは更新しない
+            if target.manifest is not None and not run.cancelled:
+                target.manifest.save()
+            if target.journal is not None:
+                if target.resumed:
+                    label = f"（{target.name}）" if len(targets) > 1 else ""
+                    print(f"再開{label}: 前回の実行で処理済み {target.resumed}件", file=stream)
+                # エラーがなければ最後まで処理できたのでジャーナルは不要（エラーの行は再開時に処理し直す）
+                if run.errors == 0 and not run.cancelled:
+                    target.journal.discard()
+        
+        # テキストのマスクキャッシュの効果（並列処理では各ワーカーの合計）
+        text_hits = run.counters.get("text_cache_hits", 0)
+        text_misses = run.counters.get("text_cache_misses", 0)
+        if text_hits or text_misses:
+            print(f"テキストキャッシュ: ヒット {text_hits}件, ミス {text_misses}件", file=stream)
+        product_hits = run.counters.get("product_cache_hits", 0)
+        product_misses = run.counters.get("product_cache_misses", 0)
+        if self.product_cache is not None:
+            print(f"商品画像キャッシュ: ヒット {product_hits}件, ミス {product_misses}件", file=stream)
+        if report is not None:
+            report.record_cache("fonts", self.fonts.batch_hits, self.fonts.batch_misses, fallbacks=self.fonts.fallbacks)
+            report.record_cache("text_sprites", text_hits, text_misses)
+            if shard is not None:
+                report.record_shard(shard.to_dict())
+            if self.product_cache is not None:
+                report.record_cache("product_images", product_hits, product_misses)
+            report.finish(run.processed, run.errors, run.skipped)
+        if run.cancelled:
+            print(f"バッチ処理を中止しました: 処理件数 {run.processed}件（--resumeで続きから再開できます）", file=stream)
+        
+        return run.processed, run.errors
@@ -1,4 +1,5 @@
 import json
+import importlib
 import traceback
 
 # 元のjson.loads関数をバックアップ
@@ -24,23 +25,11 @@ def safe_loads(s, *args, **kwargs):
         if s_trimmed.startswith("{") and s_trimmed.endswith("}"):
             try:
                 # オブジェクトとして解析できるかチェック
-                obj = original_loads(s, *args, **kwargs)
-                # データの最初の数文字をデバッグ用に出力
-                if len(s) > 20:
-                    print(f"JSONデータの先頭20文字: '{s[:20]}...'")
-                else:
-                    print(f"JSONデータ: '{s}'")
-                return obj
+                return original_loads(s, *args, **kwargs)
             except Exception:
                 # 何かエラーが発生した場合は通常の処理に戻る
                 pass
         
-        # データの最初の数文字をデバッグ用に出力
-        if len(s) > 20:
-            print(f"JSONデータの先頭20文字: '{s[:20]}...'")
-        else:
-            print(f"JSONデータ: '{s}'")
-            
         return original_loads(s, *args, **kwargs)
     except json.JSONDecodeError as e:
         print(f"JSONデコードエラーをキャッチしました: {e}")
@@ -72,7 +61,40 @@ def safe_loads(s, *args, **kwargs):
         traceback.print_exc()
         return []
 
-# jsonモジュールのloads関数をパッチ
+# Fletのイベントを受け取るモジュール（バージョンによって場所が異なるので、見つかったものだけをパッチする）
+FLET_EVENT_MODULES = (
+    "flet_runtime.flet_socket_server",
+    "flet.fastapi.flet_app",
+    "flet.messaging.flet_socket_server",
+    "flet_web.fastapi.flet_app",
+)
+
+class ScopedJSON:
+    """loadsだけをsafe_loadsに差し替えたjsonモジュールの代わり（他の属性は本物のjsonを返す）"""
+
+    loads = staticmethod(safe_loads)
+
+    def __getattr__(self, name):
+        return getattr(json, name)
+
+def apply_flet_patch(module_names=FLET_EVENT_MODULES):
+    """Fletのイベント受信モジュールの中だけでjson.loadsをsafe_loadsにする
+    
+    グローバルなjson.loadsは変更しないので、テンプレートやCSVの読み込み、
+    バッチ処理の進捗の解析には影響しない。パッチしたモジュール名のリストを返す。
+    """
+    patched = []
+    for name in module_names:
+        try:
+            module = importlib.import_module(name)
+        except Exception:
+            continue
+        if getattr(module, "json", None) is json:
+            module.json = ScopedJSON()
+            patched.append(name)
+    return patched
+
+# jsonモジュールのloads関数をパッチ（プロセス全体に影響するため、通常はapply_flet_patchを使う）
 def apply_patch():
     json.loads = safe_loads
     print("json.loadsをパッチしました。")
@@ -0,0 +1,108 @@
+import importlib.util
+from PIL import Image
+
+# 固定レイヤーの合成方法
+# pil: Image.alpha_composite で各レイヤーの範囲だけを重ねる（既定、以前のキャンバス全体での合成と同じ結果）
+# numpy: 乗算済みアルファの配列に各レイヤーの描画範囲だけを重ねる
+COMPOSITORS = ("pil", "numpy")
+
+def check_compositor(compositor):
+    """合成方法が使えるか確認（使えなければValueError）"""
+    if compositor not in COMPOSITORS:
+        raise ValueError(f"未対応の合成方法です: {compositor}")
+    if compositor == "numpy" and importlib.util.find_spec("numpy") is None:
+        raise ValueError("numpyで合成するにはNumPyが必要です（pip install numpy）")
+
+def flatten_layers(canvas_size, layers, compositor="pil"):
+    """(RGBA画像, 位置) のリストを重なり順に合成した、キャンバスと同じ大きさの画像を返す
+
+    pilとnumpyの結果は、不透明な背景に重ねたときに各チャンネル1〜2程度の差に収まる。
+    """
+    if compositor == "numpy":
+        return _flatten_numpy(canvas_size, layers)
+    return _flatten_pil(canvas_size, layers)
+
+def _flatten_pil(canvas_size, layers):
+    """先頭のレイヤーをキャンバスの大きさにし、残りはその範囲だけを重ねる
+
+    透明な画素は重ねても変わらないので、キャンバス全体の大きさのレイヤーを
+    作って全体を合成した場合と同じ結果になる。
+    """
+    flattened = None
+    for image, position in layers:
+        x, y = position
+        if flattened is None:
+            if image.size == canvas_size and (x, y) == (0, 0):
+                flattened = image.copy()
+            else:
+                flattened = Image.new('RGBA', canvas_size, (0, 0, 0, 0))
+                flattened.paste(image, (x, y))
+            continue
+
+        # alpha_compositeの位置は負にできないので、はみ出す分は重ねる画像の側をずらす
+        dest = (max(x, 0), max(y, 0))
+        source = (dest[0] - x, dest[1] - y)
+        if source[0] >= image.width or source[1] >= image.height or dest[0] >= canvas_size[0] or dest[1] >= canvas_size[1]:
+            continue
+        flattened.alpha_composite(image, dest, source)
+    return flattened
+
+def _clip_box(image, position, canvas_size):
+    """レイヤーの描画範囲（透明でない部分）をキャンバス上の座標で返す（範囲がなければNone）"""
+    bbox = image.getbbox()
+    if bbox is None:
+        return None
+    x, y = position
+    box = (
+        max(bbox[0] + x, 0),
+        max(bbox[1] + y, 0),
+        min(bbox[2] + x, canvas_size[0]),
+        min(bbox[3] + y, canvas_size[1])
+    )
+    if box[0] >= box[2] or box[1] >= box[3]:
+        return None
+    return box
+
+def _flatten_numpy(canvas_size, layers):
+    """乗算済みアルファの配列に、各レイヤーの描画範囲だけを"over"で重ねる
+
+    重ねる範囲はすべてのレイヤーの描画範囲を合わせた矩形に限る。
+    """
+    import numpy as np
+
+    boxes = [(image, tuple(position), _clip_box(image, tuple(position), canvas_size)) for image, position in layers]
+    boxes = [entry for entry in boxes if entry[2] is not None]
+    flattened = Image.new('RGBA', canvas_size, (0, 0, 0, 0))
+    if not boxes:
+        return flattened
+
+    left = min(box[0] for _, _, box in boxes)
+    top = min(box[1] for _, _, box in boxes)
+    right = max(box[2] for _, _, box in boxes)
+    bottom = max(box[3] for _, _, box in boxes)
+
+    # チャンネルごとの平面（4, 高さ, 幅）で持つ。RGBはアルファを乗算済み、いずれも0〜255の範囲
+    # （画素ごとにRGBAが並ぶ配列のままだと最も内側のループが4要素しかなく遅いので、
+    # 読み書きはPillowのsplit・mergeでチャンネルごとの連続した配列にする）
+    accumulated = np.zeros((4, bottom - top, right - left), np.float32)
+    for image, (x, y), box in boxes:
+        bands = image.crop((box[0] - x, box[1] - y, box[2] - x, box[3] - y)).split()
+        alpha = np.asarray(bands[3], dtype=np.float32)
+        region = accumulated[:, box[1] - top:box[3] - top, box[0] - left:box[2] - left]
+        region *= 1.0 - alpha * np.float32(1.0 / 255.0)
+        region[3] += alpha
+        alpha *= np.float32(1.0 / 255.0)
+        for channel in range(3):
+            region[channel] += np.asarray(bands[channel], dtype=np.float32) * alpha
+
+    # 乗算済みアルファから戻す（透明な画素のRGBは0）
+    alpha = accumulated[3]
+    scale = np.divide(np.float32(255.0), alpha, out=np.zeros_like(alpha), where=alpha > 0)
+    planes = accumulated[:3] * scale
+    planes += 0.5
+    np.clip(planes, 0, 255, out=planes)
+    alpha += 0.5
+    np.clip(alpha, 0, 255, out=alpha)
+    bands = [Image.fromarray(plane.astype(np.uint8)) for plane in (*planes, alpha)]
+    flattened.paste(Image.merge('RGBA', bands), (left, top))
+    return flattened
@@ -1,6 +1,6 @@
-import flet as ft
 import os
 import sys
+import json
 import argparse
 import traceback
 
@@ -11,18 +11,23 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 def abs_path(rel_path):
     return os.path.join(script_dir, rel_path)
 
-# パッチを適用
-try:
-    from json_patch import apply_patch
-    apply_patch()
-except Exception as e:
-    print(f"パッチの適用に失敗しました: {e}")
-    traceback.print_exc()
-
-from ui.main_view import MainView
+# バッチ処理ではGUI（flet・ui）を読み込まない（起動を速くするため、GUIはrun_flet_appで読み込む）
 from image_processor import ImageProcessor
 from template_manager import TemplateManager
 from data_handler import DataHandler
+from batch_manifest import BatchManifest, MANIFEST_FILENAME
+from batch_journal import BatchJournal, JOURNAL_FILENAME
+from batch_shard import Shard, SHARD_MODES, load_reports, merge_reports
+from image_encoder import ImageEncoder
+from batch_pipeline import BatchPipeline
+from batch_engine import RenderTarget
+from batch_report import BatchReport
+from batch_progress import emit_event
+from font_resolver import FontResolver
+from product_cache import ProductImageCache
+from image_index import ImageIndex
+from layer_compositor import COMPOSITORS, check_compositor
+from render_server import RenderServer, find_server, DEFAULT_PORT
 
 # グローバルな例外ハンドラ
 def global_exception_handler(exctype, value, tb):
@@ -36,53 +41,275 @@ def global_exception_handler(exctype, value, tb):
 # グローバル例外ハンドラを設定
 sys.excepthook = global_exception_handler
 
-def batch_process(csv_path, image_folder, output_folder, template_path):
-    """バッチ処理を実行する関数"""
+def resolve_template_paths(template_paths, template_manager):
+    """--templateの指定をテンプレートファイルのリストに展開（フォルダは中のテンプレートすべて）"""
+    resolved = []
+    for path in template_paths:
+        if os.path.isdir(path):
+            resolved.extend(template_manager.get_template_paths(path))
+        else:
+            resolved.append(path)
+    return resolved
+
+def batch_process(csv_path, image_folder, output_folder, template_path, workers=1, incremental=False, output_options=None, pipeline=None, report=None, progress_format="text", font_dirs=None, product_cache=None, recursive_images=False, resume=False, shard=None, image_processor=None, pool=None, cancel=None, compositor="pil", stream=None):
+    """バッチ処理を実行する関数（progress_formatが"jsonl"なら進捗をJSON Linesで出力）
+    
+    template_pathにテンプレートファイルを1つ指定した場合は出力先フォルダに直接保存する。
+    複数のファイルやテンプレートフォルダを指定した場合は、CSVと商品画像を1回だけ読み込んで
+    すべてのテンプレートに描画し、出力先フォルダの中のテンプレート名（ファイル名）のフォルダに保存する。
+    商品画像フォルダは最初に1回だけ走査し（recursive_imagesならサブフォルダも）、
+    見つからない商品画像は描画を始める前にまとめて表示する。
+    描画が終わった行は出力フォルダのジャーナルに記録し、resumeなら中断した実行で
+    描画済みの行を省略して続きから処理する。
+    shard（batch_shard.Shard）を指定すると担当する行だけを処理し、マニフェストとジャーナルは
+    シャードごとのファイルに保存する（複数のシャードが同じ出力先フォルダを使える）。
+    image_processor・pool・cancelはレンダーサーバーが常駐ワーカーで処理するときに渡す。
+    compositorはテンプレートの固定レイヤーをまとめる合成方法（pil・numpy）。
+    streamを渡すとログと進捗をそこに書き出す（省略時は標準出力。レンダーサーバーはジョブのログを渡す）。
+    """
     template_manager = TemplateManager()
-    data_handler = DataHandler()
-    image_processor = ImageProcessor()
+    data_handler = DataHandler(stream)
+    if image_processor is None:
+        image_processor = ImageProcessor(FontResolver(font_dirs), product_cache, compositor=compositor)
     
     try:
-        # CSVデータを読み込み
-        csv_data = data_handler.load_csv(csv_path)
+        # CSVデータを読み込み（1行ずつ読みながら処理する）
+        csv_data = data_handler.stream_csv(csv_path)
         if csv_data is None:
-            print("CSVファイルの読み込みに失敗しました")
+            print("CSVファイルの読み込みに失敗しました", file=stream)
             return False
+        total = data_handler.count_csv_rows(csv_path)
+        if shard is not None:
+            shard.total_rows = total
+            total = sum(1 for _ in shard.filter(enumerate(data_handler.stream_csv(csv_path) or [])))
+            print(f"シャード {shard.index}/{shard.count}（{shard.mode}）: 担当 {total}行 / 全 {shard.total_rows}行", file=stream)
         
-        # テンプレートを読み込み
-        template = template_manager.data_handler.load_template(template_path)
-        if template is None:
-            print(f"テンプレートの読み込みに失敗しました: {template_path}")
+        # 商品画像フォルダの索引（行ごとにファイルの存在を確認しない）
+        image_index = ImageIndex(image_folder, recursive=recursive_images)
+        rows = enumerate(data_handler.stream_csv(csv_path) or [])
+        image_index.report_missing(shard.filter(rows) if shard is not None else rows, stream)
+        
+        # ファイルを1つだけ指定した場合は出力先フォルダに直接保存する
+        requested = [template_path] if isinstance(template_path, str) else list(template_path)
+        fan_out = len(requested) != 1 or os.path.isdir(requested[0])
+        template_paths = resolve_template_paths(requested, template_manager)
+        if not template_paths:
+            print(f"テンプレートが見つかりません: {', '.join(requested)}", file=stream)
+            return False
+        names = [os.path.splitext(os.path.basename(path))[0] for path in template_paths]
+        if fan_out and len(set(names)) != len(names):
+            print("出力フォルダ名が重複するため、同じファイル名のテンプレートは同時に指定できません", file=stream)
             return False
         
-        # テンプレートの色情報をタプルに変換
-        for text_elem in template.get("text_elements", []):
-            if "color" in text_elem and isinstance(text_elem["color"], list):
-                text_elem["color"] = tuple(text_elem["color"])
+        targets = []
+        for path, name in zip(template_paths, names):
+            # テンプレートを読み込み（内容の問題は描画を始める前にすべて表示される）
+            template = data_handler.load_template(path)
+            if template is None:
+                print(f"テンプレートの読み込みに失敗しました: {path}", file=stream)
+                return False
+            
+            # 出力形式（テンプレートの"output"設定をコマンドラインの指定で上書き）
+            try:
+                encoder = ImageEncoder.from_template(template, output_options)
+            except ValueError as e:
+                print(f"出力設定が不正です（{path}）: {e}", file=stream)
+                return False
+            
+            target_folder = os.path.join(output_folder, name) if fan_out else output_folder
+            
+            os.makedirs(target_folder, exist_ok=True)
+            
+            # 差分処理の場合は前回のマニフェストと比較する
+            manifest = None
+            if incremental:
+                manifest = BatchManifest(target_folder, template, encoder,
+                                         shard.filename(MANIFEST_FILENAME) if shard is not None else MANIFEST_FILENAME, stream)
+            
+            # シャードで出力フォルダを共有する場合、一時ファイルにはシャード名を含める
+            targets.append(RenderTarget(name, template, encoder, target_folder, manifest,
+                                        temp_tag=shard.label if shard is not None else None))
+        
+        # 中断したときに続きから再開できるよう、描画が終わった行をジャーナルに記録する
+        for target in targets:
+            target.journal = BatchJournal(target.output_folder, target.template, target.encoder, resume=resume,
+                                          filename=shard.filename(JOURNAL_FILENAME) if shard is not None else JOURNAL_FILENAME,
+                                          temp_tag=target.temp_tag, stream=stream)
+        
+        if fan_out:
+            print(f"テンプレート {len(targets)}件: {', '.join(target.name for target in targets)}", file=stream)
         
         # 進捗表示コールバック
         def progress_callback(current, total):
-            print(f"処理中... {current}/{total} 完了")
+            if progress_format == "jsonl":
+                emit_event({"event": "progress", "current": current, "total": total}, stream)
+            else:
+                print(f"処理中... {current}/{total} 完了", file=stream)
+        
+        if progress_format == "jsonl":
+            emit_event({"event": "start", "total": total}, stream)
         
         # 画像処理実行
-        processed, errors = image_processor.batch_process(
+        processed, errors = image_processor.batch_process_targets(
             csv_data, 
             image_folder, 
-            template, 
-            output_folder, 
-            progress_callback=progress_callback
+            targets, 
+            progress_callback=progress_callback,
+            workers=workers,
+            total=total,
+            pipeline=pipeline,
+            report=report,
+            image_index=image_index,
+            shard=shard,
+            pool=pool,
+            cancel=cancel,
+            stream=stream
         )
         
-        print(f"バッチ処理完了: 処理件数 {processed}件, エラー {errors}件")
+        if pipeline is not None:
+            print(f"ステージ稼働率: {pipeline.summary()}", file=stream)
+        
+        for target in targets:
+            if target.manifest is not None:
+                label = f"（{target.name}）" if fan_out else ""
+                print(f"差分処理{label}: 変更なし {target.manifest.skipped}件, 削除 {target.manifest.removed}件", file=stream)
+        print(f"バッチ処理完了: 処理件数 {processed}件, エラー {errors}件", file=stream)
+        if progress_format == "jsonl":
+            # すべてのテンプレートで変更がない・処理済みのため省略した行数
+            skipped = total - processed - errors if (incremental or resume) else 0
+            emit_event({"event": "done", "processed": processed, "errors": errors, "skipped": skipped}, stream)
         return True
     except Exception as e:
-        print(f"バッチ処理でエラーが発生しました: {str(e)}")
-        traceback.print_exc()
+        print(f"バッチ処理でエラーが発生しました: {str(e)}", file=stream)
+        traceback.print_exc(file=stream)
         return False
 
+def merge_shard_reports(paths, csv_path=None, output_path=None):
+    """シャードごとのレポートを結合して抜けと重複を表示する（問題がなければTrue）
+    
+    pathsにはレポートファイルか、シャードのレポートを保存した出力先フォルダを指定する。
+    csv_pathを指定すると、CSVのIDのうちどのシャードも処理していないものを確認する。
+    """
+    reports = load_reports(paths)
+    if not reports:
+        print(f"シャードのレポートが見つかりません: {', '.join(paths)}")
+        return False
+    
+    expected_ids = None
+    if csv_path:
+        rows = DataHandler().stream_csv(csv_path)
+        if rows is None:
+            return False
+        expected_ids = [str(product_data.get('id', index)) for index, product_data in enumerate(rows)]
+    
+    try:
+        merged = merge_reports(reports, expected_ids)
+    except ValueError as e:
+        print(f"レポートを結合できません: {e}")
+        return False
+    
+    summary = merged["summary"]
+    shards = merged["shards"]
+    print(f"シャード {len(reports)}/{shards['count']}件を結合: 処理件数 {summary['processed']}件, エラー {summary['errors']}件, 省略 {summary['skipped']}件")
+    problems = [
+        ("レポートのないシャード", shards["missing_shards"]),
+        ("レポートが重複しているシャード", shards["duplicate_shards"]),
+        ("どのシャードも処理していないID", shards["missing_ids"] or []),
+        ("複数回処理されたID", shards["duplicate_ids"])
+    ]
+    for label, values in problems:
+        if values:
+            shown = ", ".join(str(value) for value in values[:20])
+            print(f"{label}: {len(values)}件 ({shown}{', ...' if len(values) > 20 else ''})")
+    
+    if output_path:
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(merged, f, indent=4, ensure_ascii=False)
+        print(f"結合したレポートを保存しました: {output_path}")
+    return not any(values for _, values in problems)
+
+def default_report_path(output_folder, report_path=None, shard=None):
+    """計測レポートの保存先（分担して処理する場合は指定がなくても出力先フォルダに保存する）"""
+    if report_path:
+        return os.path.abspath(report_path)
+    if shard is not None:
+        return os.path.join(output_folder, shard.filename("report.json"))
+    return None
+
+def submit_to_server(client, args):
+    """起動中のレンダーサーバーにバッチ処理を投入し、終わるまで進捗を表示する（成功ならTrue）"""
+    from render_server import follow_job, DONE
+    
+    params = {
+        "csv": os.path.abspath(args.csv),
+        "images": os.path.abspath(args.images),
+        "output": os.path.abspath(args.output),
+        "templates": [os.path.abspath(path) for path in args.template],
+        "incremental": args.incremental,
+        "output_options": output_options_from_args(args),
+        "recursive_images": args.recursive_images,
+        "resume": args.resume,
+        "shard": args.shard,
+        "shard_by": args.shard_by,
+        "report": os.path.abspath(args.report) if args.report else None
+    }
+    job = client.submit(params, args.priority)
+    if args.progress_format != "jsonl":
+        print(f"レンダーサーバー（{client.url}）にジョブ {job['id']} を投入しました")
+    status = follow_job(client, job["id"], args.progress_format)
+    if status["error"]:
+        print(f"バッチ処理でエラーが発生しました: {status['error']}")
+    return status["state"] == DONE
+
+def parse_size(value):
+    """WxH形式のサイズを [幅, 高さ] に変換（argparseのtypeに使う）"""
+    try:
+        width, height = (int(part) for part in value.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"WxH形式（例: 200x200）で指定してください: {value}")
+    if width <= 0 or height <= 0:
+        raise argparse.ArgumentTypeError(f"幅と高さは1以上で指定してください: {value}")
+    return [width, height]
+
+def int_range(minimum, maximum):
+    """minimum〜maximumの整数だけを受け付ける変換関数を作成（argparseのtypeに使う）"""
+    def parse(value):
+        try:
+            number = int(value)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"整数で指定してください: {value}")
+        if not minimum <= number <= maximum:
+            raise argparse.ArgumentTypeError(f"{minimum}〜{maximum}の範囲で指定してください: {value}")
+        return number
+    return parse
+
+def output_options_from_args(args):
+    """コマンドライン引数から出力設定の上書き分を作成"""
+    options = {
+        "format": args.format,
+        "quality": args.quality,
+        "compress_level": args.compress_level
+    }
+    if args.thumbnail:
+        options["variants"] = [{"suffix": "_thumb", "size": args.thumbnail}]
+    return options
+
 def run_flet_app(assets_dir):
     """Fletアプリケーションを実行する関数"""
+    # 不正なイベントデータでアプリが止まらないよう、Fletのイベント受信部分だけjson.loadsを差し替える
     try:
+        from json_patch import apply_flet_patch, FLET_EVENT_MODULES
+        if not apply_flet_patch():
+            # このバージョンのFletにはパッチ対象のモジュールがない（不正なイベントデータで止まる可能性がある）
+            print(f"警告: Fletのイベント受信モジュールが見つからないため、JSONのパッチを適用できませんでした: {', '.join(FLET_EVENT_MODULES)}")
+    except Exception as e:
+        print(f"パッチの適用に失敗しました: {e}")
+        traceback.print_exc()
+    
+    try:
+        import flet as ft
+        from ui.main_view import MainView
+        
         # view関数に例外ハンドリングを追加したラッパー
         def wrapped_main_view(page):
             try:
@@ -121,7 +348,33 @@ def main():
     parser.add_argument('--csv', help='商品情報CSVファイルパス')
     parser.add_argument('--images', help='商品画像フォルダパス')
     parser.add_argument('--output', help='出力先フォルダパス')
-    parser.add_argument('--template', help='テンプレートファイルパス')
+    parser.add_argument('--template', nargs='+', help='テンプレートファイルパス（複数のファイルやテンプレートフォルダも指定可）')
+    parser.add_argument('--workers', type=int, default=1, help='並列処理のワーカープロセス数（0でCPUコア数）')
+    parser.add_argument('--incremental', action='store_true', help='前回から入力が変わった行だけを処理')
+    parser.add_argument('--format', choices=['png', 'jpeg', 'webp', 'avif'], help='出力形式（既定はテンプレートの設定またはpng）')
+    parser.add_argument('--quality', type=int_range(1, 100), help='JPEG/WebP/AVIFの画質（1-100）')
+    parser.add_argument('--compress-level', type=int_range(0, 9), help='PNGの圧縮レベル（0-9、既定は1）')
+    parser.add_argument('--thumbnail', type=parse_size, help='縮小版も出力する場合の最大サイズ（例: 200x200）')
+    parser.add_argument('--pipeline', action='store_true', help='読み込み・合成・保存を別スレッドで並行して処理')
+    parser.add_argument('--readers', type=int, default=2, help='パイプラインの読み込みスレッド数')
+    parser.add_argument('--writers', type=int, default=2, help='パイプラインの保存スレッド数')
+    parser.add_argument('--queue-size', type=int, default=16, help='パイプラインの段間キューの上限件数')
+    parser.add_argument('--report', help='処理時間の計測結果を保存するJSONファイルパス')
+    parser.add_argument('--events', help='処理中のイベントをJSON Lines形式で書き出すファイルパス（-で標準出力）')
+    parser.add_argument('--font-dir', action='append', help='フォントを探すフォルダ（複数指定可、OS標準のフォントフォルダより優先）')
+    parser.add_argument('--product-cache', help='リサイズ済みの商品画像をキャッシュするフォルダ')
+    parser.add_argument('--product-cache-size', type=int, default=1024, help='商品画像キャッシュの容量の上限（MB）')
+    parser.add_argument('--resume', action='store_true', help='中断したバッチ処理を続きから再開（前回描画済みの行を省略）')
+    parser.add_argument('--shard', help='複数のマシンで分担する場合の担当分（K/N、Kは1〜N）')
+    parser.add_argument('--shard-by', choices=SHARD_MODES, default='hash', help='シャードへの行の割り当て方法（hash: IDのハッシュ, range: 行番号の範囲）')
+    parser.add_argument('--merge-reports', nargs='+', metavar='PATH', help='シャードごとのレポート（ファイルか出力先フォルダ）を結合して抜けと重複を確認')
+    parser.add_argument('--recursive-images', action='store_true', help='商品画像フォルダのサブフォルダも探す')
+    parser.add_argument('--progress-format', choices=['text', 'jsonl'], default='text', help='進捗の出力形式（jsonlはGUIとの連携用）')
+    parser.add_argument('--compositor', choices=COMPOSITORS, default='pil', help='テンプレートの固定レイヤーの合成方法（numpyは装飾要素が多いテンプレート向け）')
+    parser.add_argument('--serve', action='store_true', help='レンダーサーバーを起動（起動中はバッチ処理をサーバーに投入する）')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help='レンダーサーバーの待ち受けポート（localhostのみ）')
+    parser.add_argument('--priority', type=int, default=0, help='レンダーサーバーに投入するジョブの優先度（大きいほど先に処理）')
+    parser.add_argument('--no-server', action='store_true', help='レンダーサーバーが起動中でもこのプロセスで処理する')
     
     args = parser.parse_args()
     
@@ -135,6 +388,33 @@ def main():
     if not os.path.exists(assets_dir):
         os.makedirs(assets_dir, exist_ok=True)
     
+    # シャードごとのレポートの結合（--csvを指定するとCSVのIDと照合、--reportで結合結果を保存）
+    if args.merge_reports:
+        success = merge_shard_reports(args.merge_reports, args.csv, args.report)
+        sys.exit(0 if success else 1)
+    
+    try:
+        check_compositor(args.compositor)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    
+    # レンダーサーバーの起動
+    if args.serve:
+        product_cache = None
+        if args.product_cache:
+            product_cache = ProductImageCache(os.path.abspath(args.product_cache), args.product_cache_size * 1024 * 1024)
+        try:
+            # --imagesを指定すると、その商品画像フォルダで1枚ずつ画像を合成するAPIも使える
+            server = RenderServer(port=args.port, workers=args.workers, font_dirs=args.font_dir, product_cache=product_cache,
+                                  templates_dir=templates_dir, image_folder=os.path.abspath(args.images) if args.images else None,
+                                  recursive_images=args.recursive_images, compositor=args.compositor)
+        except OSError as e:
+            print(f"レンダーサーバーを起動できません（ポート {args.port}）: {e}")
+            sys.exit(1)
+        server.serve_forever()
+        return
+    
     # バッチモードの場合
     if args.batch:
         if not all([args.csv, args.images, args.output, args.template]):
@@ -145,14 +425,73 @@ def main():
             print("--template: テンプレートファイルパス")
             return
         
+        if args.pipeline and args.workers != 1:
+            print("--pipeline と --workers は同時に指定できません")
+            sys.exit(1)
+        pipeline = BatchPipeline(args.readers, args.writers, args.queue_size) if args.pipeline else None
+        
+        # レンダーサーバーが起動していればそちらで処理する（フォントやテンプレートの準備が済んでいるため速い）。
+        # サーバーの設定で処理するので、パイプライン・イベント出力・フォントやキャッシュ・合成方法の指定がある場合はこのプロセスで処理する
+        if not (args.no_server or args.pipeline or args.events or args.font_dir or args.product_cache or args.compositor != 'pil'):
+            client = find_server()
+            if client is not None:
+                try:
+                    success = submit_to_server(client, args)
+                except (OSError, RuntimeError) as e:
+                    print(f"レンダーサーバーとの通信に失敗しました: {e}")
+                    success = False
+                sys.exit(0 if success else 1)
+        
         # 絶対パスに変換
         csv_path = os.path.abspath(args.csv)
         image_folder = os.path.abspath(args.images)
         output_folder = os.path.abspath(args.output)
-        template_path = os.path.abspath(args.template)
+        template_path = [os.path.abspath(path) for path in args.template]
+        
+        # 計測レポートとイベント出力
+        events = None
+        if args.events == '-':
+            events = sys.stdout
+        elif args.events:
+            events = open(args.events, 'w', encoding='utf-8')
+        # 分担して処理する場合はシャードごとのレポートを必ず保存する（既定は出力先フォルダ）
+        shard = None
+        report_path = args.report
+        if args.shard:
+            try:
+                shard = Shard.parse(args.shard, args.shard_by)
+            except ValueError as e:
+                print(e)
+                sys.exit(1)
+        report_path = default_report_path(output_folder, report_path, shard)
+        report = BatchReport(events) if (report_path or events) else None
+        
+        # リサイズ済みの商品画像のキャッシュ
+        product_cache = None
+        if args.product_cache:
+            product_cache = ProductImageCache(os.path.abspath(args.product_cache), args.product_cache_size * 1024 * 1024)
         
         # バッチ処理実行
-        success = batch_process(csv_path, image_folder, output_folder, template_path)
+        try:
+            success = batch_process(csv_path, image_folder, output_folder, template_path, workers=args.workers, incremental=args.incremental,
+                                    output_options=output_options_from_args(args),
+                                    pipeline=pipeline,
+                                    report=report,
+                                    progress_format=args.progress_format,
+                                    font_dirs=args.font_dir,
+                                    product_cache=product_cache,
+                                    recursive_images=args.recursive_images,
+                                    resume=args.resume,
+                                    shard=shard,
+                                    compositor=args.compositor)
+        finally:
+            if events is not None and events is not sys.stdout:
+                events.close()
+        
+        if report is not None and report_path:
+            os.makedirs(os.path.dirname(report_path), exist_ok=True)
+            report.save(report_path)
+            print(f"計測レポートを保存しました: {report_path}")
         # 終了コードを設定
         sys.exit(0 if success else 1)
     else:
@@ -0,0 +1,78 @@
+import io
+import os
+import base64
+import threading
+from PIL import Image
+from image_processor import ImageProcessor
+from template_compiler import AssetCache, scale_point
+
+# プレビューの既定の縮尺とリサンプリング方法（速度優先）
+PREVIEW_SCALE = 0.5
+PREVIEW_RESAMPLE = Image.BILINEAR
+
+# 編集が止まってから描画するまでの待ち時間（秒）
+PREVIEW_DELAY = 0.3
+
+class PreviewRenderer:
+    """テンプレート編集中のプレビューを縮小サイズで描画する
+
+    背景・装飾画像・商品画像・固定テキストはAssetCacheに保持するので、
+    編集のたびに描き直すのは変更された要素とレイヤーの重ね合わせだけになる。
+    product_cacheにProductImageCacheを渡すと、リサイズ済みの商品画像をディスクにも保存する。
+    """
+
+    def __init__(self, processor=None, scale=PREVIEW_SCALE, resample=PREVIEW_RESAMPLE, product_cache=None):
+        self.processor = processor or ImageProcessor(product_cache=product_cache)
+        self.scale = scale
+        self.resample = resample
+        self.assets = AssetCache()
+
+    def render(self, template, product_data, product_image_path=None):
+        """サンプルの商品データでテンプレートを適用した縮小画像を返す"""
+        compiled = self.processor.compile_template(template, self.scale, self.resample, self.assets)
+        return self.processor.compose(self._load_product(product_image_path, compiled), product_data, compiled)
+
+    def render_base64(self, template, product_data, product_image_path=None):
+        """プレビュー画像をPNGのbase64文字列で返す（ft.Imageのsrc_base64用）"""
+        buffer = io.BytesIO()
+        self.render(template, product_data, product_image_path).save(buffer, "PNG", compress_level=1)
+        return base64.b64encode(buffer.getvalue()).decode('ascii')
+
+    def _load_product(self, product_image_path, compiled):
+        """商品画像を読み込む（見つからなければ灰色の仮画像）"""
+        if product_image_path and os.path.exists(product_image_path):
+            try:
+                key = ("product", product_image_path, os.path.getmtime(product_image_path),
+                       compiled.product_size, compiled.scale, compiled.resample)
+                return self.assets.get_or_create(
+                    key, lambda: self.processor.load_product_image(product_image_path, compiled)
+                )
+            except Exception as e:
+                print(f"プレビュー用商品画像の読み込みエラー: {e}")
+
+        size = compiled.product_size or scale_point((300, 300), compiled.scale)
+        return Image.new('RGBA', size, (200, 200, 200, 255))
+
+class Debouncer:
+    """連続した呼び出しをまとめ、最後の呼び出しから一定時間後に別スレッドで1回だけ実行する"""
+
+    def __init__(self, func, delay=PREVIEW_DELAY):
+        self.func = func
+        self.delay = delay
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = threading.Timer(self.delay, self.func, args, kwargs)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def cancel(self):
+        """予約中の実行を取り消す"""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
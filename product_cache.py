@@ -0,0 +1,116 @@
+import os
+import hashlib
+import threading
+from PIL import Image
+
+# 既定のキャッシュフォルダと容量の上限
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage", "cache", "products")
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# 上限を超えたとき、この割合まで減らす（削除のたびにフォルダを走査しないよう余裕を持たせる）
+EVICT_RATIO = 0.9
+
+CACHE_EXTENSION = ".png"
+
+class ProductImageCache:
+    """リサイズ済みの商品画像をディスクに保持するキャッシュ
+
+    同じ商品画像を複数のテンプレートや毎晩のバッチで使い回すときに、
+    デコードとリサイズを省く。キーは元画像のパス・サイズ・更新日時と
+    リサイズ後のサイズ・リサンプリング方法で、元画像が差し替えられれば別のキーになる。
+    合計サイズが上限を超えると、最後に使われたのが古いものから削除する。
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self._entries())
+
+    def key(self, source_path, size, resample):
+        """キャッシュのキー（ファイル名）を作成"""
+        stat = os.stat(source_path)
+        text = f"{os.path.abspath(source_path)}|{stat.st_size}|{stat.st_mtime_ns}|{size[0]}x{size[1]}|{int(resample)}"
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, source_path, size, resample):
+        """キャッシュ済みの画像をRGBAで返す（なければNone）"""
+        path = self._path(self.key(source_path, size, resample))
+        try:
+            with Image.open(path) as image:
+                image = image.convert('RGBA')
+        except (OSError, ValueError):
+            # 未作成、または他のプロセスが削除・書き込み中
+            self.misses += 1
+            return None
+
+        # 最後に使った日時を更新（LRUの順序に使う）
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return image
+
+    def put(self, source_path, size, resample, image):
+        """リサイズ済みの画像を保存"""
+        path = self._path(self.key(source_path, size, resample))
+        # パイプラインの読み込みスレッドが同じ画像を同時に保存しても衝突しないよう、スレッドごとの一時ファイルにする
+        temp_path = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        try:
+            # 読み込みの速さを優先して圧縮は最小限にする
+            image.save(temp_path, "PNG", compress_level=1)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"商品画像キャッシュの保存エラー: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+
+        self.total_bytes += os.path.getsize(path)
+        if self.total_bytes > self.max_bytes:
+            self.evict()
+
+    def load(self, source_path, size, resample, decode):
+        """キャッシュから画像を取得し、なければdecode()で作成して保存"""
+        image = self.get(source_path, size, resample)
+        if image is None:
+            image = decode()
+            self.put(source_path, size, resample, image)
+        return image
+
+    def evict(self):
+        """最後に使われたのが古いものから削除し、合計サイズを上限の9割まで減らす"""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        limit = self.max_bytes * EVICT_RATIO
+        for path, size, _ in entries:
+            if total <= limit:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # 他のプロセスが先に削除した
+                pass
+            total -= size
+        self.total_bytes = total
+
+    def _path(self, key):
+        """キーに対応するファイルパス"""
+        return os.path.join(self.cache_dir, key + CACHE_EXTENSION)
+
+    def _entries(self):
+        """キャッシュ済みのファイルの (パス, サイズ, 最終使用日時) の一覧"""
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for entry in it:
+                if not entry.name.endswith(CACHE_EXTENSION):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
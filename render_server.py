@@ -0,0 +1,627 @@
+import os
+import sys
+import json
+import time
+import heapq
+import itertools
+import threading
+from collections import deque
+from batch_progress import parse_event
+
+# 既定の待ち受けアドレス（外部からは接続できないようlocalhostのみ）
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+
+# 起動中のサーバーのアドレスとトークンを記録するファイル（CLIとGUIはこれを見てサーバーに接続する）
+STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "storage", "render_server.json")
+
+# すべての要求に必要なトークンのヘッダー（値は状態ファイルに記録する）
+TOKEN_HEADER = "X-Render-Token"
+
+# 画像を合成して返すAPI（/render/<テンプレートID>）が使うテンプレートフォルダの既定値
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+
+# GETで画像を合成するとき、商品データではなく出力設定として扱うクエリパラメータ
+OUTPUT_PARAMS = ("format", "quality")
+
+# ジョブごとに保持するログの行数
+MAX_LOG_LINES = 1000
+
+# ジョブの状態（FINISHED_STATESになったら変わらない）
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+class Job:
+    """レンダーサーバーで処理する1回分のバッチ処理
+
+    paramsはmain.batch_processに渡す内容（csv, images, output, templates と任意の設定）。
+    ログはbatch_processが書き出した行で、進捗イベント（JSON Lines）から進捗と件数を更新する。
+    """
+
+    def __init__(self, job_id, params, priority=0):
+        self.id = job_id
+        self.params = params
+        self.priority = priority
+        self.state = QUEUED
+        self.cancel = threading.Event()
+        self.current = 0
+        self.total = None
+        self.processed = 0
+        self.errors = 0
+        self.skipped = 0
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.log = deque(maxlen=MAX_LOG_LINES)
+        self.log_count = 0
+        self._lock = threading.Lock()
+
+    def append_log(self, line):
+        """ログに1行追加し、進捗イベントなら状態を更新"""
+        event = parse_event(line)
+        with self._lock:
+            if event is not None:
+                if event["event"] == "start":
+                    self.total = event.get("total")
+                elif event["event"] == "progress":
+                    self.current = event.get("current", self.current)
+                    self.total = event.get("total", self.total)
+                elif event["event"] == "done":
+                    self.processed = event.get("processed", 0)
+                    self.errors = event.get("errors", 0)
+                    self.skipped = event.get("skipped", 0)
+            self.log.append(line)
+            self.log_count += 1
+
+    def to_dict(self, log_offset=None):
+        """状態を辞書で返す（log_offsetを指定するとその行以降のログを含める）"""
+        with self._lock:
+            status = {
+                "id": self.id,
+                "state": self.state,
+                "priority": self.priority,
+                "params": self.params,
+                "current": self.current,
+                "total": self.total,
+                "processed": self.processed,
+                "errors": self.errors,
+                "skipped": self.skipped,
+                "error": self.error,
+                "created": self.created,
+                "started": self.started,
+                "finished": self.finished
+            }
+            if log_offset is not None:
+                # 保持している範囲より前のログは捨てられている
+                first = self.log_count - len(self.log)
+                start = max(log_offset, first)
+                status["log"] = list(itertools.islice(self.log, start - first, None))
+                status["log_offset"] = self.log_count
+            return status
+
+class JobLog:
+    """batch_processのstreamに渡し、書き込まれた行をジョブのログに追加する"""
+
+    def __init__(self, job):
+        self.job = job
+        self._buffer = ""
+
+    def write(self, text):
+        self._buffer += text
+        while "\n" in self._buffer:
+            line, self._buffer = self._buffer.split("\n", 1)
+            self.job.append_log(line)
+        return len(text)
+
+    def flush(self):
+        pass
+
+class JobQueue:
+    """優先度つきのジョブの待ち行列（優先度の高い順、同じなら投入順）"""
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def __len__(self):
+        with self._condition:
+            return sum(1 for _, _, job in self._heap if job.state == QUEUED)
+
+    def put(self, job):
+        with self._condition:
+            heapq.heappush(self._heap, (-job.priority, next(self._counter), job))
+            self._condition.notify()
+
+    def get(self):
+        """次のジョブを返す（なければ待つ、閉じられたらNone）。中止済みのジョブは飛ばす"""
+        with self._condition:
+            while True:
+                while self._heap and self._heap[0][2].state != QUEUED:
+                    heapq.heappop(self._heap)
+                if self._heap:
+                    return heapq.heappop(self._heap)[2]
+                if self._closed:
+                    return None
+                self._condition.wait()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+class RenderServer:
+    """常駐するレンダーサーバー（localhostのHTTPでジョブを受け付ける）
+
+    ジョブは優先度順に1件ずつ処理する。フォント・テキストのマスク・デコード済みの背景や
+    装飾画像はジョブをまたいで保持し、workersが2以上なら常駐ワーカーのプール（WarmPool）で
+    並列に描画するので、バッチごとにPythonやPillowを起動し直す必要がない。
+
+    ジョブとは別に、1枚の画像をその場で合成して返すAPI（RenderService）も提供する。
+    templates_dirのテンプレートとimage_folderの商品画像を使う。
+
+    待ち受けはlocalhostのみで、要求には状態ファイルに記録したトークン（TOKEN_HEADER）が必要。
+    ブラウザから送られた要求（Originヘッダーがある）とJSON以外のPOSTは受け付けない。
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=1, font_dirs=None, product_cache=None, state_path=STATE_PATH,
+                 templates_dir=TEMPLATES_DIR, image_folder=None, recursive_images=False, compositor="pil"):
+        from image_processor import ImageProcessor
+        from font_resolver import FontResolver
+        from template_compiler import AssetCache
+        from batch_engine import WarmPool, resolve_workers
+        from render_service import RenderService
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        import secrets
+
+        self.token = secrets.token_urlsafe(32)
+        self.processor = ImageProcessor(FontResolver(font_dirs), product_cache, AssetCache(), compositor)
+        # ジョブの処理と並行して呼ばれるので、フォント・テキストのマスクなどのキャッシュは別に持つ
+        # （代用フォントの警告やヒット件数がジョブのものと混ざらないようにする）
+        self.render_service = RenderService(
+            templates_dir, image_folder,
+            ImageProcessor(FontResolver(font_dirs), product_cache, AssetCache(), compositor),
+            recursive_images=recursive_images
+        )
+        self.workers = resolve_workers(workers)
+        self.pool = WarmPool(self.workers, font_dirs, product_cache, compositor) if self.workers > 1 else None
+        self.state_path = state_path
+        self.queue = JobQueue()
+        self.jobs = {}
+        self.current = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        handler = type("RenderServerHandler", (_RequestHandler, BaseHTTPRequestHandler), {})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.httpd.render_server = self
+        self._threads = []
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def submit(self, params, priority=0):
+        """ジョブを投入"""
+        for key in ("csv", "images", "output", "templates"):
+            if not params.get(key):
+                raise ValueError(f"{key}が指定されていません")
+        with self._lock:
+            job = Job(str(next(self._ids)), params, priority)
+            self.jobs[job.id] = job
+        self.queue.put(job)
+        return job
+
+    def cancel(self, job_id):
+        """ジョブを中止（待機中なら処理せず、処理中なら新しい行の投入をやめる）"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        job.cancel.set()
+        with job._lock:
+            if job.state == QUEUED:
+                job.state = CANCELLED
+                job.finished = time.time()
+        return job
+
+    def status(self):
+        """サーバーの状態"""
+        return {
+            "pid": os.getpid(),
+            "url": self.url,
+            "workers": self.workers,
+            "queued": len(self.queue),
+            "running": self.current.id if self.current is not None else None,
+            "jobs": len(self.jobs),
+            "render_cache": {
+                "entries": len(self.render_service.cache),
+                "bytes": self.render_service.cache.size,
+                "hits": self.render_service.cache.hits,
+                "misses": self.render_service.cache.misses
+            }
+        }
+
+    def start(self):
+        """HTTPの待ち受けとジョブの処理を別スレッドで開始し、アドレスとトークンを記録する"""
+        self._threads = [
+            threading.Thread(target=self.httpd.serve_forever, daemon=True),
+            threading.Thread(target=self._run_jobs, daemon=True)
+        ]
+        for thread in self._threads:
+            thread.start()
+        if self.state_path:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            # トークンを含むので本人だけが読めるように作る
+            fd = os.open(self.state_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with open(fd, 'w', encoding='utf-8') as f:
+                json.dump({"url": self.url, "pid": os.getpid(), "token": self.token}, f)
+
+    def serve_forever(self):
+        """Ctrl+Cかshutdownの要求まで処理を続ける"""
+        self.start()
+        threads = self._threads
+        print(f"レンダーサーバーを起動しました: {self.url}（ワーカー {self.workers}）")
+        try:
+            while any(thread.is_alive() for thread in threads):
+                time.sleep(0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        """待ち受けを終了（処理中のジョブは中止する。2回目以降の呼び出しは何もしない）"""
+        with self._lock:
+            threads, self._threads = self._threads, None
+        if threads is None:
+            return
+        if self.current is not None:
+            self.current.cancel.set()
+        self.queue.close()
+        if threads:
+            self.httpd.shutdown()
+        self.httpd.server_close()
+        for thread in threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=30)
+        if self.pool is not None:
+            self.pool.shutdown()
+        if self.state_path and os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    if json.load(f).get("url") == self.url:
+                        os.remove(self.state_path)
+            except (OSError, ValueError):
+                pass
+
+    def _run_jobs(self):
+        """待ち行列のジョブを順に処理"""
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            with job._lock:
+                if job.state != QUEUED:
+                    continue
+                job.state = RUNNING
+                job.started = time.time()
+            self.current = job
+            try:
+                # 処理中の出力（進捗イベントを含む）はジョブのログに記録する
+                # （標準出力は差し替えないので、並行して処理する画像の合成の出力は混ざらない）
+                success = self._execute(job, JobLog(job))
+                state = CANCELLED if job.cancel.is_set() else (DONE if success else FAILED)
+            except Exception as e:
+                job.error = str(e)
+                state = FAILED
+            with job._lock:
+                job.state = state
+                job.finished = time.time()
+            self.current = None
+
+    def _execute(self, job, log):
+        """ジョブのバッチ処理を実行（出力はlogに書き出す）"""
+        from main import batch_process, default_report_path
+        from batch_report import BatchReport
+        from batch_shard import Shard
+
+        params = job.params
+        output_folder = os.path.abspath(params["output"])
+        shard = Shard.parse(params["shard"], params.get("shard_by", "hash")) if params.get("shard") else None
+        report_path = default_report_path(output_folder, params.get("report"), shard)
+        report = BatchReport() if report_path else None
+
+        success = batch_process(
+            os.path.abspath(params["csv"]),
+            os.path.abspath(params["images"]),
+            output_folder,
+            [os.path.abspath(path) for path in params["templates"]],
+            incremental=params.get("incremental", False),
+            output_options=params.get("output_options"),
+            report=report,
+            progress_format="jsonl",
+            recursive_images=params.get("recursive_images", False),
+            resume=params.get("resume", False),
+            shard=shard,
+            image_processor=self.processor,
+            pool=self.pool,
+            cancel=job.cancel,
+            stream=log
+        )
+        if report is not None:
+            os.makedirs(os.path.dirname(report_path), exist_ok=True)
+            report.save(report_path)
+            print(f"計測レポートを保存しました: {report_path}", file=log)
+        return success
+
+class _RequestHandler:
+    """レンダーサーバーのHTTP API（BaseHTTPRequestHandlerと組み合わせて使う）
+
+    http.serverやurllibは読み込みに時間がかかるため、バッチ処理の起動を遅くしないよう
+    サーバーやクライアントを使うときに読み込む。
+    すべての要求にトークンのヘッダー（TOKEN_HEADER）が必要で、Originヘッダーのある要求
+    （ブラウザから送られたもの）は拒否し、POSTの本文はapplication/jsonに限る。
+
+    GET  /status                 サーバーの状態
+    GET  /jobs                   ジョブの一覧
+    GET  /jobs/<id>?log=<行番号>  ジョブの状態（その行以降のログを含む）
+    POST /jobs                   ジョブの投入 {"params": {...}, "priority": 0}
+    POST /jobs/<id>/cancel       ジョブの中止
+    POST /shutdown               サーバーの終了
+    GET  /render/<テンプレートID>?id=...&image_file=...&<列名>=...&format=...&quality=...
+    POST /render/<テンプレートID>  {"fields": {...}, "output": {...}}
+                                 合成した画像（If-None-Matchが一致すれば304）
+    """
+
+    def log_message(self, format, *args):
+        # アクセスログは出さない（進捗のポーリングで溢れるため）
+        pass
+
+    def _send(self, status, body):
+        data = json.dumps(body, ensure_ascii=False, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_image(self, rendered):
+        etag = f'"{rendered.etag}"'
+        if rendered.data is None:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", rendered.content_type)
+        self.send_header("Content-Length", str(len(rendered.data)))
+        self.send_header("ETag", etag)
+        # キャッシュしてよいが、使う前にETagで確認する
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        self.wfile.write(rendered.data)
+
+    def _render(self, template_id, fields, output):
+        """画像を合成して返す"""
+        if_none_match = self.headers.get("If-None-Match", "").strip().strip('"') or None
+        try:
+            rendered = self.server.render_server.render_service.render(template_id, fields, output, if_none_match)
+        except LookupError as e:
+            self._send(404, {"error": str(e)})
+            return
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+            return
+        self._send_image(rendered)
+
+    def _authorize(self):
+        """要求を受け付けてよいか確認し、だめならエラーを返してFalse
+
+        ブラウザは任意のページからlocalhostへのPOSTを送れるので、Originヘッダーのある要求と
+        （プリフライトなしで送れる）JSON以外のPOSTは拒否し、トークンで呼び出し元を確認する。
+        """
+        import hmac
+
+        if self.headers.get("Origin") is not None:
+            self._send(403, {"error": "ブラウザからの要求は受け付けません"})
+            return False
+        token = self.headers.get(TOKEN_HEADER, "")
+        if not hmac.compare_digest(token.encode('utf-8'), self.server.render_server.token.encode('utf-8')):
+            self._send(401, {"error": "トークンが正しくありません"})
+            return False
+        if self.command == "POST":
+            content_type = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if content_type != "application/json":
+                self._send(415, {"error": "Content-Typeはapplication/jsonで指定してください"})
+                return False
+        return True
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not isinstance(body, dict):
+            raise ValueError("JSONのオブジェクトで指定してください")
+        return body
+
+    def _path(self):
+        from urllib.parse import unquote, parse_qsl
+
+        path, _, query = self.path.partition("?")
+        parts = [unquote(part) for part in path.split("/") if part]
+        return parts, dict(parse_qsl(query))
+
+    def do_GET(self):
+        if not self._authorize():
+            return
+        server = self.server.render_server
+        parts, options = self._path()
+        if parts == ["status"]:
+            self._send(200, server.status())
+        elif parts == ["jobs"]:
+            self._send(200, {"jobs": [job.to_dict() for job in server.jobs.values()]})
+        elif len(parts) == 2 and parts[0] == "jobs" and parts[1] in server.jobs:
+            try:
+                log_offset = int(options.get("log", 0))
+            except ValueError:
+                log_offset = 0
+            self._send(200, server.jobs[parts[1]].to_dict(log_offset))
+        elif len(parts) == 2 and parts[0] == "render":
+            output = {key: options.pop(key) for key in OUTPUT_PARAMS if key in options}
+            if "quality" in output:
+                try:
+                    output["quality"] = int(output["quality"])
+                except ValueError:
+                    self._send(400, {"error": f"qualityが不正です: {output['quality']}"})
+                    return
+            self._render(parts[1], options, output)
+        else:
+            self._send(404, {"error": "見つかりません"})
+
+    def do_POST(self):
+        if not self._authorize():
+            return
+        server = self.server.render_server
+        parts, _ = self._path()
+        if parts == ["jobs"]:
+            try:
+                body = self._read_json()
+                job = server.submit(body.get("params") or {}, int(body.get("priority", 0)))
+            except (ValueError, TypeError, AttributeError) as e:
+                self._send(400, {"error": str(e)})
+                return
+            self._send(201, job.to_dict())
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "cancel":
+            job = server.cancel(parts[1])
+            if job is None:
+                self._send(404, {"error": "見つかりません"})
+            else:
+                self._send(200, job.to_dict())
+        elif len(parts) == 2 and parts[0] == "render":
+            try:
+                body = self._read_json()
+                fields, output = body.get("fields") or {}, body.get("output")
+                if not isinstance(fields, dict) or not isinstance(output or {}, dict):
+                    raise ValueError("fieldsとoutputはJSONのオブジェクトで指定してください")
+            except ValueError as e:
+                self._send(400, {"error": str(e)})
+                return
+            self._render(parts[1], fields, output)
+        elif parts == ["shutdown"]:
+            self._send(200, {"ok": True})
+            threading.Thread(target=server.stop, daemon=True).start()
+        else:
+            self._send(404, {"error": "見つかりません"})
+
+class RenderClient:
+    """レンダーサーバーのクライアント（tokenはサーバーの状態ファイルに記録されたもの）"""
+
+    def __init__(self, url, token=None, timeout=10):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def _headers(self):
+        headers = {"Content-Type": "application/json"}
+        if self.token:
+            headers[TOKEN_HEADER] = self.token
+        return headers
+
+    def _request(self, method, path, body=None):
+        import urllib.error
+        import urllib.request
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = urllib.request.Request(self.url + path, data=data, method=method, headers=self._headers())
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise RuntimeError(json.loads(e.read() or b"{}").get("error", str(e)))
+
+    def status(self):
+        return self._request("GET", "/status")
+
+    def submit(self, params, priority=0):
+        """ジョブを投入して状態を返す"""
+        return self._request("POST", "/jobs", {"params": params, "priority": priority})
+
+    def job(self, job_id, log_offset=0):
+        return self._request("GET", f"/jobs/{job_id}?log={log_offset}")
+
+    def jobs(self):
+        return self._request("GET", "/jobs")["jobs"]
+
+    def cancel(self, job_id):
+        return self._request("POST", f"/jobs/{job_id}/cancel")
+
+    def shutdown(self):
+        return self._request("POST", "/shutdown")
+
+    def render(self, template_id, fields, output=None, etag=None):
+        """画像を合成して (ETag, バイト列) を返す（etagを渡して変わっていなければバイト列はNone）"""
+        import urllib.error
+        import urllib.request
+        from urllib.parse import quote
+
+        headers = self._headers()
+        if etag:
+            headers["If-None-Match"] = f'"{etag}"'
+        data = json.dumps({"fields": fields, "output": output}).encode('utf-8')
+        request = urllib.request.Request(f"{self.url}/render/{quote(template_id)}", data=data, method="POST", headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.headers["ETag"].strip('"'), response.read()
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                return e.headers["ETag"].strip('"'), None
+            raise RuntimeError(json.loads(e.read() or b"{}").get("error", str(e)))
+
+    def wait(self, job_id, on_update=None, interval=0.2):
+        """ジョブが終わるまで状態を取得し続ける（on_update(状態, 新しいログ行) を毎回呼ぶ）"""
+        log_offset = 0
+        while True:
+            status = self.job(job_id, log_offset)
+            log_offset = status["log_offset"]
+            if on_update is not None:
+                on_update(status, status["log"])
+            if status["state"] in FINISHED_STATES:
+                return status
+            time.sleep(interval)
+
+def find_server(state_path=STATE_PATH, timeout=0.5):
+    """起動中のレンダーサーバーがあればクライアントを返す（なければNone）"""
+    try:
+        with open(state_path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        url, token = state["url"], state.get("token")
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+    client = RenderClient(url, token, timeout=timeout)
+    try:
+        client.status()
+    except (OSError, RuntimeError, ValueError):
+        return None
+    client.timeout = 10
+    return client
+
+def follow_job(client, job_id, progress_format="text", stream=None):
+    """ジョブのログと進捗を表示しながら終了を待ち、終了時の状態を返す"""
+    stream = stream or sys.stdout
+
+    def on_update(status, lines):
+        for line in lines:
+            event = parse_event(line)
+            if progress_format == "jsonl" or event is None:
+                stream.write(line + "\n")
+            elif event["event"] == "progress":
+                stream.write(f"処理中... {event['current']}/{event['total']} 完了\n")
+        stream.flush()
+
+    try:
+        return client.wait(job_id, on_update)
+    except KeyboardInterrupt:
+        # Ctrl+Cでサーバー側のジョブも中止する
+        client.cancel(job_id)
+        return client.wait(job_id, on_update)
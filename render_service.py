@@ -0,0 +1,176 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from batch_manifest import hash_data
+from data_handler import DataHandler
+from image_encoder import ImageEncoder
+from image_index import ImageIndex
+from image_processor import ImageProcessor
+from template_compiler import AssetCache
+
+# 応答キャッシュの容量の既定の上限（エンコード済みのバイト数）
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+# 商品画像が見つからないときに画像フォルダを読み直す最短の間隔（秒）
+RESCAN_INTERVAL = 1.0
+
+# 出力形式ごとのContent-Type
+CONTENT_TYPES = {
+    "PNG": "image/png",
+    "JPEG": "image/jpeg",
+    "WEBP": "image/webp",
+    "AVIF": "image/avif",
+}
+
+class RenderedImage:
+    """エンコード済みの画像（etagは入力のハッシュ、未変更の応答ではdataがNone）"""
+
+    def __init__(self, etag, content_type, data):
+        self.etag = etag
+        self.content_type = content_type
+        self.data = data
+
+class ResponseCache:
+    """エンコード済みの画像をETagで引くLRUキャッシュ（合計バイト数で上限を決める）"""
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, etag):
+        """キャッシュにあれば返す（なければNone）"""
+        rendered = self.entries.get(etag)
+        if rendered is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(etag)
+        return rendered
+
+    def put(self, rendered):
+        """追加し、上限を超えたら最後に使われたのが古いものから捨てる"""
+        if len(rendered.data) > self.max_bytes:
+            return
+        previous = self.entries.pop(rendered.etag, None)
+        if previous is not None:
+            self.size -= len(previous.data)
+        self.entries[rendered.etag] = rendered
+        self.size += len(rendered.data)
+        while self.size > self.max_bytes:
+            _, removed = self.entries.popitem(last=False)
+            self.size -= len(removed.data)
+
+class RenderService:
+    """テンプレートのIDと商品データから1枚の画像を合成し、エンコードしたバイト列を返す
+
+    テンプレートのIDはテンプレートフォルダ内のファイル名（拡張子なし）。コンパイル済みの
+    テンプレートはIDごとに保持し、テンプレートファイルか参照している画像が更新されたら
+    コンパイルし直す。同じ入力（テンプレート・商品データ・商品画像・出力設定）への応答は
+    入力のハッシュをETagとしてキャッシュする。複数のスレッドから呼び出せる（描画は1件ずつ）。
+    """
+
+    def __init__(self, templates_dir, image_folder=None, processor=None, cache_bytes=DEFAULT_CACHE_BYTES, recursive_images=False):
+        self.templates_dir = templates_dir
+        self.image_folder = image_folder
+        self.recursive_images = recursive_images
+        self.processor = processor or ImageProcessor(assets=AssetCache())
+        self.data_handler = DataHandler()
+        self.cache = ResponseCache(cache_bytes)
+        self.templates = {}
+        self._index = None
+        self._scanned = 0.0
+        self._lock = threading.Lock()
+
+    def template_path(self, template_id):
+        """テンプレートのIDからファイルパスを求める（テンプレートフォルダの外は指せない）"""
+        if not template_id or template_id.startswith(".") or os.path.basename(template_id) != template_id or "\\" in template_id:
+            raise LookupError(f"テンプレートのIDが不正です: {template_id}")
+        path = os.path.join(self.templates_dir, f"{template_id}.json")
+        if not os.path.isfile(path):
+            raise LookupError(f"テンプレートが見つかりません: {template_id}")
+        return path
+
+    def _signature(self, path, template):
+        """テンプレートファイルと参照している画像の更新日時（変わればコンパイルし直す）"""
+        paths = [path]
+        if template.background:
+            paths.append(template.background)
+        paths.extend(image_element.path for image_element in template.image_elements)
+
+        signature = []
+        for asset_path in paths:
+            try:
+                signature.append(os.stat(asset_path).st_mtime_ns)
+            except OSError:
+                signature.append(None)
+        return signature
+
+    def compiled_template(self, template_id):
+        """(更新日時, CompiledTemplate) を返す（不正なテンプレートはValueError）"""
+        path = self.template_path(template_id)
+        entry = self.templates.get(template_id)
+        if entry is not None and entry[0] == self._signature(path, entry[1].template):
+            return entry
+
+        template = self.data_handler.load_template(path)
+        if template is None:
+            raise ValueError(f"テンプレートの内容が不正です: {template_id}")
+        entry = (self._signature(path, template), self.processor.compile_template(template))
+        self.templates[template_id] = entry
+        return entry
+
+    def find_image(self, fields):
+        """商品データ（image_file・id）から商品画像のパスを求める（商品画像フォルダの中の画像に限る）"""
+        if not self.image_folder:
+            raise LookupError("商品画像フォルダが指定されていません")
+
+        # 見つからなければ追加された画像があるかもしれないので、間隔をあけて読み直す
+        for _ in range(2):
+            if self._index is None:
+                self._index = ImageIndex(self.image_folder, self.recursive_images)
+                self._scanned = time.monotonic()
+            path = self._index.find(fields.get("image_file"), fields.get("id"), allow_outside=False)
+            if path is not None:
+                return path
+            if time.monotonic() - self._scanned < RESCAN_INTERVAL:
+                break
+            self._index = None
+        raise LookupError(f"商品画像が見つかりません: {fields.get('image_file') or fields.get('id', '')}")
+
+    def render(self, template_id, fields, output=None, if_none_match=None):
+        """合成してRenderedImageを返す
+
+        outputは出力設定の上書き（例: {"format": "webp", "quality": 80}）。
+        if_none_matchに前回のETagを渡し、入力が変わっていなければdataなしで返す。
+        テンプレートや商品画像が見つからなければLookupError、設定が不正ならValueError。
+        """
+        with self._lock:
+            signature, compiled = self.compiled_template(template_id)
+            image_path = self.find_image(fields)
+            image_stat = os.stat(image_path)
+            encoder = ImageEncoder.from_template(compiled.template, output)
+            content_type = CONTENT_TYPES[encoder.outputs[0].format]
+
+            etag = hash_data([
+                template_id,
+                signature,
+                fields,
+                [image_path, image_stat.st_size, image_stat.st_mtime_ns],
+                encoder.config
+            ])
+            if etag == if_none_match:
+                return RenderedImage(etag, content_type, None)
+
+            rendered = self.cache.get(etag)
+            if rendered is None:
+                data = self.processor.render_bytes(image_path, fields, compiled, encoder)
+                rendered = RenderedImage(etag, content_type, data)
+                self.cache.put(rendered)
+            return rendered
@@ -6,21 +6,23 @@ import json
 # テスト対象のモジュールをインポートできるようにパスを追加
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
-# パッチをテスト前に適用
-print("JSONパッチを適用しています...")
-try:
-    from json_patch import apply_patch
-    apply_patch()
-except Exception as e:
-    print(f"パッチの適用に失敗しました: {e}")
-    
 # 既存のテストをインポート
 print("テストモジュールを読み込んでいます...")
 try:
     from test_data_handler import TestDataHandler
     from test_template_manager import TestTemplateManager
     from test_batch_process import TestBatchProcess
-    from test_json_patch import TestJSONPatch
+    from test_template_compiler import TestTemplateCompiler
+    from test_preview_renderer import TestPreviewRenderer
+    from test_font_resolver import TestFontResolver
+    from test_product_cache import TestProductImageCache
+    from test_image_index import TestImageIndex
+    from test_batch_journal import TestBatchJournal
+    from test_batch_shard import TestBatchShard
+    from test_render_server import TestRenderServer
+    from test_render_service import TestRenderService
+    from test_layer_compositor import TestLayerCompositor
+    from test_json_patch import TestJSONPatch, TestFletPatch
     from test_template_view import TestTemplateView
 except Exception as e:
     print(f"テストモジュールのインポートに失敗しました: {e}")
@@ -34,7 +36,18 @@ def create_test_suite():
     suite.addTest(unittest.makeSuite(TestDataHandler))
     suite.addTest(unittest.makeSuite(TestTemplateManager))
     suite.addTest(unittest.makeSuite(TestBatchProcess))
+    suite.addTest(unittest.makeSuite(TestTemplateCompiler))
+    suite.addTest(unittest.makeSuite(TestPreviewRenderer))
+    suite.addTest(unittest.makeSuite(TestFontResolver))
+    suite.addTest(unittest.makeSuite(TestProductImageCache))
+    suite.addTest(unittest.makeSuite(TestImageIndex))
+    suite.addTest(unittest.makeSuite(TestBatchJournal))
+    suite.addTest(unittest.makeSuite(TestBatchShard))
+    suite.addTest(unittest.makeSuite(TestRenderServer))
+    suite.addTest(unittest.makeSuite(TestRenderService))
+    suite.addTest(unittest.makeSuite(TestLayerCompositor))
     suite.addTest(unittest.makeSuite(TestJSONPatch))
+    suite.addTest(unittest.makeSuite(TestFletPatch))
     suite.addTest(unittest.makeSuite(TestTemplateView))
     
     return suite
@@ -10,6 +10,16 @@ if __name__ == "__main__":
     import test_data_handler
     import test_template_manager
     import test_batch_process
+    import test_template_compiler
+    import test_preview_renderer
+    import test_font_resolver
+    import test_product_cache
+    import test_image_index
+    import test_batch_journal
+    import test_batch_shard
+    import test_render_server
+    import test_render_service
+    import test_layer_compositor
     
     # テストローダーを作成
     loader = unittest.TestLoader()
@@ -21,6 +31,16 @@ if __name__ == "__main__":
     test_suite.addTests(loader.loadTestsFromTestCase(test_data_handler.TestDataHandler))
     test_suite.addTests(loader.loadTestsFromTestCase(test_template_manager.TestTemplateManager))
     test_suite.addTests(loader.loadTestsFromTestCase(test_batch_process.TestBatchProcess))
+    test_suite.addTests(loader.loadTestsFromTestCase(test_template_compiler.TestTemplateCompiler))
+    test_suite.addTests(loader.loadTestsFromTestCase(test_preview_renderer.TestPreviewRenderer))
+    test_suite.addTests(loader.loadTestsFromTestCase(test_font_resolver.TestFontResolver))
+    test_suite.addTests(loader.loadTestsFromTestCase(test_product_cache.TestProductImageCache))
+    test_suite.addTests(loader.loadTestsFromTestCase(test_image_index.TestImageIndex))
+    test_suite.addTests(loader.loadTestsFromTestCase(test_batch_journal.TestBatchJournal))
+    test_suite.addTests(loader.loadTestsFromTestCase(test_batch_shard.TestBatchShard))
+    test_suite.addTests(loader.loadTestsFromTestCase(test_render_server.TestRenderServer))
+    test_suite.addTests(loader.loadTestsFromTestCase(test_render_service.TestRenderService))
+    test_suite.addTests(loader.loadTestsFromTestCase(test_layer_compositor.TestLayerCompositor))
     
     # テストを実行
     runner = unittest.TextTestRunner(verbosity=2)
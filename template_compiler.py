@@ -0,0 +1,323 @@
+import os
+import re
+import time
+from collections import OrderedDict
+from PIL import Image, ImageDraw
+from batch_report import add_time
+from layer_compositor import flatten_layers
+
+# テキスト内のプレースホルダ（${列名}）
+PLACEHOLDER_PATTERN = re.compile(r"\$\{([^}]*)\}")
+
+# 縮小読み込みでreduceしたあとに残す、目的のサイズに対する倍率の下限
+# （最後の仕上げはresampleで行うので、この倍率があれば画質はほぼ変わらない）
+REDUCING_GAP = 2.0
+
+# 縮小してからRGBAに変換してもよいモード（それ以外は先に変換する）
+REDUCIBLE_MODES = ("RGB", "RGBA", "L", "LA", "CMYK")
+
+class CompiledText:
+    """${列名}を含むテキストを、固定文字列と参照する列名に分解したもの"""
+
+    def __init__(self, text):
+        # 固定文字列と列名を交互に並べる（偶数番目が固定文字列、奇数番目が列名）
+        self.parts = PLACEHOLDER_PATTERN.split(text)
+        self.fields = self.parts[1::2]
+
+    def render(self, product_data):
+        """商品データで置換した文字列と、見つからなかった列名のリストを返す"""
+        if not self.fields:
+            return self.parts[0], []
+
+        pieces = list(self.parts)
+        missing = []
+        for i in range(1, len(pieces), 2):
+            field = pieces[i]
+            if field in product_data:
+                pieces[i] = str(product_data[field])
+            else:
+                missing.append(field)
+                pieces[i] = ""
+        return "".join(pieces), missing
+
+def scale_point(point, scale):
+    """座標やサイズを縮尺に合わせて変換"""
+    if scale == 1.0:
+        return tuple(point)
+    return tuple(max(1, int(round(value * scale))) if value > 0 else int(round(value * scale)) for value in point)
+
+def open_image(path, size=None, stats=None):
+    """画像をデコードする（sizeを指定するとJPEGは1/2・1/4・1/8の縮小デコードでsize以上の大きさだけ展開する）"""
+    start = time.perf_counter()
+    with Image.open(path) as image:
+        if size is not None:
+            # JPEG以外ではdraftは何もしない
+            image.draft(image.mode, size)
+        image.load()
+    add_time(stats, "decode", start)
+    return image
+
+def resize_image(image, size=None, resample=Image.LANCZOS, stats=None):
+    """デコード済みの画像をリサイズしてRGBAに変換（sizeがNoneなら変換のみ）
+
+    reduceで整数分の1にしてからresampleで仕上げ、RGBAへの変換は縮小後に行う。
+    """
+    if size is None:
+        return image.convert('RGBA')
+
+    start = time.perf_counter()
+    if image.mode not in REDUCIBLE_MODES:
+        image = image.convert('RGBA')
+    image = image.resize(size, resample, reducing_gap=REDUCING_GAP).convert('RGBA')
+    add_time(stats, "resize", start)
+    return image
+
+def decode_image(path, size=None, resample=Image.LANCZOS, stats=None):
+    """画像をRGBAで読み込む（sizeを指定すると目的のサイズに近い大きさでデコードしてからリサイズ）
+
+    大きな元画像でも原寸のRGBA画像を展開せずに済む。
+    """
+    return resize_image(open_image(path, size, stats), size, resample, stats)
+
+class AssetCache:
+    """デコード済み・リサイズ済みの画像や描画済みレイヤーを保持するキャッシュ
+
+    ファイルはパスと更新日時で識別するので、画像が差し替えられれば読み直す。
+    テンプレートを何度もコンパイルし直すプレビューで、変わっていない素材の
+    デコードや描画を省くために使う。
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_create(self, key, factory):
+        """キーに対応する値を返す（なければfactoryで作成して保持）"""
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        value = factory()
+        self.entries[key] = value
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
+
+    def load_image(self, path, size=None, resample=Image.LANCZOS):
+        """画像をRGBAで読み込み、sizeが指定されていればリサイズ"""
+        key = ("image", path, os.path.getmtime(path), size, resample)
+
+        def load():
+            return decode_image(path, size, resample)
+
+        return self.get_or_create(key, load)
+
+def apply_color_alpha(mask, color):
+    """文字のマスクに色のアルファを掛ける（半透明の色は下の画像と混ぜて描く）
+
+    固定テキストのレイヤーと可変テキストの描画で同じ見た目になるよう両方で使う。
+    """
+    alpha = color[3] if len(color) > 3 else 255
+    if alpha >= 255:
+        return mask
+    return mask.point(lambda value: value * alpha // 255)
+
+class TextSpriteCache:
+    """描画済みの文字列をアルファマスクとして保持するキャッシュ
+
+    ブランド名や「送料無料」のように複数の行で同じになる文字列は、
+    一度描いたマスクを使い回して行ごとのグリフの描画を省く。
+    マスクは色によらないので、キーは文字列・フォント名・サイズだけとする。
+    """
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text, element):
+        """文字列のマスクと描画位置からのずれを返す（描画するものがなければNone）"""
+        key = (text, element.font_name, element.font_size)
+        if key in self.entries:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+        self.misses += 1
+        sprite = self._render(text, element.font)
+        self.entries[key] = sprite
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return sprite
+
+    def draw(self, image, element, text):
+        """文字列をimageに描画（不透明な色ならdraw.textと同じ結果）し、キャッシュにあったかを返す"""
+        hits = self.hits
+        sprite = self.get(text, element)
+        if sprite is not None:
+            mask, (dx, dy) = sprite
+            x = element.position[0] + dx
+            y = element.position[1] + dy
+            image.paste(element.color[:3] + (255,), (x, y, x + mask.width, y + mask.height), apply_color_alpha(mask, element.color))
+        return self.hits > hits
+
+    def _render(self, text, font):
+        """文字列を描画範囲だけのマスクに描く"""
+        left, top, right, bottom = ImageDraw.Draw(Image.new('L', (1, 1))).textbbox((0, 0), text, font=font)
+        if right <= left or bottom <= top:
+            return None
+        mask = Image.new('L', (right - left, bottom - top), 0)
+        ImageDraw.Draw(mask).text((-left, -top), text, font=font, fill=255)
+        return mask, (left, top)
+
+class CompiledTextElement:
+    """テキスト要素（TextElement）に縮尺を適用し、フォントを読み込んだもの"""
+
+    def __init__(self, text_element, get_font, scale=1.0):
+        self.text = CompiledText(text_element.text)
+        self.position = scale_point(text_element.position, scale)
+        self.font_name = text_element.font
+        self.font_size = max(1, int(round(text_element.font_size * scale)))
+        self.font = get_font(self.font_name, self.font_size)
+        self.color = text_element.color
+
+class CompiledTemplate:
+    """検証済みのテンプレート（Template）から一度だけ構築する描画用データ
+
+    背景画像と装飾画像はデコード・リサイズ済みの状態で保持し、
+    行ごとの処理では商品画像とテキストだけを扱えばよいようにする。
+
+    重なり順は「背景 → 商品画像 → テキスト要素 → 装飾要素」で、行によって
+    変わらないレイヤー（背景、プレースホルダを含まないテキスト、装飾要素）は
+    この順序を保ったまま事前に1枚の画像へ平坦化しておく。
+
+    scaleとresampleを指定すると、プレビュー用に縮小した状態でコンパイルする。
+    compositorは固定レイヤーをまとめるときの合成方法（layer_compositor.COMPOSITORS）。
+    """
+
+    def __init__(self, template, get_font, scale=1.0, resample=Image.LANCZOS, assets=None, compositor="pil"):
+        self.template = template
+        self.scale = scale
+        self.compositor = compositor
+        self.resample = resample
+        self.assets = assets if assets is not None else AssetCache()
+        self.product_position = scale_point(template.product_position, scale)
+        self.product_size = scale_point(template.product_size, scale) if template.product_size else None
+        self.text_elements = template.text_elements
+        self.background = self._load_background(template)
+        self.decorations = self._load_decorations(template)
+
+        # 商品画像より下のレイヤー（コピーして土台にする）と、商品画像より上のレイヤー
+        # 上側は ("layer", 画像, 位置) か ("text", CompiledTextElement) を重なり順に並べたもの
+        self.base, self.layers = self._flatten_layers(get_font)
+
+    def _load_background(self, template):
+        """背景画像を読み込む"""
+        if template.background:
+            background = self.assets.load_image(template.background)
+            if self.scale != 1.0:
+                size = scale_point(background.size, self.scale)
+                background = self.assets.load_image(template.background, size, self.resample)
+            return background
+        # デフォルト背景（白）を作成
+        return Image.new('RGBA', scale_point((800, 800), self.scale), (255, 255, 255, 255))
+
+    def _load_decorations(self, template):
+        """装飾要素をリサイズ済みの画像として読み込む"""
+        decorations = []
+        for image_element in template.image_elements:
+            try:
+                # サイズ調整（指定がなければ元のサイズを縮尺に合わせる）
+                if image_element.size is not None:
+                    size = scale_point(image_element.size, self.scale)
+                elif self.scale != 1.0:
+                    size = scale_point(self.assets.load_image(image_element.path).size, self.scale)
+                else:
+                    size = None
+                element_img = self.assets.load_image(image_element.path, size, self.resample)
+
+                position = scale_point(image_element.position, self.scale)
+                decorations.append((element_img, position))
+            except Exception as e:
+                print(f"装飾要素の処理エラー: {e}")
+        return decorations
+
+    def _flatten_layers(self, get_font):
+        """行によって変わらないレイヤーを重なり順を保ったまままとめる"""
+        canvas_size = self.background.size
+
+        # 商品画像より上の描画処理を重なり順に列挙
+        operations = []
+        for text_element in self.text_elements:
+            element = CompiledTextElement(text_element, get_font, self.scale)
+            if element.text.fields:
+                operations.append(("text", element))
+            else:
+                operations.append(("static", (self._render_static_text(element, canvas_size), (0, 0))))
+        for element_img, position in self.decorations:
+            operations.append(("static", (element_img, position)))
+
+        # 連続する固定レイヤーを1枚にまとめる
+        layers = []
+        pending = []
+        for kind, payload in operations:
+            if kind == "static":
+                pending.append(payload)
+                continue
+            if pending:
+                layers.append(flatten_layers(canvas_size, pending, self.compositor))
+                pending = []
+            layers.append(payload)
+        if pending:
+            layers.append(flatten_layers(canvas_size, pending, self.compositor))
+
+        base = self.background
+        compiled_layers = []
+        for i, layer in enumerate(layers):
+            if isinstance(layer, CompiledTextElement):
+                compiled_layers.append(("text", layer))
+                continue
+
+            bbox = layer.getbbox()
+            if bbox is None:
+                continue
+
+            # 先頭の固定レイヤーが商品画像と重ならなければ背景に焼き込む
+            if i == 0 and not self._overlaps_product(bbox):
+                base = Image.alpha_composite(base, layer)
+                continue
+
+            # 描画範囲だけを切り出して保持
+            compiled_layers.append(("layer", layer.crop(bbox), bbox[:2]))
+
+        return base, compiled_layers
+
+    def _render_static_text(self, element, canvas_size):
+        """プレースホルダを含まないテキストを透明レイヤーに描画"""
+        text, _ = element.text.render({})
+
+        def render():
+            # 文字の形をマスクとして描き、単色レイヤーのアルファに使う
+            mask = Image.new('L', canvas_size, 0)
+            ImageDraw.Draw(mask).text(element.position, text, font=element.font, fill=255)
+            layer = Image.new('RGBA', canvas_size, element.color[:3] + (255,))
+            layer.putalpha(apply_color_alpha(mask, element.color))
+            return layer
+
+        key = ("text", text, element.position, element.font_name, element.font_size, element.color, canvas_size)
+        return self.assets.get_or_create(key, render)
+
+    def _overlaps_product(self, bbox):
+        """レイヤーの描画範囲が商品画像の配置範囲と重なるか"""
+        if self.product_size is None:
+            # 商品画像のサイズが不明な場合は重なるものとして扱う
+            return True
+        left, top = self.product_position
+        right = left + self.product_size[0]
+        bottom = top + self.product_size[1]
+        return bbox[0] < right and left < bbox[2] and bbox[1] < bottom and top < bbox[3]
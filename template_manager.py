@@ -25,7 +25,7 @@ class TemplateManager:
             if filename.endswith(".json"):
                 template_path = os.path.join(self.templates_dir, filename)
                 try:
-                    template = self.data_handler.load_template(template_path)
+                    template = self.data_handler.load_template_data(template_path)
                     templates.append({
                         "name": template.get("name", filename),
                         "path": template_path
@@ -34,6 +34,15 @@ class TemplateManager:
                     pass
         return templates
     
+    def get_template_paths(self, directory=None):
+        """フォルダ内のテンプレートファイルのパスを名前順に取得（省略時はテンプレートフォルダ）"""
+        directory = directory or self.templates_dir
+        return sorted(
+            os.path.join(directory, filename)
+            for filename in os.listdir(directory)
+            if filename.endswith(".json")
+        )
+    
     def create_template(self, template_data, name):
         """新しいテンプレートを作成"""
         filename = f"{name.replace(' ', '_')}.json"
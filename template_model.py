@@ -0,0 +1,216 @@
+import copy
+from collections.abc import Mapping
+from dataclasses import dataclass, fields
+from typing import Optional, Tuple
+
+DEFAULT_FONT = "arial.ttf"
+DEFAULT_FONT_SIZE = 24
+
+class TemplateError(ValueError):
+    """テンプレートの内容が不正（errorsに問題のある項目をすべて持つ）"""
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        super().__init__("\n".join(self.errors))
+
+class _Record(Mapping):
+    """読み取り専用の辞書としても参照できるようにする（template["name"] や template.get(...)）"""
+
+    def __getitem__(self, key):
+        if key not in self._field_names():
+            raise KeyError(key)
+        value = getattr(self, key)
+        if value is None:
+            # 省略された項目は辞書のときと同じくキーがないものとして扱う
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return (name for name in self._field_names() if getattr(self, name) is not None)
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    @classmethod
+    def _field_names(cls):
+        return [field.name for field in fields(cls)]
+
+@dataclass(frozen=True, eq=True)
+class TextElement(_Record):
+    """テキスト要素（textは${列名}で商品データを参照できる）"""
+    text: str
+    position: Tuple[int, int] = (0, 0)
+    font: str = DEFAULT_FONT
+    font_size: int = DEFAULT_FONT_SIZE
+    color: Tuple[int, ...] = (0, 0, 0)
+
+    def to_dict(self):
+        return {
+            "text": self.text,
+            "position": list(self.position),
+            "font": self.font,
+            "font_size": self.font_size,
+            "color": list(self.color)
+        }
+
+@dataclass(frozen=True, eq=True)
+class ImageElement(_Record):
+    """装飾画像要素（sizeがNoneなら元のサイズ）"""
+    path: str
+    position: Tuple[int, int] = (0, 0)
+    size: Optional[Tuple[int, int]] = None
+
+    def to_dict(self):
+        result = {"path": self.path, "position": list(self.position)}
+        if self.size is not None:
+            result["size"] = list(self.size)
+        return result
+
+@dataclass(frozen=True, eq=True)
+class Template(_Record):
+    """検証・正規化済みのテンプレート（変更できない）
+
+    座標・サイズ・色はタプル、省略された項目は既定値になっているので、
+    描画処理では型の確認や変換をしなくてよい。ワーカープロセスに渡しても
+    共有している状態が書き換えられることはない。
+    """
+    name: str = ""
+    background: str = ""
+    product_position: Tuple[int, int] = (0, 0)
+    product_size: Optional[Tuple[int, int]] = None
+    text_elements: Tuple[TextElement, ...] = ()
+    image_elements: Tuple[ImageElement, ...] = ()
+    output: Optional[Mapping] = None
+
+    @classmethod
+    def from_dict(cls, data):
+        """テンプレートの辞書を検証して作成（問題があればすべてまとめてTemplateErrorを送出）"""
+        errors = []
+        if not isinstance(data, Mapping):
+            raise TemplateError([f"テンプレートはJSONオブジェクトである必要があります: {type(data).__name__}"])
+
+        name = _string(data, "name", "", errors)
+        background = _string(data, "background", "", errors) or ""
+        product_position = _pair(data, "product_position", (0, 0), errors, "product_position")
+        product_size = _pair(data, "product_size", None, errors, "product_size", positive=True)
+
+        text_elements = []
+        for i, element in enumerate(_list(data, "text_elements", errors)):
+            where = f"text_elements[{i}]"
+            if not isinstance(element, Mapping):
+                errors.append(f"{where}: オブジェクトである必要があります")
+                continue
+            text = _string(element, "text", None, errors, where)
+            if text is None:
+                errors.append(f"{where}.text: 必須です")
+            text_elements.append(TextElement(
+                text=text or "",
+                position=_pair(element, "position", (0, 0), errors, f"{where}.position"),
+                font=_string(element, "font", DEFAULT_FONT, errors, where) or DEFAULT_FONT,
+                font_size=_positive_int(element, "font_size", DEFAULT_FONT_SIZE, errors, where),
+                color=_color(element, errors, where)
+            ))
+
+        image_elements = []
+        for i, element in enumerate(_list(data, "image_elements", errors)):
+            where = f"image_elements[{i}]"
+            if not isinstance(element, Mapping):
+                errors.append(f"{where}: オブジェクトである必要があります")
+                continue
+            path = _string(element, "path", None, errors, where)
+            if not path:
+                errors.append(f"{where}.path: 必須です")
+            image_elements.append(ImageElement(
+                path=path or "",
+                position=_pair(element, "position", (0, 0), errors, f"{where}.position"),
+                size=_pair(element, "size", None, errors, f"{where}.size", positive=True)
+            ))
+
+        output = data.get("output")
+        if output is not None and not isinstance(output, Mapping):
+            errors.append("output: オブジェクトである必要があります")
+            output = None
+
+        if errors:
+            raise TemplateError(errors)
+        return cls(
+            name=name,
+            background=background,
+            product_position=product_position,
+            product_size=product_size,
+            text_elements=tuple(text_elements),
+            image_elements=tuple(image_elements),
+            output=copy.deepcopy(dict(output)) if output is not None else None
+        )
+
+    @classmethod
+    def coerce(cls, template):
+        """Templateはそのまま、辞書なら検証して作成"""
+        if isinstance(template, cls):
+            return template
+        return cls.from_dict(template)
+
+    def to_dict(self):
+        """JSONに保存できる辞書に変換（テンプレートファイルと同じ形式）"""
+        result = {
+            "name": self.name,
+            "background": self.background,
+            "product_position": list(self.product_position),
+            "text_elements": [element.to_dict() for element in self.text_elements],
+            "image_elements": [element.to_dict() for element in self.image_elements]
+        }
+        if self.product_size is not None:
+            result["product_size"] = list(self.product_size)
+        if self.output is not None:
+            result["output"] = copy.deepcopy(dict(self.output))
+        return result
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _string(data, key, default, errors, where=None):
+    """文字列の項目"""
+    value = data.get(key, default)
+    if value is None or isinstance(value, str):
+        return value
+    errors.append(f"{where + '.' if where else ''}{key}: 文字列である必要があります: {value!r}")
+    return default
+
+def _list(data, key, errors):
+    """要素のリスト"""
+    value = data.get(key) or []
+    if isinstance(value, (list, tuple)):
+        return value
+    errors.append(f"{key}: リストである必要があります: {value!r}")
+    return []
+
+def _pair(data, key, default, errors, where, positive=False):
+    """[x, y] や [幅, 高さ] の項目を整数のタプルに変換"""
+    value = data.get(key)
+    if value is None:
+        return default
+    if not isinstance(value, (list, tuple)) or len(value) != 2 or not all(_is_number(v) for v in value):
+        errors.append(f"{where}: 2つの数値である必要があります: {value!r}")
+        return default
+    pair = tuple(int(round(v)) for v in value)
+    if positive and min(pair) <= 0:
+        errors.append(f"{where}: 1以上である必要があります: {value!r}")
+        return default
+    return pair
+
+def _positive_int(data, key, default, errors, where):
+    """1以上の整数の項目"""
+    value = data.get(key, default)
+    if not _is_number(value) or value < 1:
+        errors.append(f"{where}.{key}: 1以上の数値である必要があります: {value!r}")
+        return default
+    return int(round(value))
+
+def _color(data, errors, where):
+    """[R, G, B] または [R, G, B, A] の色"""
+    value = data.get("color", (0, 0, 0))
+    if (not isinstance(value, (list, tuple)) or len(value) not in (3, 4)
+            or not all(isinstance(v, int) and not isinstance(v, bool) and 0 <= v <= 255 for v in value)):
+        errors.append(f"{where}.color: 0〜255の整数3つか4つである必要があります: {value!r}")
+        return (0, 0, 0)
+    return tuple(value)
@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+from PIL import Image
+from batch_journal import BatchJournal, JOURNAL_FILENAME
+from batch_engine import RenderTarget
+from image_encoder import ImageEncoder, write_atomic
+from image_processor import ImageProcessor
+from template_model import Template
+
+class TestBatchJournal(unittest.TestCase):
+    """中断したバッチの再開用ジャーナルの単体テスト"""
+
+    def setUp(self):
+        """テスト用の画像とテンプレートを準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.image_folder = os.path.join(self.test_dir, "images")
+        self.output_folder = os.path.join(self.test_dir, "output")
+        os.makedirs(self.image_folder)
+        os.makedirs(self.output_folder)
+        Image.new('RGBA', (20, 20), (255, 0, 0, 255)).save(os.path.join(self.image_folder, "product.png"))
+        self.template = Template.from_dict({
+            "name": "journal",
+            "background": "",
+            "product_position": [0, 0],
+            "product_size": [20, 20]
+        })
+        self.encoder = ImageEncoder()
+        self.rows = [{"id": str(i), "image_file": "product.png"} for i in range(1, 6)]
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir)
+
+    def journal(self, resume=False, **kwargs):
+        return BatchJournal(self.output_folder, self.template, self.encoder, resume=resume, **kwargs)
+
+    def touch(self, filename):
+        open(os.path.join(self.output_folder, filename), 'wb').close()
+
+    def test_record_and_resume(self):
+        """記録した行を再開時に読み込み、書きかけの最後の行と消された出力は処理し直すかテスト"""
+        journal = self.journal()
+        for task_id in ("1", "2", "3"):
+            self.touch(f"{task_id}.png")
+            journal.record(task_id, [f"{task_id}.png"])
+        journal.close()
+        os.remove(os.path.join(self.output_folder, "2.png"))
+        with open(journal.path, 'a', encoding='utf-8') as f:
+            f.write('{"id": "4", "outp')
+        self.touch(".4.png.123-456.tmp")
+
+        resumed = self.journal(resume=True)
+        self.assertEqual(resumed.outputs("1"), ["1.png"])
+        self.assertIsNone(resumed.outputs("2"))
+        self.assertIsNone(resumed.outputs("4"))
+        self.assertFalse(os.path.exists(os.path.join(self.output_folder, ".4.png.123-456.tmp")))
+
+        # 切り詰めた位置から続きを追記できる
+        self.touch("4.png")
+        resumed.record("4", ["4.png"])
+        resumed.close()
+        self.assertEqual(self.journal(resume=True).outputs("4"), ["4.png"])
+
+    def test_resume_keeps_other_shards_temp_files(self):
+        """再開時は自分のシャードの一時ファイルだけを消し、出力フォルダを共有する他のシャードのものは残すかテスト"""
+        self.journal(temp_tag="shard-1-of-2", filename=".journal.shard-1-of-2.jsonl").close()
+        self.touch(".1.png.123-456.shard-1-of-2.tmp")
+        self.touch(".2.png.123-789.shard-2-of-2.tmp")
+        self.touch(".3.png.123-999.tmp")
+
+        self.journal(resume=True, temp_tag="shard-1-of-2", filename=".journal.shard-1-of-2.jsonl").close()
+        remaining = [name for name in os.listdir(self.output_folder) if name.endswith(".tmp")]
+        self.assertEqual(sorted(remaining), [".2.png.123-789.shard-2-of-2.tmp", ".3.png.123-999.tmp"])
+
+        # シャードを指定しない場合はシャード名のない一時ファイルだけを消す
+        self.journal().close()
+        self.journal(resume=True).close()
+        remaining = [name for name in os.listdir(self.output_folder) if name.endswith(".tmp")]
+        self.assertEqual(remaining, [".2.png.123-789.shard-2-of-2.tmp"])
+
+    def test_resume_requires_same_template(self):
+        """テンプレートが変わっていれば最初から処理するかテスト"""
+        journal = self.journal()
+        self.touch("1.png")
+        journal.record("1", ["1.png"])
+        journal.close()
+
+        self.encoder = ImageEncoder({"format": "jpeg"})
+        self.assertEqual(len(self.journal(resume=True)), 0)
+        self.assertEqual(len(self.journal(resume=False)), 0)
+
+    def test_sync_is_batched(self):
+        """fsyncを行ごとではなくまとめて行うかテスト"""
+        now = [0.0]
+        journal = self.journal(sync_rows=3, sync_interval=10.0, clock=lambda: now[0])
+        with mock.patch("os.fsync") as fsync:
+            for task_id in range(5):
+                journal.record(task_id, [f"{task_id}.png"])
+            self.assertEqual(fsync.call_count, 1)
+            now[0] = 11.0
+            journal.record(5, ["5.png"])
+            self.assertEqual(fsync.call_count, 2)
+        journal.close()
+
+    def test_write_atomic(self):
+        """書き込みに失敗しても出力ファイルや一時ファイルが残らないかテスト"""
+        path = os.path.join(self.output_folder, "1.png")
+        write_atomic(path, b"data")
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b"data")
+
+        with mock.patch("os.replace", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                write_atomic(os.path.join(self.output_folder, "2.png"), b"data")
+        self.assertEqual(sorted(os.listdir(self.output_folder)), ["1.png"])
+
+    def test_resume_interrupted_batch(self):
+        """中断したバッチを再開すると、残りの行だけを描画するかテスト"""
+        processor = ImageProcessor()
+
+        def interrupt(current, total):
+            if current == 2:
+                raise KeyboardInterrupt()
+
+        target = RenderTarget("journal", self.template, self.encoder, self.output_folder, journal=self.journal())
+        with self.assertRaises(KeyboardInterrupt):
+            processor.batch_process_targets(self.rows, self.image_folder, [target], progress_callback=interrupt)
+        self.assertTrue(os.path.exists(os.path.join(self.output_folder, JOURNAL_FILENAME)))
+
+        target = RenderTarget("journal", self.template, self.encoder, self.output_folder, journal=self.journal(resume=True))
+        processed, errors = processor.batch_process_targets(self.rows, self.image_folder, [target])
+        self.assertEqual((processed, errors, target.resumed), (3, 0, 2))
+        for row in self.rows:
+            self.assertTrue(os.path.exists(os.path.join(self.output_folder, f"{row['id']}.png")))
+        # 最後まで処理できたのでジャーナルは削除される
+        self.assertFalse(os.path.exists(os.path.join(self.output_folder, JOURNAL_FILENAME)))
+
+    def test_resume_rerenders_changed_rows(self):
+        """中断後に行データが変わった行は、再開時に描画し直して差分処理のマニフェストにも新しい入力で記録するかテスト"""
+        from batch_manifest import BatchManifest
+        processor = ImageProcessor()
+
+        def interrupt(current, total):
+            if current == 2:
+                raise KeyboardInterrupt()
+
+        def target(resume):
+            return RenderTarget("journal", self.template, self.encoder, self.output_folder,
+                                BatchManifest(self.output_folder, self.template, self.encoder), self.journal(resume=resume))
+
+        first = target(False)
+        with self.assertRaises(KeyboardInterrupt):
+            processor.batch_process_targets(self.rows, self.image_folder, [first], progress_callback=interrupt)
+        first.journal.close()
+
+        # 描画済みの1行目の価格を変えてから再開する
+        self.rows[0] = dict(self.rows[0], price="2500")
+        resumed = target(True)
+        processed, errors = processor.batch_process_targets(self.rows, self.image_folder, [resumed])
+        self.assertEqual((processed, errors, resumed.resumed), (4, 0, 1))
+
+        # 次の差分処理では変更のない行としてすべて省略される
+        manifest = BatchManifest(self.output_folder, self.template, self.encoder)
+        processed, errors = processor.batch_process_targets(
+            self.rows, self.image_folder, [RenderTarget("journal", self.template, self.encoder, self.output_folder, manifest)]
+        )
+        self.assertEqual((processed, manifest.skipped), (0, len(self.rows)))
+
+if __name__ == "__main__":
+    unittest.main()
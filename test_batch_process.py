@@ -99,14 +99,10 @@ class TestBatchProcess(unittest.TestCase):
         csv_data = self.data_handler.load_csv(self.csv_path)
         self.assertIsNotNone(csv_data, "CSVの読み込みに失敗しました")
         
-        # テンプレートを読み込み
+        # テンプレートを読み込み（色や座標は読み込み時にタプルへ正規化される）
         template = self.data_handler.load_template(self.template_path)
         self.assertIsNotNone(template, "テンプレートの読み込みに失敗しました")
-        
-        # テンプレートの色情報をタプルに変換
-        for text_elem in template["text_elements"]:
-            if "color" in text_elem and isinstance(text_elem["color"], list):
-                text_elem["color"] = tuple(text_elem["color"])
+        self.assertEqual(template.text_elements[0].color, (0, 0, 0), "色が正規化されていません")
         
         # 進捗コールバック関数
         progress_log = []
@@ -152,11 +148,6 @@ class TestBatchProcess(unittest.TestCase):
         # テンプレートを読み込み
         template = self.data_handler.load_template(self.template_path)
         
-        # テンプレートの色情報をタプルに変換
-        for text_elem in template["text_elements"]:
-            if "color" in text_elem and isinstance(text_elem["color"], list):
-                text_elem["color"] = tuple(text_elem["color"])
-        
         # バッチ処理を実行
         processed, errors = self.image_processor.batch_process(
             csv_data,
@@ -174,5 +165,466 @@ class TestBatchProcess(unittest.TestCase):
         self.assertFalse(os.path.exists(os.path.join(self.output_folder, "2.png")))
         self.assertTrue(os.path.exists(os.path.join(self.output_folder, "3.png")))
 
+    def test_batch_process_template_validation(self):
+        """テンプレートの問題は描画前にまとめて報告され、渡した辞書は変更されないことをテスト"""
+        import copy
+        from template_model import TemplateError
+        
+        template = self.data_handler.load_template_data(self.template_path)
+        original = copy.deepcopy(template)
+        processed, errors = self.image_processor.batch_process(
+            self.data_handler.stream_csv(self.csv_path), self.image_folder, template, self.output_folder
+        )
+        self.assertEqual((processed, errors), (3, 0))
+        self.assertEqual(template, original, "呼び出し元のテンプレートが変更されています")
+        
+        template["product_size"] = [0, 80]
+        template["text_elements"][1]["color"] = "red"
+        with self.assertRaises(TemplateError) as context:
+            self.image_processor.batch_process(
+                self.data_handler.stream_csv(self.csv_path), self.image_folder, template, os.path.join(self.test_dir, "invalid")
+            )
+        self.assertEqual(len(context.exception.errors), 2, "問題のある項目がまとめて報告されていません")
+        self.assertFalse(os.path.exists(os.path.join(self.test_dir, "invalid")), "描画が始まっています")
+
+    def test_batch_process_parallel(self):
+        """並列処理でも逐次処理と同じ出力・件数になることをテスト"""
+        csv_data = self.data_handler.load_csv(self.csv_path)
+        template = self.data_handler.load_template(self.template_path)
+        
+        # 逐次処理の結果を比較用に作成
+        sequential_folder = os.path.join(self.test_dir, "sequential")
+        self.image_processor.batch_process(csv_data, self.image_folder, template, sequential_folder)
+        
+        # 並列処理を実行
+        progress_log = []
+        processed, errors = self.image_processor.batch_process(
+            csv_data,
+            self.image_folder,
+            template,
+            self.output_folder,
+            progress_callback=lambda current, total: progress_log.append((current, total)),
+            workers=2
+        )
+        
+        self.assertEqual(processed, 3, "処理件数が想定と異なります")
+        self.assertEqual(errors, 0, "エラー件数が想定と異なります")
+        self.assertEqual(progress_log, [(1, 3), (2, 3), (3, 3)], "進捗が行順に通知されていません")
+        
+        # 同じファイル名・同じ内容で出力されていることを確認
+        for i in range(1, 4):
+            with open(os.path.join(sequential_folder, f"{i}.png"), 'rb') as f:
+                expected = f.read()
+            with open(os.path.join(self.output_folder, f"{i}.png"), 'rb') as f:
+                self.assertEqual(f.read(), expected, f"{i}.png の内容が逐次処理と異なります")
+
+    def test_apply_template_with_compiled_template(self):
+        """コンパイル済みテンプレートでも辞書テンプレートと同じ画像になることをテスト"""
+        from PIL import Image
+        
+        # 装飾画像を含むテンプレートを用意
+        decoration_path = os.path.join(self.test_dir, "decoration.png")
+        Image.new('RGBA', (40, 40), (0, 0, 255, 128)).save(decoration_path)
+        template = self.data_handler.load_template_data(self.template_path)
+        template["image_elements"] = [{"path": decoration_path, "position": [5, 5], "size": [20, 20]}]
+        
+        compiled = self.image_processor.compile_template(template)
+        self.assertEqual(len(compiled.decorations), 1, "装飾画像がコンパイルされていません")
+        self.assertEqual(compiled.decorations[0][0].size, (20, 20), "装飾画像がリサイズされていません")
+        self.assertEqual(compiled.layers[-1][0], "layer", "装飾要素が固定レイヤーになっていません")
+        
+        product_image_path = os.path.join(self.image_folder, "test1.png")
+        product_data = {"id": 1, "name": "テスト商品1", "price": 1000}
+        expected = self.image_processor.apply_template(product_image_path, product_data, template)
+        actual = self.image_processor.apply_template(product_image_path, product_data, compiled)
+        self.assertEqual(actual.tobytes(), expected.tobytes(), "合成結果が一致しません")
+
+    def test_apply_template_flattened_layers(self):
+        """固定レイヤーを平坦化しても重なり順どおりに合成されることをテスト"""
+        from PIL import Image, ImageDraw, ImageChops
+        
+        # 商品画像に重なる装飾画像と、商品画像と重ならない装飾画像を用意
+        decoration_path = os.path.join(self.test_dir, "decoration.png")
+        Image.new('RGBA', (40, 40), (0, 0, 255, 255)).save(decoration_path)
+        template = self.data_handler.load_template_data(self.template_path)
+        template["text_elements"].append({
+            "text": "送料無料",
+            "position": [60, 60],
+            "font": "arial.ttf",
+            "font_size": 12,
+            "color": [0, 128, 0]
+        })
+        template["image_elements"] = [
+            {"path": decoration_path, "position": [70, 70], "size": [20, 20]},
+            {"path": decoration_path, "position": [300, 300], "size": [20, 20]}
+        ]
+        
+        compiled = self.image_processor.compile_template(template)
+        kinds = [layer[0] for layer in compiled.layers]
+        self.assertEqual(kinds, ["text", "text", "layer"], "固定レイヤーがまとめられていません")
+        
+        # 平坦化しない場合の描画結果を作成
+        product_image_path = os.path.join(self.image_folder, "test1.png")
+        product_data = {"id": 1, "name": "テスト商品1", "price": 1000}
+        expected = Image.new('RGBA', (800, 800), (255, 255, 255, 255))
+        product = Image.open(product_image_path).convert('RGBA').resize((80, 80), Image.LANCZOS)
+        expected.paste(product, (50, 50), product)
+        draw = ImageDraw.Draw(expected)
+        font = self.image_processor.get_font("arial.ttf", 12)
+        draw.text((10, 10), "テスト商品1", font=font, fill=(0, 0, 0))
+        draw.text((10, 30), "¥1000", font=self.image_processor.get_font("arial.ttf", 14), fill=(255, 0, 0))
+        draw.text((60, 60), "送料無料", font=font, fill=(0, 128, 0))
+        decoration = Image.open(decoration_path).convert('RGBA').resize((20, 20), Image.LANCZOS)
+        expected.paste(decoration, (70, 70), decoration)
+        expected.paste(decoration, (300, 300), decoration)
+        
+        actual = self.image_processor.apply_template(product_image_path, product_data, compiled)
+        diff = ImageChops.difference(actual, expected)
+        self.assertLessEqual(max(high for _, high in diff.getextrema()), 1, "合成結果が平坦化前と異なります")
+
+    def test_batch_process_streaming(self):
+        """ストリーム読み込みしたCSVでバッチ処理できるかテスト"""
+        rows = self.data_handler.stream_csv(self.csv_path)
+        total = self.data_handler.count_csv_rows(self.csv_path)
+        template = self.data_handler.load_template(self.template_path)
+        
+        progress_log = []
+        processed, errors = self.image_processor.batch_process(
+            rows,
+            self.image_folder,
+            template,
+            self.output_folder,
+            progress_callback=lambda current, total: progress_log.append((current, total)),
+            total=total
+        )
+        
+        self.assertEqual(processed, 3, "処理件数が想定と異なります")
+        self.assertEqual(errors, 0, "エラー件数が想定と異なります")
+        self.assertEqual(progress_log[-1], (3, 3), "進捗の総件数が想定と異なります")
+        for i in range(1, 4):
+            self.assertTrue(os.path.exists(os.path.join(self.output_folder, f"{i}.png")))
+
+    def test_batch_process_incremental(self):
+        """差分処理で変更のない行が省略され、消えたIDの出力が削除されることをテスト"""
+        from batch_manifest import BatchManifest
+        
+        template = self.data_handler.load_template(self.template_path)
+        
+        def run(data):
+            csv_path = os.path.join(self.test_dir, "incremental.csv")
+            pd.DataFrame(data).to_csv(csv_path, index=False)
+            manifest = BatchManifest(self.output_folder, template)
+            processed, errors = self.image_processor.batch_process(
+                self.data_handler.stream_csv(csv_path),
+                self.image_folder,
+                template,
+                self.output_folder,
+                manifest=manifest
+            )
+            return processed, manifest
+        
+        data = {
+            'id': [1, 2, 3],
+            'name': ['テスト商品1', 'テスト商品2', 'テスト商品3'],
+            'price': [1000, 2000, 3000],
+            'image_file': ['test1.png', 'test2.png', 'test3.png']
+        }
+        
+        # 初回は全件処理
+        processed, manifest = run(data)
+        self.assertEqual(processed, 3, "初回の処理件数が想定と異なります")
+        
+        # 変更がなければ全件省略
+        processed, manifest = run(data)
+        self.assertEqual(processed, 0, "変更のない行が再処理されています")
+        self.assertEqual(manifest.skipped, 3, "省略件数が想定と異なります")
+        
+        # 価格を変更した行と画像を変更した行だけ再処理
+        data['price'][1] = 2500
+        from PIL import Image
+        Image.new('RGBA', (100, 100), (255, 0, 0, 255)).save(os.path.join(self.image_folder, "test1.png"))
+        processed, manifest = run(data)
+        self.assertEqual(processed, 2, "変更した行の処理件数が想定と異なります")
+        self.assertEqual(manifest.skipped, 1, "省略件数が想定と異なります")
+        
+        # CSVから消えたIDの出力は削除
+        data = {key: values[:2] for key, values in data.items()}
+        processed, manifest = run(data)
+        self.assertEqual(processed, 0, "変更のない行が再処理されています")
+        self.assertEqual(manifest.removed, 1, "削除件数が想定と異なります")
+        self.assertFalse(os.path.exists(os.path.join(self.output_folder, "3.png")))
+        self.assertTrue(os.path.exists(os.path.join(self.output_folder, "1.png")))
+
+    def test_batch_process_incremental_missing_image(self):
+        """商品画像が一時的に見つからない行は、差分処理で前回の出力を削除しないことをテスト"""
+        from batch_manifest import BatchManifest
+
+        template = self.data_handler.load_template(self.template_path)
+
+        def run():
+            manifest = BatchManifest(self.output_folder, template)
+            processed, errors = self.image_processor.batch_process(
+                self.data_handler.stream_csv(self.csv_path), self.image_folder, template, self.output_folder, manifest=manifest
+            )
+            return processed, errors, manifest
+
+        self.assertEqual(run()[:2], (3, 0))
+
+        # 画像を移動すると、その行はエラーになるが出力は残る
+        moved_path = os.path.join(self.test_dir, "test2.png")
+        shutil.move(os.path.join(self.image_folder, "test2.png"), moved_path)
+        processed, errors, manifest = run()
+        self.assertEqual((processed, errors, manifest.removed), (0, 1, 0))
+        self.assertTrue(os.path.exists(os.path.join(self.output_folder, "2.png")))
+
+        # 画像が戻れば変更のない行として省略される
+        shutil.move(moved_path, os.path.join(self.image_folder, "test2.png"))
+        processed, errors, manifest = run()
+        self.assertEqual((processed, errors, manifest.skipped), (0, 0, 3))
+
+    def test_batch_process_incremental_duplicate_ids(self):
+        """同じIDの行が複数あっても、先読みする処理（並列・パイプライン）の差分処理が中断しないことをテスト"""
+        from batch_manifest import BatchManifest
+        from batch_pipeline import BatchPipeline
+
+        template = self.data_handler.load_template(self.template_path)
+        csv_path = os.path.join(self.test_dir, "duplicate.csv")
+        pd.DataFrame({
+            'id': [1, 1, 2],
+            'name': ['テスト商品1', 'テスト商品1（重複）', 'テスト商品2'],
+            'price': [1000, 1100, 2000],
+            'image_file': ['test1.png', 'test1.png', 'test2.png']
+        }).to_csv(csv_path, index=False)
+
+        for options in ({"workers": 2}, {"pipeline": BatchPipeline(readers=2, writers=2, queue_size=1)}):
+            output_folder = os.path.join(self.test_dir, "duplicate_" + next(iter(options)))
+            os.makedirs(output_folder)
+            manifest = BatchManifest(output_folder, template)
+            processed, errors = self.image_processor.batch_process(
+                self.data_handler.stream_csv(csv_path), self.image_folder, template, output_folder,
+                manifest=manifest, **options
+            )
+            self.assertEqual((processed, errors), (3, 0), options)
+            self.assertTrue(os.path.exists(manifest.path), options)
+            self.assertEqual(sorted(manifest.entries), ["1", "2"], options)
+
+    def test_batch_process_output_formats(self):
+        """出力形式と縮小版の指定に従って保存されることをテスト"""
+        from PIL import Image
+        from image_encoder import ImageEncoder
+        
+        template = self.data_handler.load_template_data(self.template_path)
+        template["output"] = {
+            "format": "jpeg",
+            "quality": 70,
+            "variants": [{"suffix": "_thumb", "size": [100, 100], "format": "webp"}]
+        }
+        
+        processed, errors = self.image_processor.batch_process(
+            self.data_handler.stream_csv(self.csv_path),
+            self.image_folder,
+            template,
+            self.output_folder
+        )
+        self.assertEqual(processed, 3, "処理件数が想定と異なります")
+        
+        # 原寸はJPEG（RGB）、縮小版はWebPで保存される
+        with Image.open(os.path.join(self.output_folder, "1.jpg")) as image:
+            self.assertEqual(image.format, "JPEG")
+            self.assertEqual(image.mode, "RGB")
+            self.assertEqual(image.size, (800, 800))
+        with Image.open(os.path.join(self.output_folder, "1_thumb.webp")) as image:
+            self.assertEqual(image.format, "WEBP")
+            self.assertEqual(image.size, (100, 100))
+        self.assertFalse(os.path.exists(os.path.join(self.output_folder, "1.png")))
+        
+        # 不透明な画像は既定（flatten: auto）でRGBのPNGになり、透過がある場合はRGBAのまま
+        encoder = ImageEncoder()
+        opaque = Image.new('RGBA', (10, 10), (255, 0, 0, 255))
+        transparent = Image.new('RGBA', (10, 10), (255, 0, 0, 128))
+        self.assertEqual(encoder.outputs[0].prepare(opaque).mode, "RGB")
+        self.assertEqual(encoder.outputs[0].prepare(transparent).mode, "RGBA")
+        
+        # 未対応の形式はエラー
+        with self.assertRaises(ValueError):
+            ImageEncoder({"format": "bmp"})
+
+    def test_batch_process_pipeline(self):
+        """パイプライン処理でも逐次処理と同じ出力・件数になることをテスト"""
+        from batch_pipeline import BatchPipeline
+        
+        template = self.data_handler.load_template(self.template_path)
+        
+        # 逐次処理の結果を比較用に作成
+        sequential_folder = os.path.join(self.test_dir, "sequential")
+        self.image_processor.batch_process(
+            self.data_handler.stream_csv(self.csv_path), self.image_folder, template, sequential_folder
+        )
+        
+        pipeline = BatchPipeline(readers=2, writers=2, queue_size=1)
+        progress_log = []
+        processed, errors = self.image_processor.batch_process(
+            self.data_handler.stream_csv(self.csv_path),
+            self.image_folder,
+            template,
+            self.output_folder,
+            progress_callback=lambda current, total: progress_log.append(current),
+            total=3,
+            pipeline=pipeline
+        )
+        
+        self.assertEqual(processed, 3, "処理件数が想定と異なります")
+        self.assertEqual(errors, 0, "エラー件数が想定と異なります")
+        self.assertEqual(progress_log, [1, 2, 3], "進捗の通知が想定と異なります")
+        self.assertEqual([stage.count for stage in pipeline.stages], [3, 3, 3], "各段の処理件数が想定と異なります")
+        
+        for i in range(1, 4):
+            with open(os.path.join(sequential_folder, f"{i}.png"), 'rb') as f:
+                expected = f.read()
+            with open(os.path.join(self.output_folder, f"{i}.png"), 'rb') as f:
+                self.assertEqual(f.read(), expected, f"{i}.png の内容が逐次処理と異なります")
+
+    def test_batch_process_report(self):
+        """計測レポートに段ごとの処理時間と失敗した行が記録されることをテスト"""
+        import io
+        import json
+        from batch_report import BatchReport
+        
+        data = {
+            'id': [1, 2, 3],
+            'name': ['テスト商品1', 'テスト商品2', 'テスト商品3'],
+            'price': [1000, 2000, 3000],
+            'image_file': ['test1.png', 'not_exist.png', 'test3.png']
+        }
+        csv_path = os.path.join(self.test_dir, "report_data.csv")
+        pd.DataFrame(data).to_csv(csv_path, index=False)
+        template = self.data_handler.load_template(self.template_path)
+        
+        events = io.StringIO()
+        report = BatchReport(events)
+        processed, errors = self.image_processor.batch_process(
+            self.data_handler.stream_csv(csv_path),
+            self.image_folder,
+            template,
+            self.output_folder,
+            report=report
+        )
+        self.assertEqual((processed, errors), (2, 1))
+        
+        report_path = os.path.join(self.test_dir, "report.json")
+        report.save(report_path)
+        with open(report_path, 'r', encoding='utf-8') as f:
+            result = json.load(f)
+        
+        self.assertEqual(result["summary"]["processed"], 2)
+        self.assertEqual(result["rows"]["count"], 2)
+        for stage in ("decode", "resize", "paste", "text", "encode", "write"):
+            self.assertEqual(result["stages"][stage]["count"], 2, f"{stage}の計測件数が想定と異なります")
+        self.assertGreater(result["bytes_read"], 0)
+        self.assertGreater(result["bytes_written"], 0)
+        self.assertEqual(len(result["slowest"]), 2)
+        self.assertEqual(result["failure_count"], 1)
+        self.assertEqual(result["failures"][0]["id"], "2")
+        
+        # キャッシュのヒット数・ミス数（テキストは描画した要素ごとに数える）
+        sprites = result["caches"]["text_sprites"]
+        self.assertGreater(sprites["hits"] + sprites["misses"], 0)
+        self.assertIn("fonts", result["caches"])
+        
+        # イベントはJSON Lines形式で書き出される
+        lines = [json.loads(line) for line in events.getvalue().splitlines()]
+        self.assertEqual(lines[0]["event"], "start")
+        self.assertEqual(lines[-1]["event"], "end")
+        self.assertEqual(sum(1 for line in lines if line["event"] == "row"), 3)
+
+    def test_batch_process_multiple_templates(self):
+        """1回のバッチで複数のテンプレートに描画し、商品画像のデコードが行ごとに1回だけかテスト"""
+        from unittest import mock
+        from PIL import Image
+        import image_processor
+        from batch_engine import RenderTarget
+        from batch_manifest import BatchManifest
+        from batch_pipeline import BatchPipeline
+        from image_encoder import ImageEncoder
+        
+        square = self.data_handler.load_template(self.template_path)
+        banner = dict(square, product_size=[40, 40], output={"format": "jpeg"})
+        
+        def targets():
+            result = []
+            for name, template in (("square", square), ("banner", banner)):
+                folder = os.path.join(self.output_folder, name)
+                os.makedirs(folder, exist_ok=True)
+                result.append(RenderTarget(name, template, ImageEncoder.from_template(template), folder,
+                                           BatchManifest(folder, template)))
+            return result
+        
+        with mock.patch.object(image_processor, "open_image", wraps=image_processor.open_image) as open_image:
+            processed, errors = self.image_processor.batch_process_targets(
+                self.data_handler.stream_csv(self.csv_path), self.image_folder, targets()
+            )
+        self.assertEqual((processed, errors), (3, 0))
+        self.assertEqual(open_image.call_count, 3, "商品画像がテンプレートごとにデコードされています")
+        
+        # テンプレートごとのフォルダに、それぞれの出力形式で保存される
+        for i in range(1, 4):
+            with Image.open(os.path.join(self.output_folder, "square", f"{i}.png")) as image:
+                self.assertEqual(image.size, (800, 800))
+            self.assertTrue(os.path.exists(os.path.join(self.output_folder, "banner", f"{i}.jpg")))
+        
+        # 片方のテンプレートだけ変更すると、そのテンプレートだけを描画し直す
+        banner["product_size"] = [60, 60]
+        run_targets = targets()
+        processed, errors = self.image_processor.batch_process_targets(
+            self.data_handler.stream_csv(self.csv_path), self.image_folder, run_targets, pipeline=BatchPipeline()
+        )
+        self.assertEqual(processed, 3)
+        self.assertEqual((run_targets[0].manifest.skipped, run_targets[1].manifest.skipped), (3, 0))
+        
+        # どちらも変更がなければ行ごと省略される
+        processed, errors = self.image_processor.batch_process_targets(
+            self.data_handler.stream_csv(self.csv_path), self.image_folder, targets(), workers=2
+        )
+        self.assertEqual((processed, errors), (0, 0))
+
+    def test_progress_protocol(self):
+        """進捗イベントの書き出し・読み取りと画面更新の間引きをテスト"""
+        import io
+        from batch_progress import emit_event, parse_event, FrameThrottle
+        
+        stream = io.StringIO()
+        emit_event({"event": "progress", "current": 1, "total": 3}, stream)
+        self.assertEqual(parse_event(stream.getvalue()), {"event": "progress", "current": 1, "total": 3})
+        
+        # 通常のログ行や不正なJSONはイベントとして扱わない
+        self.assertIsNone(parse_event("処理中... 1/3 完了\n"))
+        self.assertIsNone(parse_event("{invalid\n"))
+        
+        # 間隔内の更新は間引かれる
+        now = [0.0]
+        throttle = FrameThrottle(interval=0.1, clock=lambda: now[0])
+        self.assertTrue(throttle.ready())
+        now[0] = 0.05
+        self.assertFalse(throttle.ready())
+        now[0] = 0.15
+        self.assertTrue(throttle.ready())
+    
+    def test_batch_startup_imports(self):
+        """バッチ処理の起動ではGUI（flet・ui）とpandasを読み込まないことをテスト"""
+        import sys
+        import subprocess
+        
+        code = (
+            "import sys, main; "
+            "print(','.join(sorted(m for m in ('flet', 'pandas', 'ui', 'ui.main_view') if m in sys.modules)))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=60
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "")
+
 if __name__ == "__main__":
     unittest.main() 
\ No newline at end of file
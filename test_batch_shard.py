@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+import unittest
+import os
+import sys
+import json
+import shutil
+import tempfile
+import subprocess
+from PIL import Image
+from batch_shard import Shard, merge_reports
+
+class TestBatchShard(unittest.TestCase):
+    """複数のマシンでの分担処理（シャード）の単体テスト"""
+
+    def setUp(self):
+        """テスト用のCSV・画像・テンプレートを準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.image_folder = os.path.join(self.test_dir, "images")
+        self.output_folder = os.path.join(self.test_dir, "output")
+        os.makedirs(self.image_folder)
+        Image.new('RGBA', (20, 20), (255, 0, 0, 255)).save(os.path.join(self.image_folder, "product.png"))
+
+        self.rows = [{"id": f"item-{i}", "image_file": "product.png"} for i in range(30)]
+        self.csv_path = os.path.join(self.test_dir, "products.csv")
+        with open(self.csv_path, 'w', encoding='utf-8') as f:
+            f.write("id,image_file\n")
+            for row in self.rows:
+                f.write(f"{row['id']},{row['image_file']}\n")
+
+        self.template_path = os.path.join(self.test_dir, "template.json")
+        with open(self.template_path, 'w', encoding='utf-8') as f:
+            json.dump({"name": "shard", "background": "", "product_position": [0, 0], "product_size": [20, 20]}, f)
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir)
+
+    def owned(self, shard):
+        return [row["id"] for row_number, row in enumerate(self.rows) if shard.owns(row_number, row)]
+
+    def test_partition(self):
+        """各行がちょうど1つのシャードに割り当てられ、割り当てが毎回同じかテスト"""
+        for mode in ("hash", "range"):
+            shards = [Shard(index, 4, mode, total_rows=len(self.rows)) for index in range(1, 5)]
+            owned = [self.owned(shard) for shard in shards]
+            self.assertEqual(sorted(sum(owned, [])), sorted(row["id"] for row in self.rows))
+            self.assertTrue(all(owned), mode)
+            self.assertEqual(owned, [self.owned(Shard(index, 4, mode, len(self.rows))) for index in range(1, 5)])
+
+        # rangeは連続した行
+        self.assertEqual(self.owned(Shard(1, 3, "range", len(self.rows))), [f"item-{i}" for i in range(10)])
+
+    def test_parse(self):
+        """K/Nの指定を解析し、不正な指定はエラーにするかテスト"""
+        shard = Shard.parse("2/4")
+        self.assertEqual((shard.index, shard.count, shard.label), (2, 4, "shard-2-of-4"))
+        self.assertEqual(shard.filename(".manifest.json"), ".manifest.shard-2-of-4.json")
+        for text in ("0/4", "5/4", "1", "a/b"):
+            with self.assertRaises(ValueError):
+                Shard.parse(text)
+
+    def test_merge_reports(self):
+        """レポートを結合し、抜けと重複を検出するかテスト"""
+        def report(index, ids, processed):
+            return {
+                "summary": {"processed": processed, "errors": 0, "skipped": 0, "elapsed": float(index)},
+                "rows": {"count": processed, "total": 1.0, "max": 0.5},
+                "caches": {"fonts": {"hits": 1, "misses": 1}},
+                "slowest": [{"id": ids[0], "seconds": 0.1 * index}],
+                "shard": {"index": index, "count": 3, "mode": "hash", "ids": ids}
+            }
+
+        merged = merge_reports([report(1, ["a", "b"], 2), report(3, ["b", "c"], 2)], expected_ids=["a", "b", "c", "d"])
+        self.assertEqual(merged["summary"]["processed"], 4)
+        self.assertEqual(merged["summary"]["elapsed"], 3.0)
+        self.assertEqual(merged["caches"]["fonts"], {"hits": 2, "misses": 2})
+        self.assertEqual(merged["slowest"][0]["id"], "b")
+        self.assertEqual(merged["shards"]["missing_shards"], [2])
+        self.assertEqual(merged["shards"]["missing_ids"], ["d"])
+        self.assertEqual(merged["shards"]["duplicate_ids"], ["b"])
+
+        with self.assertRaises(ValueError):
+            merge_reports([report(1, ["a"], 1), dict(report(2, ["b"], 1), shard={"index": 2, "count": 4, "mode": "hash", "ids": []})])
+
+    def run_main(self, *args):
+        main_script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+        return subprocess.run([sys.executable, main_script, *args], capture_output=True, text=True, timeout=120)
+
+    def test_local_shards(self):
+        """1台で複数のシャードのプロセスを動かし、レポートを結合できるかテスト"""
+        count = 3
+        processes = [
+            subprocess.Popen(
+                [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py"),
+                 "--batch", "--csv", self.csv_path, "--images", self.image_folder, "--output", self.output_folder,
+                 "--template", self.template_path, "--incremental", "--shard", f"{index}/{count}"],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+            )
+            for index in range(1, count + 1)
+        ]
+        for process in processes:
+            stdout, stderr = process.communicate(timeout=120)
+            self.assertEqual(process.returncode, 0, stdout + stderr)
+
+        for row in self.rows:
+            self.assertTrue(os.path.exists(os.path.join(self.output_folder, f"{row['id']}.png")))
+        for index in range(1, count + 1):
+            self.assertTrue(os.path.exists(os.path.join(self.output_folder, f".manifest.shard-{index}-of-{count}.json")))
+            self.assertTrue(os.path.exists(os.path.join(self.output_folder, f"report.shard-{index}-of-{count}.json")))
+
+        merged_path = os.path.join(self.test_dir, "merged.json")
+        result = self.run_main("--merge-reports", self.output_folder, "--csv", self.csv_path, "--report", merged_path)
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        with open(merged_path, 'r', encoding='utf-8') as f:
+            merged = json.load(f)
+        self.assertEqual(merged["summary"]["processed"], len(self.rows))
+        self.assertEqual(merged["shards"]["rows"], len(self.rows))
+
+        # 1つのシャードだけ再実行しても、他のシャードの出力は削除されない
+        result = self.run_main("--batch", "--csv", self.csv_path, "--images", self.image_folder, "--output", self.output_folder,
+                               "--template", self.template_path, "--incremental", "--shard", f"1/{count}")
+        self.assertEqual(result.returncode, 0, result.stdout + result.stderr)
+        self.assertEqual(len([name for name in os.listdir(self.output_folder) if name.endswith(".png")]), len(self.rows))
+
+        # シャードが欠けていれば抜けとして報告する
+        os.remove(os.path.join(self.output_folder, f"report.shard-2-of-{count}.json"))
+        result = self.run_main("--merge-reports", self.output_folder, "--csv", self.csv_path)
+        self.assertEqual(result.returncode, 1)
+        self.assertIn("レポートのないシャード", result.stdout)
+
+if __name__ == "__main__":
+    unittest.main()
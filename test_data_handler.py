@@ -99,6 +99,26 @@ class TestDataHandler(unittest.TestCase):
         self.assertIsNotNone(result, "テンプレート読み込みエラー時にデフォルトテンプレートが返されていません")
         self.assertIn("name", result, "デフォルトテンプレートに'name'キーがありません")
     
+    def test_load_template_invalid(self):
+        """内容が不正なテンプレートは問題のある項目をすべて表示してNoneを返すかテスト"""
+        import io
+        from contextlib import redirect_stdout
+        
+        template = self.data_handler.create_default_template()
+        template["product_position"] = "中央"
+        template["text_elements"][0]["font_size"] = 0
+        self.data_handler.save_template(template, self.template_path)
+        
+        output = io.StringIO()
+        with redirect_stdout(output):
+            result = self.data_handler.load_template(self.template_path)
+        self.assertIsNone(result, "不正なテンプレートが読み込まれています")
+        self.assertIn("product_position", output.getvalue())
+        self.assertIn("text_elements[0].font_size", output.getvalue())
+        
+        # 編集用には検証せずに辞書として読み込める
+        self.assertEqual(self.data_handler.load_template_data(self.template_path)["product_position"], "中央")
+    
     def test_save_template_invalid_path(self):
         """無効なパスへのテンプレート保存をテスト"""
         # デフォルトテンプレートを生成
@@ -111,5 +131,24 @@ class TestDataHandler(unittest.TestCase):
         # 結果を検証
         self.assertFalse(result, "無効なパスへの保存エラーハンドリングに失敗しました")
 
+    def test_stream_csv(self):
+        """CSVファイルを1行ずつ読み込めるかテスト"""
+        rows = self.data_handler.stream_csv(self.csv_path)
+        self.assertIsNotNone(rows, "CSVのストリーム読み込みに失敗しました")
+        
+        # ジェネレータとして1行ずつ取り出せること
+        first = next(rows)
+        self.assertEqual(first['name'], 'テスト商品1', "データ内容が一致しません")
+        self.assertEqual(list(first.keys()), ['id', 'name', 'price', 'image_file'], "列名が一致しません")
+        self.assertEqual(len(list(rows)), 2, "残りの行数が一致しません")
+        
+        # 行数のカウント
+        self.assertEqual(self.data_handler.count_csv_rows(self.csv_path), 3, "行数が一致しません")
+    
+    def test_stream_csv_not_exist(self):
+        """存在しないCSVファイルのストリーム読み込みをテスト"""
+        rows = self.data_handler.stream_csv(os.path.join(self.test_dir, "not_exist.csv"))
+        self.assertIsNone(rows, "存在しないCSVファイルのロードエラーハンドリングに失敗しました")
+
 if __name__ == "__main__":
     unittest.main() 
\ No newline at end of file
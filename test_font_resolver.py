@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+import unittest
+import io
+import os
+import glob
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+from font_resolver import FontResolver, default_font_dirs
+
+def find_system_font():
+    """テストに使えるTrueTypeフォントを探す（見つからなければNone）"""
+    for font_dir in default_font_dirs():
+        fonts = glob.glob(os.path.join(font_dir, "**", "*.ttf"), recursive=True)
+        if fonts:
+            return fonts[0]
+    return None
+
+class TestFontResolver(unittest.TestCase):
+    """フォントの解決とキャッシュの単体テスト"""
+    
+    def setUp(self):
+        """テスト用のフォントフォルダを準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.system_font = find_system_font()
+        if self.system_font:
+            shutil.copy(self.system_font, os.path.join(self.test_dir, "TestFont.ttf"))
+    
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir)
+    
+    def test_resolve_from_font_dir(self):
+        """指定フォルダのフォントを拡張子や大文字小文字の違いを許して解決できるかテスト"""
+        if not self.system_font:
+            self.skipTest("TrueTypeフォントが見つかりません")
+        resolver = FontResolver([self.test_dir], use_fontconfig=False)
+        expected = os.path.join(self.test_dir, "TestFont.ttf")
+        self.assertEqual(resolver.resolve("TestFont.ttf"), expected)
+        self.assertEqual(resolver.resolve("testfont"), expected)
+        
+        # サイズごとにフォントが読み込まれ、同じ組み合わせはキャッシュから返る
+        small = resolver.get_font("TestFont.ttf", 12)
+        large = resolver.get_font("TestFont.ttf", 24)
+        self.assertEqual((small.size, large.size), (12, 24))
+        self.assertIs(resolver.get_font("TestFont.ttf", 12), small)
+        self.assertEqual((resolver.hits, resolver.misses), (1, 2))
+        self.assertEqual(resolver.fallbacks, [])
+    
+    def test_lru_bounded(self):
+        """保持するフォントの件数に上限があるかテスト"""
+        resolver = FontResolver([self.test_dir], max_faces=2, use_fontconfig=False, report_fallbacks=False)
+        for size in (10, 11, 12):
+            resolver.get_font("TestFont.ttf", size)
+        self.assertEqual(len(resolver._faces), 2, "上限を超えてフォントを保持しています")
+        self.assertNotIn(("TestFont.ttf", 10), resolver._faces, "最も古いフォントが破棄されていません")
+    
+    def test_fallback_reported_once(self):
+        """見つからないフォントは既定のフォントで代用し、警告はバッチごとに1回だけかテスト"""
+        resolver = FontResolver([self.test_dir], use_fontconfig=False)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertIsNotNone(resolver.get_font("no-such-font.ttf", 12))
+            resolver.get_font("no-such-font.ttf", 14)
+        self.assertEqual(output.getvalue().count("no-such-font.ttf"), 1, "警告が複数回表示されています")
+        self.assertEqual(resolver.fallbacks, ["no-such-font.ttf"])
+        
+        # 次のバッチでは改めて1回だけ警告する（読み込み済みのサイズでも警告し、件数はバッチごとに数える）
+        resolver.begin_batch()
+        self.assertEqual(resolver.fallbacks, [])
+        output = io.StringIO()
+        with redirect_stdout(output):
+            resolver.get_font("no-such-font.ttf", 12)
+            resolver.get_font("no-such-font.ttf", 16)
+        self.assertEqual(output.getvalue().count("no-such-font.ttf"), 1)
+        self.assertEqual(resolver.fallbacks, ["no-such-font.ttf"])
+        self.assertEqual((resolver.batch_hits, resolver.batch_misses), (1, 1))
+        self.assertEqual((resolver.hits, resolver.misses), (1, 3))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+import unittest
+import os
+import shutil
+import tempfile
+from unittest import mock
+from PIL import Image
+from image_index import ImageIndex
+from image_processor import ImageProcessor
+from template_model import Template
+
+class TestImageIndex(unittest.TestCase):
+    """商品画像フォルダの索引の単体テスト"""
+
+    def setUp(self):
+        """テスト用の画像フォルダを準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.image_folder = os.path.join(self.test_dir, "images")
+        os.makedirs(os.path.join(self.image_folder, "sub", "deep"))
+        for relative in ["abc.JPG", "item.webp", "item.png", "42.jpeg",
+                         os.path.join("sub", "nested.png"), os.path.join("sub", "deep", "nested.jpg")]:
+            Image.new('RGBA', (20, 20), (255, 0, 0, 255)).save(os.path.join(self.image_folder, relative), "PNG")
+        open(os.path.join(self.image_folder, "notes.txt"), 'w').close()
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir)
+
+    def path(self, *parts):
+        return os.path.join(self.image_folder, *parts)
+
+    def test_find(self):
+        """大文字小文字・拡張子の違いを許容し、image_fileが空ならIDで探すかテスト"""
+        index = ImageIndex(self.image_folder)
+        self.assertEqual(index.find("abc.JPG"), self.path("abc.JPG"))
+        self.assertEqual(index.find("ABC.jpg"), self.path("abc.JPG"))
+        # 拡張子違いは拡張子の優先順（pngが先）で選ぶ
+        self.assertEqual(index.find("Item.jpg"), self.path("item.png"))
+        self.assertEqual(index.find("item"), self.path("item.png"))
+        self.assertEqual(index.find("", 42), self.path("42.jpeg"))
+        self.assertEqual(index.find(float("nan"), "42"), self.path("42.jpeg"))
+        self.assertIsNone(index.find("missing.png"))
+        self.assertIsNone(index.find("", None))
+
+    def test_recursive(self):
+        """サブフォルダの画像をパスやファイル名で探せ、浅いフォルダを優先するかテスト"""
+        index = ImageIndex(self.image_folder, recursive=True)
+        self.assertEqual(index.find("sub/nested.png"), self.path("sub", "nested.png"))
+        self.assertEqual(index.find("SUB\\Deep\\nested.JPG"), self.path("sub", "deep", "nested.jpg"))
+        self.assertEqual(index.find("nested.jpg"), self.path("sub", "deep", "nested.jpg"))
+        self.assertEqual(index.find("nested.gif"), self.path("sub", "nested.png"))
+
+    def test_relative_path(self):
+        """索引にないサブフォルダの画像や./で始まるパスを探し、フォルダの外は探さないかテスト"""
+        for recursive in (False, True):
+            index = ImageIndex(self.image_folder, recursive=recursive)
+            self.assertEqual(index.find("sub/nested.png"), self.path("sub", "nested.png"))
+            self.assertEqual(index.find("./abc.JPG"), self.path("abc.JPG"))
+            self.assertEqual(index.find("./sub/../item.png"), self.path("item.png"))
+
+        outside = os.path.join(self.test_dir, "outside.png")
+        open(outside, 'wb').close()
+        index = ImageIndex(self.image_folder)
+        self.assertIsNone(index.find("../outside.png", allow_outside=False))
+        self.assertIsNone(index.find(outside, allow_outside=False))
+        self.assertEqual(index.find(outside), outside)
+        if hasattr(os, "symlink"):
+            os.symlink(outside, self.path("link.png"))
+            self.assertIsNone(ImageIndex(self.image_folder).find("./link.png", allow_outside=False))
+
+    def test_missing(self):
+        """見つからない商品画像を描画前にまとめて取得できるかテスト"""
+        index = ImageIndex(self.image_folder)
+        rows = enumerate([
+            {"id": "1", "image_file": "ABC.jpg"},
+            {"id": "2", "image_file": "none.png"},
+            {"id": "42", "image_file": ""},
+            {"id": "3", "image_file": ""}
+        ])
+        self.assertEqual(index.missing(rows), [("2", "none.png"), ("3", "")])
+
+    def test_batch_uses_index(self):
+        """バッチ処理が行ごとにファイルの存在を確認せず、索引から商品画像を探すかテスト"""
+        output_folder = os.path.join(self.test_dir, "output")
+        template = Template.from_dict({
+            "name": "index",
+            "background": "",
+            "product_position": [0, 0],
+            "product_size": [20, 20]
+        })
+        rows = [
+            {"id": "1", "image_file": "ABC.jpg"},
+            {"id": "42", "image_file": ""},
+            {"id": "3", "image_file": "none.png"}
+        ]
+        with mock.patch("os.path.exists", wraps=os.path.exists) as exists:
+            processed, errors = ImageProcessor().batch_process(rows, self.image_folder, template, output_folder)
+
+        self.assertEqual((processed, errors), (2, 1))
+        self.assertTrue(os.path.exists(os.path.join(output_folder, "1.png")))
+        self.assertTrue(os.path.exists(os.path.join(output_folder, "42.png")))
+        self.assertFalse(any(self.image_folder in str(call.args[0]) for call in exists.call_args_list))
+
+if __name__ == "__main__":
+    unittest.main()
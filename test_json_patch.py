@@ -2,6 +2,7 @@ import unittest
 import json
 import sys
 import os
+import types
 
 # テスト対象のモジュールをインポートできるようにパスを追加
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
@@ -46,5 +47,39 @@ class TestJSONPatch(unittest.TestCase):
         self.assertEqual(result, [])
 
 
+class TestFletPatch(unittest.TestCase):
+    """Fletのイベント受信モジュールだけをパッチするテスト"""
+
+    def setUp(self):
+        # Fletのイベント受信モジュールの代わり
+        self.module = types.ModuleType("fake_flet_socket_server")
+        self.module.json = json
+        sys.modules[self.module.__name__] = self.module
+
+    def tearDown(self):
+        del sys.modules[self.module.__name__]
+        json.loads = original_loads
+
+    def test_scoped_to_module(self):
+        """パッチしたモジュールの中だけ不正なJSONを許容し、グローバルなjson.loadsは変えない"""
+        from json_patch import apply_flet_patch
+        patched = apply_flet_patch([self.module.__name__, "missing_flet_module"])
+
+        self.assertEqual(patched, [self.module.__name__])
+        self.assertIs(json.loads, original_loads)
+        self.assertEqual(self.module.json.loads("{invalid"), [])
+        self.assertEqual(self.module.json.loads('{"action": "update"}'), {"action": "update"})
+        # loads以外は本物のjsonモジュール
+        self.assertIs(self.module.json.dumps, json.dumps)
+        with self.assertRaises(json.JSONDecodeError):
+            json.loads("{invalid")
+
+    def test_apply_twice(self):
+        """2回適用しても二重にはパッチしない"""
+        from json_patch import apply_flet_patch
+        self.assertEqual(apply_flet_patch([self.module.__name__]), [self.module.__name__])
+        self.assertEqual(apply_flet_patch([self.module.__name__]), [])
+
+
 if __name__ == "__main__":
     unittest.main() 
\ No newline at end of file
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import unittest
+import os
+import random
+import shutil
+import tempfile
+import importlib.util
+from unittest import mock
+from PIL import Image, ImageChops
+from layer_compositor import flatten_layers, check_compositor
+from image_processor import ImageProcessor
+
+HAS_NUMPY = importlib.util.find_spec("numpy") is not None
+
+def random_layer(rng, max_size=60):
+    """半透明の画素を含むランダムなRGBA画像"""
+    width, height = rng.randint(1, max_size), rng.randint(1, max_size)
+    data = bytes(rng.randrange(256) for _ in range(width * height * 4))
+    return Image.frombytes('RGBA', (width, height), data)
+
+def max_difference(first, second):
+    """各チャンネルの差の最大値"""
+    return max(high for _, high in ImageChops.difference(first, second).getextrema())
+
+class TestLayerCompositor(unittest.TestCase):
+    """固定レイヤーの合成方法（PillowとNumPy）の単体テスト"""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.canvas_size = (120, 90)
+        self.background = Image.new('RGBA', self.canvas_size, (30, 120, 200, 255))
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def flatten(self, layers, compositor):
+        return Image.alpha_composite(self.background, flatten_layers(self.canvas_size, layers, compositor))
+
+    def test_pil_matches_full_canvas(self):
+        """描画範囲だけを重ねても、キャンバス全体の大きさのレイヤーを重ねた場合と同じ結果になるかテスト"""
+        rng = random.Random(2)
+        layers = [(random_layer(rng, 1).resize(self.canvas_size), (0, 0))]
+        layers += [(random_layer(rng), (rng.randint(-70, 130), rng.randint(-70, 100))) for _ in range(20)]
+
+        first_layer = layers[0][0].tobytes()
+        expected = None
+        for image, position in layers:
+            layer = Image.new('RGBA', self.canvas_size, (0, 0, 0, 0))
+            layer.paste(image, position)
+            expected = layer if expected is None else Image.alpha_composite(expected, layer)
+        self.assertEqual(flatten_layers(self.canvas_size, layers, "pil").tobytes(), expected.tobytes())
+        # 先頭のレイヤー（アセットキャッシュの画像）は書き換えない
+        self.assertEqual(layers[0][0].tobytes(), first_layer)
+
+    @unittest.skipUnless(HAS_NUMPY, "NumPyがインストールされていません")
+    def test_matches_pil(self):
+        """はみ出すものを含む多数のレイヤーを重ねても、Pillowとの差が許容範囲に収まるかテスト"""
+        rng = random.Random(0)
+        for count in (1, 10, 50):
+            layers = [(random_layer(rng), (rng.randint(-30, 110), rng.randint(-30, 80))) for _ in range(count)]
+            # キャンバス全体の大きさのレイヤー（固定テキスト）も混ぜる
+            layers.insert(0, (random_layer(rng, 1).resize(self.canvas_size), (0, 0)))
+            self.assertLessEqual(max_difference(self.flatten(layers, "pil"), self.flatten(layers, "numpy")), 2, count)
+
+    @unittest.skipUnless(HAS_NUMPY, "NumPyがインストールされていません")
+    def test_opaque_layers_are_exact(self):
+        """不透明なレイヤーと完全に透明な画素はPillowと同じ結果になるかテスト"""
+        opaque = Image.new('RGBA', (30, 20), (255, 0, 0, 255))
+        transparent = Image.new('RGBA', (40, 40), (0, 255, 0, 0))
+        layers = [(opaque, (10, 10)), (transparent, (0, 0)), (opaque, (100, 80))]
+        self.assertEqual(max_difference(self.flatten(layers, "pil"), self.flatten(layers, "numpy")), 0)
+
+        # 描画範囲がなければ透明な画像
+        empty = flatten_layers(self.canvas_size, [(transparent, (0, 0)), (opaque, (500, 500))], "numpy")
+        self.assertEqual(empty.size, self.canvas_size)
+        self.assertIsNone(empty.getbbox())
+
+    @unittest.skipUnless(HAS_NUMPY, "NumPyがインストールされていません")
+    def test_template_compositor(self):
+        """装飾要素の多いテンプレートを両方の合成方法で描画し、差が許容範囲に収まるかテスト"""
+        rng = random.Random(1)
+        image_elements = []
+        for i in range(12):
+            path = os.path.join(self.test_dir, f"decoration{i}.png")
+            random_layer(rng, 80).save(path)
+            image_elements.append({"path": path, "position": [rng.randint(-20, 760), rng.randint(-20, 760)]})
+        product_path = os.path.join(self.test_dir, "product.png")
+        Image.new('RGBA', (50, 50), (0, 0, 0, 255)).save(product_path)
+        template = {
+            "name": "decorations",
+            "background": "",
+            "product_position": [100, 100],
+            "product_size": [300, 300],
+            "text_elements": [{"text": "${name}", "position": [10, 10], "font_size": 20}],
+            "image_elements": image_elements
+        }
+
+        images = [
+            ImageProcessor(compositor=compositor).apply_template(product_path, {"name": "商品"}, template)
+            for compositor in ("pil", "numpy")
+        ]
+        self.assertLessEqual(max_difference(*images), 2)
+
+    def test_check_compositor(self):
+        """未対応の合成方法やNumPyがない場合はValueErrorかテスト"""
+        check_compositor("pil")
+        with self.assertRaises(ValueError):
+            check_compositor("cairo")
+        with mock.patch("importlib.util.find_spec", return_value=None):
+            with self.assertRaises(ValueError):
+                ImageProcessor(compositor="numpy")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+import unittest
+import os
+import time
+import shutil
+import tempfile
+from PIL import Image
+from preview_renderer import PreviewRenderer, Debouncer
+
+class TestPreviewRenderer(unittest.TestCase):
+    """プレビュー描画の単体テスト"""
+    
+    def setUp(self):
+        """テスト用の画像とテンプレートを準備"""
+        self.test_dir = tempfile.mkdtemp()
+        
+        self.background_path = os.path.join(self.test_dir, "background.png")
+        Image.new('RGBA', (400, 300), (240, 240, 240, 255)).save(self.background_path)
+        self.decoration_path = os.path.join(self.test_dir, "decoration.png")
+        Image.new('RGBA', (50, 50), (255, 0, 0, 255)).save(self.decoration_path)
+        self.product_path = os.path.join(self.test_dir, "product.png")
+        Image.new('RGBA', (200, 200), (0, 0, 255, 255)).save(self.product_path)
+        
+        self.template = {
+            "name": "プレビュー用テンプレート",
+            "background": self.background_path,
+            "product_position": [100, 50],
+            "product_size": [100, 100],
+            "text_elements": [
+                {"text": "${name}", "position": [10, 10], "font": "arial.ttf", "font_size": 20, "color": [0, 0, 0]},
+                {"text": "送料無料", "position": [10, 250], "font": "arial.ttf", "font_size": 20, "color": [255, 0, 0]}
+            ],
+            "image_elements": [
+                {"path": self.decoration_path, "position": [300, 200], "size": [40, 40]}
+            ]
+        }
+        self.product_data = {"id": 1, "name": "テスト商品"}
+    
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir)
+    
+    def test_render_scaled(self):
+        """縮小サイズで描画されるかテスト"""
+        renderer = PreviewRenderer(scale=0.5)
+        image = renderer.render(self.template, self.product_data, self.product_path)
+        
+        self.assertEqual(image.size, (200, 150), "プレビューが縮小されていません")
+        # 商品画像は縮小した位置とサイズに配置される
+        self.assertEqual(image.getpixel((75, 50))[:3], (0, 0, 255), "商品画像の位置が一致しません")
+        # 装飾要素も縮小した位置に配置される
+        self.assertEqual(image.getpixel((160, 110))[:3], (255, 0, 0), "装飾要素の位置が一致しません")
+    
+    def test_render_reuses_cached_assets(self):
+        """再描画時にデコード済みの素材が再利用されるかテスト"""
+        renderer = PreviewRenderer()
+        renderer.render(self.template, self.product_data, self.product_path)
+        misses = renderer.assets.misses
+        
+        # 商品画像の位置だけを変更して再描画
+        self.template["product_position"] = [120, 60]
+        renderer.render(self.template, self.product_data, self.product_path)
+        self.assertEqual(renderer.assets.misses, misses, "変更のない素材が再デコードされています")
+        self.assertGreater(renderer.assets.hits, 0)
+        
+        # 商品画像が見つからない場合は仮画像で描画
+        image = renderer.render(self.template, self.product_data, os.path.join(self.test_dir, "none.png"))
+        self.assertEqual(image.size, (200, 150))
+    
+    def test_debouncer(self):
+        """連続した呼び出しが1回にまとめられるかテスト"""
+        calls = []
+        debounced = Debouncer(lambda: calls.append(1), delay=0.05)
+        for _ in range(5):
+            debounced()
+        time.sleep(0.2)
+        self.assertEqual(len(calls), 1, "呼び出しがまとめられていません")
+
+if __name__ == "__main__":
+    unittest.main()
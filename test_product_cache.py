@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+import unittest
+import os
+import time
+import shutil
+import tempfile
+import pandas as pd
+from PIL import Image
+from image_processor import ImageProcessor
+from data_handler import DataHandler
+from product_cache import ProductImageCache
+
+class TestProductImageCache(unittest.TestCase):
+    """リサイズ済み商品画像のキャッシュの単体テスト"""
+    
+    def setUp(self):
+        """テスト用の画像を準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.test_dir, "cache")
+        self.image_folder = os.path.join(self.test_dir, "images")
+        os.makedirs(self.image_folder)
+        self.source_path = os.path.join(self.image_folder, "product.png")
+        Image.new('RGBA', (400, 400), (0, 0, 255, 255)).save(self.source_path)
+    
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir)
+    
+    def test_get_put(self):
+        """保存した画像を取得でき、元画像が変わると別のキーになるかテスト"""
+        cache = ProductImageCache(self.cache_dir)
+        self.assertIsNone(cache.get(self.source_path, (100, 100), Image.LANCZOS))
+        
+        image = Image.new('RGBA', (100, 100), (0, 0, 255, 255))
+        cache.put(self.source_path, (100, 100), Image.LANCZOS, image)
+        cached = cache.get(self.source_path, (100, 100), Image.LANCZOS)
+        self.assertEqual((cached.mode, cached.size), ('RGBA', (100, 100)))
+        self.assertEqual(cached.getpixel((50, 50)), (0, 0, 255, 255))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        
+        # サイズやリサンプリング方法が違えば別の画像
+        self.assertIsNone(cache.get(self.source_path, (50, 50), Image.LANCZOS))
+        self.assertIsNone(cache.get(self.source_path, (100, 100), Image.BILINEAR))
+        
+        # 元画像を差し替えるとキャッシュは使われない
+        Image.new('RGBA', (400, 400), (255, 0, 0, 255)).save(self.source_path)
+        stat = os.stat(self.source_path)
+        os.utime(self.source_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000000000))
+        self.assertIsNone(cache.get(self.source_path, (100, 100), Image.LANCZOS))
+    
+    def test_concurrent_put(self):
+        """複数のスレッドが同じ画像を同時に保存しても、エラーや壊れたファイルにならないかテスト"""
+        import io
+        import threading
+        from contextlib import redirect_stdout
+
+        cache = ProductImageCache(self.cache_dir)
+        image = Image.new('RGBA', (300, 300), (0, 0, 255, 255))
+        output = io.StringIO()
+        with redirect_stdout(output):
+            threads = [
+                threading.Thread(target=lambda: [cache.put(self.source_path, (300, 300), Image.LANCZOS, image) for _ in range(5)])
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(output.getvalue(), "")
+        self.assertEqual(cache.get(self.source_path, (300, 300), Image.LANCZOS).size, (300, 300))
+        self.assertEqual([name for name in os.listdir(self.cache_dir) if name.endswith(".tmp")], [])
+    
+    def test_evict_least_recently_used(self):
+        """容量の上限を超えると最後に使われたのが古いものから削除されるかテスト"""
+        cache = ProductImageCache(self.cache_dir)
+        image = Image.effect_noise((64, 64), 50).convert('RGBA')
+        for size in ((10, 10), (20, 20), (30, 30)):
+            cache.put(self.source_path, size, Image.LANCZOS, image)
+        entry_size = cache.total_bytes // 3
+        
+        # 最初の画像を古く、2番目をさらに古くしてから、最初の画像を使う
+        for age, size in ((100, (10, 10)), (200, (20, 20)), (50, (30, 30))):
+            path = cache._path(cache.key(self.source_path, size, Image.LANCZOS))
+            past = time.time() - age
+            os.utime(path, (past, past))
+        cache.get(self.source_path, (10, 10), Image.LANCZOS)
+        
+        cache.max_bytes = entry_size * 3 - 1
+        cache.put(self.source_path, (40, 40), Image.LANCZOS, image)
+        self.assertIsNone(cache.get(self.source_path, (20, 20), Image.LANCZOS), "最も古い画像が削除されていません")
+        self.assertIsNotNone(cache.get(self.source_path, (10, 10), Image.LANCZOS), "最近使った画像が削除されています")
+        self.assertLessEqual(cache.total_bytes, cache.max_bytes)
+    
+    def test_batch_process_uses_cache(self):
+        """2回目のバッチ処理でキャッシュ済みの商品画像が使われるかテスト"""
+        csv_path = os.path.join(self.test_dir, "data.csv")
+        pd.DataFrame({'id': [1, 2], 'name': ['A', 'B'], 'image_file': ['product.png', 'product.png']}).to_csv(csv_path, index=False)
+        template = {"name": "test", "product_position": [10, 10], "product_size": [100, 100], "text_elements": [], "image_elements": []}
+        data_handler = DataHandler()
+        
+        processor = ImageProcessor(product_cache=ProductImageCache(self.cache_dir))
+        for _ in range(2):
+            processed, errors = processor.batch_process(
+                data_handler.stream_csv(csv_path), self.image_folder, template, os.path.join(self.test_dir, "output")
+            )
+            self.assertEqual((processed, errors), (2, 0))
+        
+        # 1回目の最初の行だけがキャッシュミス
+        self.assertEqual((processor.product_cache.hits, processor.product_cache.misses), (3, 1))
+        output = Image.open(os.path.join(self.test_dir, "output", "1.png"))
+        self.assertEqual(output.getpixel((50, 50))[:3], (0, 0, 255))
+
+if __name__ == "__main__":
+    unittest.main()
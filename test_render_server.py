@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+import unittest
+import os
+import io
+import json
+import contextlib
+import shutil
+import tempfile
+import threading
+from PIL import Image
+from render_server import RenderServer, RenderClient, JobQueue, Job, find_server, DONE, CANCELLED, QUEUED, TOKEN_HEADER
+from batch_journal import JOURNAL_FILENAME
+
+class TestRenderServer(unittest.TestCase):
+    """常駐レンダーサーバーの単体テスト"""
+
+    def setUp(self):
+        """テスト用のCSV・画像・テンプレートを準備し、サーバーを起動"""
+        self.test_dir = tempfile.mkdtemp()
+        self.image_folder = os.path.join(self.test_dir, "images")
+        self.output_folder = os.path.join(self.test_dir, "output")
+        os.makedirs(self.image_folder)
+        Image.new('RGBA', (20, 20), (255, 0, 0, 255)).save(os.path.join(self.image_folder, "product.png"))
+
+        self.rows = [{"id": f"item-{i}", "image_file": "product.png"} for i in range(10)]
+        self.csv_path = os.path.join(self.test_dir, "products.csv")
+        with open(self.csv_path, 'w', encoding='utf-8') as f:
+            f.write("id,image_file\n")
+            for row in self.rows:
+                f.write(f"{row['id']},{row['image_file']}\n")
+
+        self.template_path = os.path.join(self.test_dir, "template.json")
+        with open(self.template_path, 'w', encoding='utf-8') as f:
+            json.dump({"name": "server", "background": "", "product_position": [0, 0], "product_size": [20, 20]}, f)
+
+        self.state_path = os.path.join(self.test_dir, "render_server.json")
+        self.server = RenderServer(port=0, state_path=self.state_path)
+        self.server.start()
+        self.client = find_server(self.state_path)
+
+    def tearDown(self):
+        """サーバーを終了してクリーンアップ"""
+        self.server.stop()
+        shutil.rmtree(self.test_dir)
+
+    def params(self, **kwargs):
+        return dict({
+            "csv": self.csv_path,
+            "images": self.image_folder,
+            "output": self.output_folder,
+            "templates": [self.template_path]
+        }, **kwargs)
+
+    def test_queue_priority(self):
+        """優先度の高い順、同じなら投入順に取り出し、中止したジョブは飛ばすかテスト"""
+        queue = JobQueue()
+        jobs = [Job("1", {}, 0), Job("2", {}, 5), Job("3", {}, 0), Job("4", {}, 5)]
+        for job in jobs:
+            queue.put(job)
+        jobs[3].state = CANCELLED
+        self.assertEqual([queue.get().id for _ in range(3)], ["2", "1", "3"])
+        queue.close()
+        self.assertIsNone(queue.get())
+
+    def test_run_job(self):
+        """投入したジョブを処理し、進捗とログを取得できるかテスト"""
+        self.assertIsNotNone(self.client)
+        job = self.client.submit(self.params(incremental=True))
+        self.assertEqual(job["state"], QUEUED)
+
+        lines = []
+        status = self.client.wait(job["id"], lambda status, new_lines: lines.extend(new_lines), interval=0.05)
+        self.assertEqual(status["state"], DONE, lines)
+        self.assertEqual((status["processed"], status["errors"], status["total"]), (len(self.rows), 0, len(self.rows)))
+        self.assertTrue(any("バッチ処理完了" in line for line in lines))
+        for row in self.rows:
+            self.assertTrue(os.path.exists(os.path.join(self.output_folder, f"{row['id']}.png")))
+
+        # 2回目はサーバーに残っているフォントやテンプレートを使い、変更のない行を省略する
+        status = self.client.wait(self.client.submit(self.params(incremental=True))["id"], interval=0.05)
+        self.assertEqual((status["state"], status["processed"], status["skipped"]), (DONE, 0, len(self.rows)))
+        self.assertEqual(self.client.status()["jobs"], 2)
+
+    def test_cancel(self):
+        """待機中のジョブは処理せず、処理中のジョブは再開できる状態で止まるかテスト"""
+        started = threading.Event()
+        release = threading.Event()
+        original = self.server._execute
+
+        def blocking_execute(job, log):
+            if job.id == "1":
+                started.set()
+                release.wait(10)
+            return original(job, log)
+
+        self.server._execute = blocking_execute
+        first = self.client.submit(self.params())
+        second = self.client.submit(self.params())
+        self.assertTrue(started.wait(10))
+
+        # 待機中のジョブの中止
+        self.assertEqual(self.client.cancel(second["id"])["state"], CANCELLED)
+        # 処理中のジョブの中止（投入前に中止されるので出力は作られず、ジャーナルが残る）
+        self.client.cancel(first["id"])
+        release.set()
+        status = self.client.wait(first["id"], interval=0.05)
+        self.assertEqual(status["state"], CANCELLED)
+        self.assertTrue(os.path.exists(os.path.join(self.output_folder, JOURNAL_FILENAME)))
+        self.assertEqual(self.client.job(second["id"])["started"], None)
+
+        # 続きから再開できる
+        status = self.client.wait(self.client.submit(self.params(resume=True))["id"], interval=0.05)
+        self.assertEqual((status["state"], status["processed"]), (DONE, len(self.rows)))
+        self.assertFalse(os.path.exists(os.path.join(self.output_folder, JOURNAL_FILENAME)))
+
+    def test_rejects_unauthorized_requests(self):
+        """トークンのない要求・ブラウザからの要求・JSON以外のPOSTを拒否するかテスト"""
+        import urllib.error
+        import urllib.request
+
+        def post(path, headers):
+            body = json.dumps({"params": self.params()}).encode('utf-8')
+            request = urllib.request.Request(self.server.url + path, data=body, method="POST", headers=headers)
+            with self.assertRaises(urllib.error.HTTPError) as context:
+                urllib.request.urlopen(request, timeout=5)
+            return context.exception.code
+
+        token = {TOKEN_HEADER: self.server.token}
+        self.assertEqual(post("/jobs", {"Content-Type": "application/json"}), 401)
+        self.assertEqual(post("/jobs", {"Content-Type": "application/json", TOKEN_HEADER: "wrong"}), 401)
+        self.assertEqual(post("/jobs", dict(token, **{"Content-Type": "text/plain"})), 415)
+        self.assertEqual(post("/shutdown", dict(token, **{"Content-Type": "application/json", "Origin": "http://evil.example"})), 403)
+        with self.assertRaises(RuntimeError):
+            RenderClient(self.server.url).status()
+        self.assertEqual(self.client.status()["jobs"], 0)
+        self.assertFalse(os.path.exists(self.output_folder))
+
+        # トークンは本人だけが読める状態ファイルに記録される
+        with open(self.state_path, 'r', encoding='utf-8') as f:
+            self.assertEqual(json.load(f)["token"], self.server.token)
+        if os.name == "posix":
+            self.assertEqual(os.stat(self.state_path).st_mode & 0o777, 0o600)
+
+    def test_job_log_is_separate_from_stdout(self):
+        """ジョブの処理中に他のスレッドが標準出力に書いた内容はジョブのログに入らないかテスト"""
+        outside = io.StringIO()
+        lines = []
+
+        def on_update(status, new_lines):
+            lines.extend(new_lines)
+            print("ジョブの外の出力")
+
+        with contextlib.redirect_stdout(outside):
+            status = self.client.wait(self.client.submit(self.params())["id"], on_update, interval=0.01)
+        self.assertEqual(status["state"], DONE)
+        self.assertTrue(any("バッチ処理完了" in line for line in lines))
+        self.assertFalse(any("ジョブの外の出力" in line for line in lines))
+        self.assertNotIn("バッチ処理完了", outside.getvalue())
+
+    def test_invalid_job(self):
+        """必要な指定のないジョブは受け付けないかテスト"""
+        with self.assertRaises(RuntimeError):
+            self.client.submit({"csv": self.csv_path})
+
+    def test_find_server(self):
+        """サーバーが終了していれば見つからないかテスト"""
+        self.assertEqual(self.client.status()["url"], self.server.url)
+        self.server.stop()
+        self.assertFalse(os.path.exists(self.state_path))
+        self.assertIsNone(find_server(self.state_path))
+        self.assertIsNone(find_server(os.path.join(self.test_dir, "missing.json")))
+        # tearDownで再度stopしても問題ないよう、待ち受けのないサーバーに差し替える
+        self.server = RenderServer(port=0, state_path=None)
+
+if __name__ == "__main__":
+    unittest.main()
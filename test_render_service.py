@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+import unittest
+import io
+import os
+import json
+import time
+import shutil
+import tempfile
+from unittest import mock
+from PIL import Image
+from render_service import RenderService, ResponseCache, RenderedImage
+from render_server import RenderServer, RenderClient, TOKEN_HEADER
+
+class TestRenderService(unittest.TestCase):
+    """1枚ずつ画像を合成して返すAPIの単体テスト"""
+
+    def setUp(self):
+        """テスト用の商品画像とテンプレートを準備"""
+        self.test_dir = tempfile.mkdtemp()
+        self.templates_dir = os.path.join(self.test_dir, "templates")
+        self.image_folder = os.path.join(self.test_dir, "images")
+        os.makedirs(self.templates_dir)
+        os.makedirs(self.image_folder)
+        Image.new('RGBA', (20, 20), (255, 0, 0, 255)).save(os.path.join(self.image_folder, "product.png"))
+        self.write_template({"name": "card", "background": "", "product_position": [10, 10], "product_size": [20, 20]})
+        self.service = RenderService(self.templates_dir, self.image_folder)
+        self.fields = {"id": "1", "image_file": "product.png"}
+
+    def tearDown(self):
+        """テスト後のクリーンアップ"""
+        shutil.rmtree(self.test_dir)
+
+    def write_template(self, data, name="card"):
+        path = os.path.join(self.templates_dir, f"{name}.json")
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        return path
+
+    def test_render_bytes(self):
+        """テンプレートのIDと商品データからエンコード済みの画像を返すかテスト"""
+        rendered = self.service.render("card", self.fields)
+        self.assertEqual(rendered.content_type, "image/png")
+        with Image.open(io.BytesIO(rendered.data)) as image:
+            self.assertEqual(image.size, (800, 800))
+            self.assertEqual(image.convert('RGB').getpixel((15, 15)), (255, 0, 0))
+
+        rendered = self.service.render("card", self.fields, {"format": "jpeg", "quality": 70})
+        self.assertEqual(rendered.content_type, "image/jpeg")
+        self.assertEqual(rendered.data[:2], b"\xff\xd8")
+
+    def test_response_cache(self):
+        """同じ入力は描画せずにキャッシュから返し、入力が変われば描画し直すかテスト"""
+        first = self.service.render("card", self.fields)
+        with mock.patch.object(self.service.processor, "render_bytes", wraps=self.service.processor.render_bytes) as render_bytes:
+            self.assertIs(self.service.render("card", dict(self.fields)), first)
+            self.assertEqual(render_bytes.call_count, 0)
+
+            # ETagが一致すれば本体なし
+            self.assertIsNone(self.service.render("card", self.fields, if_none_match=first.etag).data)
+
+            # 商品データが変われば別のETag
+            self.assertNotEqual(self.service.render("card", dict(self.fields, name="A")).etag, first.etag)
+            self.assertEqual(render_bytes.call_count, 1)
+
+            # テンプレートを変更すればコンパイルし直す
+            path = self.write_template({"name": "card", "background": "", "product_position": [0, 0], "product_size": [20, 20]})
+            os.utime(path, ns=(time.time_ns() + 10 ** 9, time.time_ns() + 10 ** 9))
+            changed = self.service.render("card", self.fields)
+            self.assertNotEqual(changed.etag, first.etag)
+            self.assertEqual(render_bytes.call_count, 2)
+
+    def test_cache_limit(self):
+        """容量を超えたら最後に使われたのが古いものから捨てるかテスト"""
+        cache = ResponseCache(max_bytes=10)
+        for etag in ("a", "b", "c"):
+            cache.put(RenderedImage(etag, "image/png", b"1234"))
+            cache.get("a")
+        self.assertEqual(list(cache.entries), ["c", "a"])
+        self.assertEqual(cache.size, 8)
+        cache.put(RenderedImage("big", "image/png", b"x" * 11))
+        self.assertNotIn("big", cache.entries)
+
+    def test_not_found(self):
+        """テンプレートや商品画像が見つからない・フォルダの外を指す場合はLookupErrorかテスト"""
+        for template_id in ("missing", "../card", ".hidden", ""):
+            with self.assertRaises(LookupError):
+                self.service.render(template_id, self.fields)
+        with self.assertRaises(LookupError):
+            self.service.render("card", {"id": "2", "image_file": "missing.png"})
+
+        # 商品画像フォルダの外の画像は絶対パスでも相対パスでも使わない
+        secret = os.path.join(self.test_dir, "secret.png")
+        Image.new('RGBA', (20, 20)).save(secret)
+        for image_file in (secret, "../secret.png", os.path.join(self.image_folder, "..", "secret.png")):
+            with self.assertRaises(LookupError):
+                self.service.render("card", {"id": "2", "image_file": image_file})
+
+        # 後から追加された商品画像は読み直して見つける
+        self.service._scanned -= 10
+        Image.new('RGBA', (20, 20)).save(os.path.join(self.image_folder, "added.png"))
+        self.assertIsNotNone(self.service.render("card", {"id": "3", "image_file": "added.png"}).data)
+
+    def test_http_endpoint(self):
+        """レンダーサーバーのHTTP APIで画像を取得し、ETagで再検証できるかテスト"""
+        server = RenderServer(port=0, state_path=None, templates_dir=self.templates_dir, image_folder=self.image_folder)
+        server.start()
+        try:
+            client = RenderClient(server.url, server.token)
+            etag, data = client.render("card", self.fields, {"format": "webp"})
+            with Image.open(io.BytesIO(data)) as image:
+                self.assertEqual(image.format, "WEBP")
+            self.assertEqual(client.render("card", self.fields, {"format": "webp"}, etag=etag), (etag, None))
+
+            import urllib.request
+            request = urllib.request.Request(f"{server.url}/render/card?id=1&image_file=product.png&format=jpeg",
+                                             headers={TOKEN_HEADER: server.token})
+            with urllib.request.urlopen(request) as response:
+                self.assertEqual(response.headers["Content-Type"], "image/jpeg")
+                self.assertTrue(response.headers["ETag"])
+
+            with self.assertRaises(RuntimeError):
+                client.render("missing", self.fields)
+            self.assertEqual(client.status()["render_cache"]["entries"], 2)
+        finally:
+            server.stop()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import unittest
+import os
+import tempfile
+from PIL import Image, ImageDraw, ImageChops
+from image_processor import ImageProcessor
+from template_compiler import CompiledText, CompiledTextElement, TextSpriteCache, decode_image
+from template_model import TextElement
+
+class TestTemplateCompiler(unittest.TestCase):
+    """テンプレートのコンパイル処理の単体テスト"""
+    
+    def test_compiled_text_fields(self):
+        """テキストが参照する列名を抽出できるかテスト"""
+        compiled = CompiledText("¥${price}（${name}）")
+        self.assertEqual(compiled.fields, ["price", "name"], "参照する列名が一致しません")
+        
+        # プレースホルダを含まないテキスト
+        self.assertEqual(CompiledText("送料無料").fields, [], "固定テキストに列名が含まれています")
+    
+    def test_compiled_text_render(self):
+        """参照する列だけが置換されるかテスト"""
+        compiled = CompiledText("¥${price}（${name}）")
+        text, missing = compiled.render({"name": "テスト商品", "price": 1000, "unused": object()})
+        self.assertEqual(text, "¥1000（テスト商品）", "置換結果が一致しません")
+        self.assertEqual(missing, [], "存在する列が欠落扱いになっています")
+    
+    def test_compiled_text_missing_field(self):
+        """存在しない列を参照した場合に空文字で置換され、列名が報告されるかテスト"""
+        compiled = CompiledText("${name} ${foo}")
+        text, missing = compiled.render({"name": "テスト商品"})
+        self.assertEqual(text, "テスト商品 ", "置換結果が一致しません")
+        self.assertEqual(missing, ["foo"], "欠落した列名が報告されていません")
+
+    def test_text_sprite_cache(self):
+        """同じ文字列はマスクを使い回し、draw.textと同じ結果になるかテスト"""
+        processor = ImageProcessor()
+        element = CompiledTextElement(
+            TextElement("${brand}", position=(12, 8), font="arial.ttf", font_size=20, color=(200, 0, 0)),
+            processor.get_font
+        )
+        cache = TextSpriteCache(max_entries=2)
+        
+        expected = Image.new('RGBA', (200, 50), (0, 128, 0, 128))
+        ImageDraw.Draw(expected).text(element.position, "送料無料 Brand", font=element.font, fill=element.color)
+        for _ in range(3):
+            actual = Image.new('RGBA', (200, 50), (0, 128, 0, 128))
+            cache.draw(actual, element, "送料無料 Brand")
+            self.assertIsNone(ImageChops.difference(actual, expected).getbbox(), "描画結果がdraw.textと異なります")
+        self.assertEqual((cache.hits, cache.misses), (2, 1), "ヒット数・ミス数が想定と異なります")
+        
+        # 上限を超えると古いマスクから破棄される
+        cache.draw(actual, element, "A")
+        cache.draw(actual, element, "B")
+        self.assertEqual(len(cache.entries), 2)
+        self.assertFalse(cache.draw(actual, element, "送料無料 Brand"), "破棄されたマスクがヒットしています")
+        
+        # 空文字は何も描画しない
+        self.assertIsNone(cache.get("", element))
+
+    def test_translucent_text_color(self):
+        """半透明の色のテキストが、固定テキストでも可変テキストでも同じように下の画像と混ざるかテスト"""
+        processor = ImageProcessor()
+
+        def render(text):
+            template = {
+                "name": "translucent",
+                "background": "",
+                "product_position": [0, 0],
+                "product_size": [10, 10],
+                "text_elements": [{"text": text, "position": [10, 10], "font": "arial.ttf", "font_size": 30, "color": [255, 0, 0, 128]}],
+                "image_elements": []
+            }
+            return processor.compose(None, {"label": "SALE"}, processor.compile_template(template))
+
+        static = render("SALE")
+        variable = render("${label}")
+        self.assertLessEqual(max(high for _, high in ImageChops.difference(static, variable).getextrema()), 1,
+                             "固定テキストと可変テキストの見た目が異なります")
+
+        # 文字の部分は白い土台と混ざった色になり、土台の不透明度は保たれる
+        red, green, blue, alpha = static.getextrema()
+        self.assertEqual(alpha, (255, 255))
+        self.assertGreater(green[0], 100, "色のアルファが反映されていません")
+
+    def test_decode_image_reduced(self):
+        """大きな画像を縮小しながら読み込み、RGBAで目的のサイズになるかテスト"""
+        with tempfile.TemporaryDirectory() as test_dir:
+            jpeg_path = os.path.join(test_dir, "large.jpg")
+            Image.new('RGB', (2000, 1600), (0, 0, 255)).save(jpeg_path, quality=95)
+            stats = {}
+            image = decode_image(jpeg_path, (200, 200), Image.LANCZOS, stats)
+            self.assertEqual((image.mode, image.size), ('RGBA', (200, 200)))
+            self.assertGreater(image.getpixel((100, 100))[2], 250, "色が変わっています")
+            self.assertIn("decode", stats)
+            self.assertIn("resize", stats)
+            
+            # 透過のあるパレット画像は先にRGBAへ変換してから縮小する
+            png_path = os.path.join(test_dir, "palette.png")
+            palette = Image.new('RGBA', (400, 400), (0, 0, 0, 0))
+            palette.paste((255, 0, 0, 255), (0, 0, 200, 400))
+            palette.convert('P').save(png_path, transparency=0)
+            image = decode_image(png_path, (100, 100))
+            self.assertEqual((image.mode, image.size), ('RGBA', (100, 100)))
+            self.assertEqual(image.getpixel((10, 50))[3], 255)
+            self.assertEqual(image.getpixel((90, 50))[3], 0)
+
+if __name__ == "__main__":
+    unittest.main()
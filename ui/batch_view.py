@@ -4,9 +4,12 @@ import threading
 import time
 import subprocess
 import sys
+from collections import deque
 from template_manager import TemplateManager
 from data_handler import DataHandler
 from image_processor import ImageProcessor
+from batch_progress import FrameThrottle, parse_event
+from render_server import find_server, DONE
 
 def BatchView(page):
     """バッチ処理ビュー"""
@@ -224,80 +227,87 @@ def BatchView(page):
             
             # スクリプトのパスを取得
             script_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            batch_runner = os.path.join(script_dir, "batch_runner.py")
+            main_script = os.path.join(script_dir, "main.py")
             
-            # コマンドを構築
+            # コマンドを構築（進捗はJSON Lines形式で受け取る）
             cmd = [
                 sys.executable,
-                batch_runner,
-                csv_path,
-                image_folder,
-                output_folder,
-                template_path
+                main_script,
+                "--batch",
+                "--csv", csv_path,
+                "--images", image_folder,
+                "--output", output_folder,
+                "--template", template_path,
+                "--progress-format", "jsonl"
             ]
             
             # 進捗表示を更新
             progress_text.value = "バッチ処理を開始します..."
-            log_text.value += "バッチ処理を開始します...\n"
+            log_lines = deque(["バッチ処理を開始します..."], maxlen=20)
+            log_text.value = "\n".join(log_lines)
             page.update()
             
-            # サブプロセスとして実行
-            process = subprocess.Popen(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-                encoding='utf-8',
-                bufsize=1,
-                universal_newlines=True
-            )
-            
-            # 標準出力をリアルタイムで読み取り
-            total_lines = 0
             processed_items = 0
-            total_items = 0
+            throttle = FrameThrottle()
             
-            # 標準出力の読み取り
-            for line in process.stdout:
-                log_text.value += line
-                
-                # 進捗情報を解析
-                if "処理中..." in line and "/" in line:
-                    try:
-                        parts = line.split("処理中... ")[1].split("/")
-                        current = int(parts[0].strip())
-                        total = int(parts[1].split(" ")[0].strip())
-                        processed_items = current
-                        total_items = total
-                        progress_bar.value = current / total
-                        progress_text.value = f"処理中... {current}/{total}"
-                    except:
-                        pass
-                
-                # 処理完了情報
-                if "バッチ処理完了" in line:
+            def handle_line(line):
+                nonlocal processed_items
+                event = parse_event(line)
+                if event is None:
+                    log_lines.append(line.rstrip("\n"))
+                elif event["event"] == "progress" and event.get("total"):
+                    progress_bar.value = event["current"] / event["total"]
+                    progress_text.value = f"処理中... {event['current']}/{event['total']}"
+                elif event["event"] == "done":
+                    processed_items = event["processed"]
                     progress_bar.value = 1.0
                     progress_text.value = "処理完了"
                 
-                # 5行以上ある場合は古い行を削除
-                total_lines += 1
-                lines = log_text.value.split("\n")
-                if len(lines) > 20:
-                    log_text.value = "\n".join(lines[-20:])
-                
-                page.update()
+                # 画面更新は一定のフレームレートに間引く
+                if throttle.ready():
+                    log_text.value = "\n".join(log_lines)
+                    page.update()
             
-            # エラー出力の読み取り
-            error_output = process.stderr.read()
-            if error_output:
-                log_text.value += f"\nエラー出力:\n{error_output}"
-                progress_text.value = "エラーが発生しました"
-                page.update()
+            client = find_server()
+            if client is not None:
+                # レンダーサーバーが起動していればジョブを投入し、状態を取得して表示する
+                job = client.submit({
+                    "csv": csv_path,
+                    "images": image_folder,
+                    "output": output_folder,
+                    "templates": [template_path]
+                })
+                log_lines.append(f"レンダーサーバーにジョブ {job['id']} を投入しました")
+                
+                def on_update(status, lines):
+                    for line in lines:
+                        handle_line(line)
+                
+                status = client.wait(job["id"], on_update)
+                returncode = 0 if status["state"] == DONE else 1
+            else:
+                # サブプロセスとして実行（出力をバッファせずに逐次受け取る）
+                env = dict(os.environ, PYTHONUNBUFFERED="1", PYTHONIOENCODING="utf-8")
+                process = subprocess.Popen(
+                    cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    encoding='utf-8',
+                    bufsize=1,
+                    env=env
+                )
+                
+                # 標準出力の読み取り
+                for line in process.stdout:
+                    handle_line(line)
+                process.wait()
+                returncode = process.returncode
             
             # 処理完了
-            process.wait()
+            log_text.value = "\n".join(log_lines)
             
-            if process.returncode == 0:
+            if returncode == 0:
                 progress_bar.value = 1.0
                 if processed_items > 0:
                     progress_text.value = f"完了: {processed_items}件処理"
@@ -308,7 +318,7 @@ def BatchView(page):
                 page.snack_bar = ft.SnackBar(ft.Text("画像処理が完了しました"))
                 page.snack_bar.open = True
             else:
-                progress_text.value = f"エラーが発生しました (終了コード: {process.returncode})"
+                progress_text.value = f"エラーが発生しました (終了コード: {returncode})"
                 page.snack_bar = ft.SnackBar(ft.Text("処理中にエラーが発生しました"))
                 page.snack_bar.open = True
                 
@@ -1,7 +1,15 @@
 import flet as ft
 import os
 import json
+import threading
 from template_manager import TemplateManager
+from preview_renderer import PreviewRenderer, Debouncer
+from product_cache import ProductImageCache
+
+# プレビューに使うサンプルデータ（リポジトリ同梱のCSVと画像）
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_CSV_PATH = os.path.join(SCRIPT_DIR, "sample_data.csv")
+SAMPLE_IMAGE_DIR = os.path.join(SCRIPT_DIR, "storage", "data")
 
 def TemplateView(page):
     """テンプレート管理ビュー"""
@@ -11,6 +19,11 @@ def TemplateView(page):
     current_template = None
     current_template_path = None
     
+    # プレビュー描画（UIスレッドを止めないよう別スレッドで描画する）
+    preview_renderer = PreviewRenderer(product_cache=ProductImageCache())
+    preview_lock = threading.Lock()
+    preview_generation = 0
+    
     # ロード中表示用プログレスバー
     loading = ft.ProgressBar(width=100, visible=False)
     
@@ -78,6 +91,15 @@ def TemplateView(page):
         auto_scroll=True
     )
     
+    # プレビュー画像（縮小サイズで描画）
+    preview_image = ft.Image(
+        width=400,
+        height=400,
+        fit=ft.ImageFit.CONTAIN,
+        visible=False
+    )
+    preview_status = ft.Text("テンプレートを選択するとプレビューを表示します", size=12)
+    
     # テンプレート編集部分
     template_form = ft.Column(
         [
@@ -192,6 +214,17 @@ def TemplateView(page):
                 padding=ft.padding.only(bottom=20)
             ),
             
+            ft.Container(
+                content=ft.Column(
+                    [
+                        ft.Text("プレビュー", size=16, weight=ft.FontWeight.BOLD),
+                        preview_status,
+                        preview_image
+                    ]
+                ),
+                padding=ft.padding.only(bottom=20)
+            ),
+            
             ft.Container(
                 content=ft.Row(
                     [
@@ -209,6 +242,55 @@ def TemplateView(page):
         expand=True
     )
     
+    def load_sample_row():
+        """プレビュー用のサンプル行と商品画像パスを取得"""
+        rows = template_manager.data_handler.stream_csv(SAMPLE_CSV_PATH) if os.path.exists(SAMPLE_CSV_PATH) else None
+        row = next(rows, None) if rows is not None else None
+        if row is None:
+            return {"id": "sample", "name": "サンプル商品", "price": "1000"}, None
+        return row, os.path.join(SAMPLE_IMAGE_DIR, row.get("image_file", ""))
+    
+    sample_row, sample_image_path = load_sample_row()
+    
+    def build_preview_template():
+        """編集中のフォームの値を反映したテンプレートを作成（保存はしない）"""
+        template = dict(current_template)
+        template["background"] = bg_path.value
+        template["product_position"] = (int(product_pos_x.value or 0), int(product_pos_y.value or 0))
+        template["product_size"] = (int(product_size_w.value or 0), int(product_size_h.value or 0))
+        return template
+    
+    def render_preview():
+        """プレビューを描画（デバウンス後に別スレッドで呼ばれる）"""
+        nonlocal preview_generation
+        if not current_template:
+            return
+        
+        preview_generation += 1
+        generation = preview_generation
+        try:
+            template = build_preview_template()
+            with preview_lock:
+                image_base64 = preview_renderer.render_base64(template, sample_row, sample_image_path)
+        except Exception as e:
+            preview_status.value = f"プレビューを描画できません: {e}"
+            page.update()
+            return
+        
+        # 描画中にさらに編集されていれば古い結果は捨てる
+        if generation != preview_generation:
+            return
+        preview_image.src_base64 = image_base64
+        preview_image.visible = True
+        preview_status.value = f"サンプル: {sample_row.get('name', '')}（{int(preview_renderer.scale * 100)}%表示）"
+        page.update()
+    
+    schedule_preview = Debouncer(render_preview)
+    
+    # 位置・サイズ・背景の編集でプレビューを更新
+    for field in (bg_path, product_pos_x, product_pos_y, product_size_w, product_size_h):
+        field.on_change = lambda _: schedule_preview()
+    
     def load_template_list():
         """テンプレート一覧を読み込み"""
         template_list.controls.clear()
@@ -238,7 +320,8 @@ def TemplateView(page):
         loading.visible = True
         page.update()
         
-        template = template_manager.data_handler.load_template(template_info["path"])
+        # 編集するので検証済みのTemplateではなく辞書として読み込む
+        template = template_manager.data_handler.load_template_data(template_info["path"])
         current_template = template
         current_template_path = template_info["path"]
         
@@ -264,6 +347,9 @@ def TemplateView(page):
         # ローディング非表示
         loading.visible = False
         page.update()
+        
+        # プレビューを更新
+        schedule_preview()
     
     def update_text_elements_list():
         """テキスト要素リストを更新"""
@@ -331,6 +417,7 @@ def TemplateView(page):
             if e.files and len(e.files) > 0:
                 bg_path.value = e.files[0].path
                 page.update()
+                schedule_preview()
         
         file_picker = ft.FilePicker(on_result=pick_file_result)
         page.overlay.append(file_picker)
@@ -477,6 +564,7 @@ def TemplateView(page):
             
             current_template["text_elements"].append(new_element)
             update_text_elements_list()
+            schedule_preview()
             
             dlg.open = False
             page.update()
@@ -548,6 +636,7 @@ def TemplateView(page):
                 
                 current_template["image_elements"].append(new_element)
                 update_image_elements_list()
+                schedule_preview()
         
         file_picker = ft.FilePicker(on_result=pick_file_result)
         page.overlay.append(file_picker)